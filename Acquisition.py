@@ -0,0 +1,625 @@
+# Acquisition routines shared by RunExperiments_Setup1.py and RunExperiments_Setup2.py.
+#
+# Two acquisition modes are supported for the HP3457A multimeter.
+#   single: The multimeter runs with TARM AUTO and END ALWAYS. One reading is transferred per GPIB
+#           transaction. This is how all experiments were originally captured.
+#   burst:  The multimeter takes NRDGS readings for every TARM SGL and only asserts EOI after the last
+#           reading of the burst (END ON). The whole burst is transferred and decoded in one
+#           read_binary_values call, which removes most of the per-transaction GPIB overhead.
+#
+# The HP66311B source meter used by RunExperiments_Setup1.py also has a high speed digitizer.
+#   digitizer: The source meter takes a sweep of up to 4096 current readings with a sample interval of
+#              15.6us. Each sweep is fetched as one binary block with FETC:ARR:CURR?. The start time of
+#              every sweep is written to a timebase file so each reading can be placed in time.
+
+# Used to time the acquisition.
+import time
+# Used to decode raw readings.
+import struct
+# Used by the pipelined acquisition to run the reader and the writer at the same time.
+import threading
+import queue
+# Used to write the capture summary.
+import json
+# Used for the infinite half width before enough batches were captured.
+import math
+
+import Statistics
+import ResultsFormat
+import PostProcessing
+import Instrumentation
+import Instruments
+
+# Names of the acquisition modes accepted by the run scripts.
+ACQUISITION_MODES = ["single", "burst"]
+# Default number of readings taken per burst.
+DEFAULT_BURST_SIZE = 256
+# Number of points in a digitizer sweep. 4096 is the full buffer of the HP66311B.
+DIGITIZER_POINTS   = 4096
+# Time between two digitizer readings in seconds. 15.6us is the fastest the HP66311B supports.
+DIGITIZER_INTERVAL = 15.6E-6
+
+# Reads one SREAL reading from the multimeter. Returns a list so all read functions
+# can be used the same way by Acquire.
+def ReadSingle(multimeter):
+    return [multimeter.read_binary_values(datatype='f', is_big_endian=True, header_fmt='empty')[0]]
+
+# Configures the multimeter for burst acquisition. Must be called after the multimeter has been set up
+# for DC current and SREAL output.
+# arg 1 multimeter VISA resource
+# arg 2 number of readings taken every time the multimeter is triggered
+def ConfigureBurst(multimeter, burstSize):
+    # Hold the trigger arm while the multimeter is reconfigured.
+    multimeter.write("TARM HOLD")
+    # Take readings as fast as possible once armed.
+    multimeter.write("TRIG AUTO")
+    # Number of readings taken for every trigger arm event.
+    multimeter.write("NRDGS " + str(burstSize) + ",AUTO")
+    # Assert EOI only on the last reading of the burst so the whole burst is one GPIB transaction.
+    multimeter.write("END ON")
+
+# Triggers one burst and returns every reading of the burst as a list of floats.
+# The readings are 4 byte big endian floats (SREAL) that are decoded in one call.
+def ReadBurst(multimeter):
+    multimeter.write("TARM SGL")
+    return multimeter.read_binary_values(datatype='f', is_big_endian=True, header_fmt='empty')
+
+# Configures the HP66311B digitizer to measure current sweeps.
+# arg 1 source meter VISA resource
+# arg 2 number of points in a sweep
+# arg 3 time between two points in seconds
+def ConfigureDigitizer(powerSupply, points, interval):
+    # Digitize the output current.
+    powerSupply.write('SENS:FUNC "CURR"')
+    # Number of points and time between points of a sweep.
+    powerSupply.write('SENS:SWE:POIN ' + str(points))
+    powerSupply.write('SENS:SWE:TINT ' + str(interval))
+    # Start the sweep as soon as the acquisition is triggered, no pre trigger points.
+    powerSupply.write('SENS:SWE:OFFS:POIN 0')
+    # The sweep is started by a bus trigger sent by the script.
+    powerSupply.write('TRIG:ACQ:SOUR BUS')
+    # Return arrays as 4 byte big endian floats in an IEEE 488.2 block instead of ASCII.
+    powerSupply.write('FORM REAL')
+    powerSupply.write('FORM:BORD NORM')
+
+# Triggers one digitizer sweep and returns every current reading of the sweep as a list of floats.
+def ReadDigitizer(powerSupply):
+    # Arm the acquisition system and start the sweep.
+    powerSupply.write('INIT:NAME ACQ')
+    powerSupply.write('TRIG:ACQ')
+    # FETC waits until the sweep is complete and returns the whole array in one transaction.
+    return powerSupply.query_binary_values('FETC:ARR:CURR?', datatype='f', is_big_endian=True)
+
+# Adaptive capture length.
+# The mean current of an experiment is known to a given precision long before the fixed 30 seconds are
+# up for steady experiments, while bursty experiments need longer. The ConvergenceMonitor keeps the
+# running mean of the readings and a confidence interval of it, and tells the acquisition to stop once
+# the half width of the interval relative to the mean is below a tolerance.
+#
+# Readings next to each other are strongly correlated, so the confidence interval is computed from batch
+# means: the capture is cut into batches of batchTime seconds and the interval comes from the spread of
+# the batch means. Batches should be longer than the period of the experiment.
+
+# Default relative half width of the confidence interval at which the capture stops.
+DEFAULT_CI_TOLERANCE = 0.01
+# Default confidence level of the interval.
+DEFAULT_CONFIDENCE   = 0.95
+# Default length of a batch in seconds.
+DEFAULT_BATCH_TIME   = 1.0
+# Fewest batches the confidence interval is computed from.
+MIN_BATCHES          = 5
+
+# The monitor also keeps the statistics of the readings that PostProcess_SingleFile.py writes to the .stats
+# file, in milliamps, see Statistics.StreamStatistics, and a histogram of the readings. The .stats file is
+# written as soon as the capture ends so no post processing pass is needed, and a progress line with the
+# sample rate and running mean is printed while the capture runs.
+
+# Default seconds between two progress lines.
+DEFAULT_PROGRESS_TIME = 5.0
+# Readings buffered before they are added to the statistics, so single readings are added in bulk.
+STATS_FLUSH_READINGS  = 4096
+# Number of bins of the histogram written to the capture summary.
+HISTOGRAM_BINS        = 50
+
+# Running mean and confidence interval of an acquisition.
+# arg 1 True to stop the acquisition once the mean has converged, False to only record the precision
+# arg 2 relative half width of the confidence interval at which the mean has converged
+# arg 3 seconds captured at least, even if the mean converged earlier
+# arg 4 confidence level of the interval, 0 to 1
+# arg 5 length of a batch in seconds
+# arg 6 seconds between two progress lines, 0 for none
+# arg 7 function printing the progress lines
+class ConvergenceMonitor:
+    def __init__(self, adaptive=False, tolerance=DEFAULT_CI_TOLERANCE, minTime=0.0,
+                 confidence=DEFAULT_CONFIDENCE, batchTime=DEFAULT_BATCH_TIME,
+                 progressTime=DEFAULT_PROGRESS_TIME, printFunction=print):
+        self.adaptive   = adaptive
+        self.tolerance  = tolerance
+        self.minTime    = minTime
+        self.confidence = confidence
+        self.batchTime  = batchTime
+        self.quantile   = Statistics.ConfidenceQuantile(confidence)
+        self.stats      = Statistics.RunningStats()
+        self.batchMeans = Statistics.RunningStats()
+        self.batch      = Statistics.RunningStats()
+        self.batchStart = 0.0
+        self.converged  = False
+        # Statistics of the readings in milliamps and readings not yet added to them.
+        self.distribution = Statistics.StreamStatistics()
+        self.pending      = []
+        self.progressTime    = progressTime
+        self.printFunction   = printFunction
+        self.progressStart   = 0.0
+        self.progressSamples = 0
+
+    # Adds a block of readings received at blockEnd seconds after the start of the acquisition.
+    def Update(self, blockEnd, readings):
+        self.stats.Add(readings)
+        self.batch.Add(readings)
+        if blockEnd - self.batchStart >= self.batchTime and self.batch.count:
+            self.batchMeans.Add([self.batch.mean])
+            self.batch      = Statistics.RunningStats()
+            self.batchStart = blockEnd
+            self.converged  = self.RelativeHalfWidth() <= self.tolerance
+        self.pending.extend(readings)
+        if len(self.pending) >= STATS_FLUSH_READINGS:
+            self.FlushDistribution()
+        if self.progressTime > 0 and blockEnd - self.progressStart >= self.progressTime:
+            self.PrintProgress(blockEnd)
+
+    # Adds the buffered readings to the statistics.
+    def FlushDistribution(self):
+        if self.pending:
+            self.distribution.Add([reading * 1000 for reading in self.pending])
+            self.pending = []
+
+    # Prints the seconds captured, the sample rate since the last progress line and the running mean.
+    def PrintProgress(self, blockEnd):
+        rate = (self.stats.count - self.progressSamples) / (blockEnd - self.progressStart)
+        relative = self.RelativeHalfWidth()
+        self.printFunction("{0:.1f}".format(blockEnd) + " s: " + str(self.stats.count) + " samples, " +
+                           "{0:.1f}".format(rate) + " samples/s, mean " + "{0:.4f}".format(self.stats.mean * 1000) +
+                           " mA" + (" +/- " + "{0:.2f}".format(relative * 100) + " %" if math.isfinite(relative) else "") +
+                           ", min " + "{0:.4f}".format(self.stats.minimum * 1000) +
+                           " mA, max " + "{0:.4f}".format(self.stats.maximum * 1000) + " mA")
+        self.progressStart   = blockEnd
+        self.progressSamples = self.stats.count
+
+    # Statistics of every reading so far in milliamps, see Statistics.StreamStatistics.Summary.
+    def StatsSummary(self):
+        self.FlushDistribution()
+        return self.distribution.Summary()
+
+    # Half width of the confidence interval of the mean in amps, infinite until MIN_BATCHES batches are captured.
+    def HalfWidth(self):
+        if self.batchMeans.count < MIN_BATCHES:
+            return math.inf
+        return self.quantile * math.sqrt(self.batchMeans.SampleVariance() / self.batchMeans.count)
+
+    # Half width of the confidence interval relative to the mean.
+    def RelativeHalfWidth(self):
+        if self.stats.mean == 0.0:
+            return math.inf
+        return self.HalfWidth() / abs(self.stats.mean)
+
+    # True once the acquisition can stop, elapsed is the seconds acquired so far.
+    def Done(self, elapsed):
+        return self.adaptive and self.converged and elapsed >= self.minTime
+
+    # Returns a dictionary with the achieved precision of the capture.
+    def Summary(self, elapsed):
+        self.FlushDistribution()
+        halfWidth = self.HalfWidth()
+        relative  = self.RelativeHalfWidth()
+        return {"adaptive":          self.adaptive,
+                "converged":         self.converged,
+                "duration":          elapsed,
+                "samples":           self.stats.count,
+                "batches":           self.batchMeans.count,
+                "batchTime":         self.batchTime,
+                "mean":              self.stats.mean,
+                "confidence":        self.confidence,
+                "halfWidth":         halfWidth if math.isfinite(halfWidth) else None,
+                "relativeHalfWidth": relative if math.isfinite(relative) else None,
+                "tolerance":         self.tolerance,
+                "histogram":         self.distribution.Histogram(HISTOGRAM_BINS)}
+
+# Adds the capture length options shared by the run scripts to an argparse parser.
+def AddCaptureArguments(parser):
+    parser.add_argument("--adaptive", action="store_true",
+                        help="stop the capture once the mean current has converged")
+    parser.add_argument("--ci-tolerance", type=float, default=DEFAULT_CI_TOLERANCE,
+                        help="relative half width of the confidence interval of the mean at which the capture "
+                             "stops (default " + str(DEFAULT_CI_TOLERANCE) + ")")
+    parser.add_argument("--confidence", type=float, default=DEFAULT_CONFIDENCE,
+                        help="confidence level of the interval (default " + str(DEFAULT_CONFIDENCE) + ")")
+    parser.add_argument("--batch-seconds", type=float, default=DEFAULT_BATCH_TIME,
+                        help="length of the batches the interval is computed from, longer than the period of "
+                             "the experiment (default " + str(DEFAULT_BATCH_TIME) + ")")
+    parser.add_argument("--min-seconds", type=float, default=5.0,
+                        help="shortest adaptive capture in seconds (default 5)")
+    parser.add_argument("--max-seconds", type=float, default=30.0,
+                        help="longest capture in seconds, the capture length without --adaptive (default 30)")
+    parser.add_argument("--readback-seconds", type=float, default=0.0,
+                        help="seconds between two readbacks of the measured supply voltage and current during the "
+                             "capture, 0 for none (default 0)")
+    parser.add_argument("--progress-seconds", type=float, default=DEFAULT_PROGRESS_TIME,
+                        help="seconds between two progress lines during a capture, 0 for none (default " +
+                             str(DEFAULT_PROGRESS_TIME) + ")")
+
+# Checks the capture options once the command line is parsed, exits through parser.error if they conflict.
+# In digitizer mode the readings are fetched from the source meter, a readback would query the same
+# supply between two fetches and corrupt them.
+def CheckCaptureArguments(parser, args):
+    if args.readback_seconds > 0 and getattr(args, "acquisition", None) == "digitizer":
+        parser.error("--readback-seconds cannot be used with --acquisition digitizer, the readings already come "
+                     "from the supply")
+
+# Returns a new ConvergenceMonitor for one experiment from the options added by AddCaptureArguments.
+# printFunction prints the progress lines.
+def ConvergenceMonitorFromArgs(args, printFunction=print):
+    return ConvergenceMonitor(args.adaptive, args.ci_tolerance, args.min_seconds, args.confidence,
+                              args.batch_seconds, args.progress_seconds, printFunction)
+
+# Writes the summary of a ConvergenceMonitor to EXP#-VOLTAGE-FREQUENCY.capture next to the results.
+def WriteCaptureSummary(prefix, monitor, elapsed):
+    with open(prefix + ".capture", "w") as captureFile:
+        json.dump(monitor.Summary(elapsed), captureFile, indent=2)
+
+# Writes the statistics kept by a ConvergenceMonitor to the .stats file of the experiment, the same file
+# PostProcess_SingleFile.py writes. Must be called once the results are closed, so the .stats file is newer
+# than the results and post processing does not compute it again. Nothing is written without readings.
+def WriteCaptureStats(rootDir, experimentName, monitor):
+    summary = monitor.StatsSummary()
+    if summary["count"] > 0:
+        PostProcessing.WriteStats(summary, PostProcessing.OutputPath(rootDir, experimentName, "STATS"), experimentName)
+
+# Prints the achieved precision of an acquisition with printFunction.
+def PrintConvergence(monitor, elapsed, printFunction=print):
+    relative = monitor.RelativeHalfWidth()
+    printFunction("Mean " + "{0:.6e}".format(monitor.stats.mean) + " A, " +
+          ("+/- " + "{0:.2f}".format(relative * 100) + " %" if math.isfinite(relative) else "precision unknown") +
+          " at " + "{0:g}".format(monitor.confidence * 100) + " % confidence after " + "{0:.1f}".format(elapsed) +
+          " s" + (" (converged)" if monitor.converged else ""))
+
+# Supply readback.
+# The multimeter only measures current, the voltage of an experiment is the nominal supply voltage. With
+# --readback-seconds the output voltage and current the supply measures itself, MEAS:VOLT? and MEAS:CURR?,
+# are sampled during the capture and written to EXP#-VOLTAGE-FREQUENCY.supply, one line per readback with
+# the time in seconds since the start of the acquisition, the same time base as binary results, the voltage
+# in volts and the current in amps. Events.py uses the measured voltage to compute the energy.
+#
+# The supply and the multimeter share one GPIB bus, so they can not really be read at the same time. The
+# readback is interleaved with the multimeter reads instead: between two multimeter reads at most one short
+# transaction with the supply is made. Both queries are sent in one message, the status byte is polled every
+# READBACK_POLL_TIME seconds while the supply measures and the answer is only read once it is available, so
+# the bus is never held while the supply measures. A readback costs the multimeter about three short
+# transactions every --readback-seconds.
+
+# Extension of the supply readback file.
+SUPPLY_EXTENSION = ".supply"
+# Message of one readback, the supply answers both queries in one line separated by a semicolon.
+READBACK_QUERY   = "MEAS:VOLT?;:MEAS:CURR?"
+# Seconds between two polls of the status byte while the supply measures.
+READBACK_POLL_TIME = 0.02
+# Seconds a readback waits for the answer of the supply before it is counted as failed.
+READBACK_TIMEOUT = 2.0
+
+# Samples the measured output of a power supply between the reads of an acquisition.
+# arg 1 power supply VISA resource, HP66311B or HP6644A
+# arg 2 path of the .supply file
+# arg 3 seconds between two readbacks
+class SupplyReadback:
+    def __init__(self, powerSupply, path, interval):
+        self.powerSupply = powerSupply
+        self.path        = path
+        self.interval    = interval
+        self.file        = None
+        # Time the pending query was sent, None if no query is waiting for its answer.
+        self.sent        = None
+        self.nextPoll    = 0.0
+        self.due         = 0.0
+        self.samples     = 0
+        self.failed      = 0
+        self.busTime     = 0.0
+        self.voltage     = Statistics.RunningStats()
+
+    def Start(self):
+        self.file = open(self.path, "w")
+
+    # Makes at most one short transaction with the supply. now is the seconds since the start of the acquisition.
+    def Service(self, now):
+        if (self.sent is None and now < self.due) or (self.sent is not None and now < self.nextPoll):
+            return
+        busStart = time.monotonic()
+        try:
+            if self.sent is None:
+                self.powerSupply.write(READBACK_QUERY)
+                self.sent     = now
+                self.nextPoll = now + READBACK_POLL_TIME
+            elif self.powerSupply.read_stb() & Instruments.SCPI_MESSAGE_AVAILABLE:
+                volts, amps = [float(answer) for answer in self.powerSupply.read().split(";")]
+                self.Record(now, volts, amps)
+            elif now - self.sent > READBACK_TIMEOUT:
+                raise TimeoutError(READBACK_QUERY + " was not answered within " + str(READBACK_TIMEOUT) + " s")
+            else:
+                self.nextPoll = now + READBACK_POLL_TIME
+        except Exception:
+            self.failed += 1
+            self.sent    = None
+            self.due     = now + self.interval
+        self.busTime += time.monotonic() - busStart
+
+    # Writes a complete readback. Both measurements were taken between the query and the answer.
+    def Record(self, now, volts, amps):
+        self.file.write("{0:.6f},{1:.6f},{2:.9e}\n".format((self.sent + now) / 2, volts, amps))
+        self.samples += 1
+        self.voltage.Add([volts])
+        self.due  = self.sent + self.interval
+        self.sent = None
+
+    def Stop(self):
+        if self.file is not None:
+            self.file.close()
+
+# Returns a SupplyReadback for one experiment from the options added by AddCaptureArguments, None if
+# --readback-seconds is 0.
+def SupplyReadbackFromArgs(args, powerSupply, rootDir, experimentName):
+    if args.readback_seconds <= 0:
+        return None
+    return SupplyReadback(powerSupply, ResultsFormat.ResultsPrefix(rootDir, experimentName) + SUPPLY_EXTENSION,
+                          args.readback_seconds)
+
+# Prints the outcome of a supply readback with printFunction.
+def PrintReadback(readback, printFunction=print):
+    printFunction("Supply readback: " + str(readback.samples) + " samples, " +
+          ("mean " + "{0:.4f}".format(readback.voltage.mean) + " V, " if readback.samples else "") +
+          str(readback.failed) + " failed, " + "{0:.1f}".format(readback.busTime * 1000) + " ms on the bus")
+
+# Reads from an instrument for the given number of seconds and writes every reading to the results.
+# arg 1 function that returns a list of readings, ReadSingle, ReadBurst or ReadDigitizer
+# arg 2 VISA resource passed to the read function
+# arg 3 results writer, see ResultsFormat.OpenResultsWriter
+# arg 4 number of seconds to take measurements for, the longest capture if a monitor is given
+# arg 5 optional ConvergenceMonitor that is updated with every block and can end the acquisition early
+# arg 6 optional Instrumentation.AcquisitionHealth that records the read latencies and failed reads
+# arg 7 optional SupplyReadback, serviced between the reads
+# arg 8 function the first failed read of every kind is printed with
+#
+# Times are taken from a monotonic clock and are relative to the start of the acquisition.
+# Returns a tuple of (number of readings, number of failed reads, seconds spent acquiring).
+def Acquire(readFunction, instrument, writer, duration, monitor=None, health=None, readback=None, printFunction=print):
+    samples = 0
+    errors  = 0
+    health  = health if health is not None else Instrumentation.AcquisitionHealth()
+    # Capture the time that the experiment is starting.
+    start = time.monotonic()
+    if readback is not None:
+        readback.Start()
+    while (time.monotonic() - start) < duration:
+        if monitor is not None and monitor.Done(time.monotonic() - start):
+            break
+        blockStart = time.monotonic() - start
+        # Sometimes the data returned from the instrument can be corrupted. The try and except blocks make sure that
+        # if corrupt data is received, then the system will skip. Without the try and catch the system would hard fault
+        # and the experiment would end.
+        if readback is not None:
+            readback.Service(blockStart)
+        try:
+            readings = readFunction(instrument)
+        except Exception as error:
+            # Inform the user that an error occurred. If here then some corrupt data was received.
+            # Only the first error of every kind is printed, the others are counted, so a bad connection
+            # does not flood the console at the sample rate.
+            errors += 1
+            if health.Error(error):
+                printFunction("Exception occurred: " + type(error).__name__ + ", further ones are counted")
+            continue
+        blockEnd = time.monotonic() - start
+        health.Read(blockEnd - blockStart)
+        # Every reading of the transaction is written to the results at once.
+        writer.WriteBlock(blockStart, blockEnd, readings)
+        samples += len(readings)
+        if monitor is not None:
+            monitor.Update(blockEnd, readings)
+    elapsed = time.monotonic() - start
+    if readback is not None:
+        readback.Stop()
+    return (samples, errors, elapsed)
+
+# Prints the number of readings and the achieved sample rate of an acquisition with printFunction.
+def PrintAcquisitionRate(samples, errors, elapsed, printFunction=print):
+    rate = samples / elapsed if elapsed > 0 else 0.0
+    printFunction("Captured " + str(samples) + " samples in " + "{0:.1f}".format(elapsed) + " s (" +
+          "{0:.1f}".format(rate) + " samples/s, " + str(errors) + " failed reads)")
+
+# The pipelined acquisition splits the work between two threads.
+#   reader: only talks to the instrument. Every raw block of bytes received is pushed into a bounded
+#           buffer together with the time it was requested. The reader never waits on the buffer, if the
+#           buffer is full the block is dropped and counted, so the sampling cadence does not depend on
+#           the disk.
+#   writer: takes blocks from the buffer, decodes them and hands them to the results writer in bulk.
+
+# Default number of raw blocks the buffer between the reader and the writer can hold.
+DEFAULT_BUFFER_BLOCKS = 4096
+# Maximum number of blocks the writer formats and writes in one go.
+WRITER_BATCH_BLOCKS   = 256
+# Seconds the threads wait on the buffer at a time before checking whether the other one failed.
+WRITER_POLL_TIME      = 0.1
+
+# Reads one raw SREAL reading from the multimeter without decoding it.
+def RawReadSingle(multimeter):
+    return multimeter.read_raw()
+
+# Triggers one burst and returns the raw bytes of the burst without decoding them.
+def RawReadBurst(multimeter):
+    multimeter.write("TARM SGL")
+    return multimeter.read_raw()
+
+# Triggers one digitizer sweep and returns the raw IEEE 488.2 block without decoding it.
+def RawReadDigitizer(powerSupply):
+    powerSupply.write('INIT:NAME ACQ')
+    powerSupply.write('TRIG:ACQ')
+    powerSupply.write('FETC:ARR:CURR?')
+    return powerSupply.read_raw()
+
+# Decodes raw SREAL readings, 4 byte big endian floats without any header.
+# A trailing CR LF, left by the read termination of the multimeter resource, is removed.
+# Raises ValueError if the block is not a whole number of readings.
+def DecodeSREAL(raw):
+    if len(raw) % 4 == 2 and raw.endswith(b"\r\n"):
+        raw = raw[:-2]
+    if len(raw) == 0 or len(raw) % 4 != 0:
+        raise ValueError("SREAL block of " + str(len(raw)) + " bytes")
+    return struct.unpack(">" + str(len(raw) // 4) + "f", raw)
+
+# Decodes an IEEE 488.2 definite length block of 4 byte big endian floats, #<n><length><data>.
+# Raises ValueError if the header is malformed or the block is incomplete.
+def DecodeIEEEBlock(raw):
+    start = raw.find(b"#")
+    if start < 0 or len(raw) < start + 2 or not raw[start + 1:start + 2].isdigit():
+        raise ValueError("missing IEEE block header")
+    digits = int(raw[start + 1:start + 2])
+    if digits == 0 or len(raw) < start + 2 + digits:
+        raise ValueError("unsupported IEEE block header")
+    length = int(raw[start + 2:start + 2 + digits])
+    data   = raw[start + 2 + digits:start + 2 + digits + length]
+    if len(data) != length:
+        raise ValueError("IEEE block is " + str(len(data)) + " of " + str(length) + " bytes")
+    return DecodeSREAL(data)
+
+# Raw read and decode functions of every acquisition mode used by the pipelined acquisition.
+RAW_READERS = {"single":    (RawReadSingle,    DecodeSREAL),
+               "burst":     (RawReadBurst,     DecodeSREAL),
+               "digitizer": (RawReadDigitizer, DecodeIEEEBlock)}
+
+# Reads from an instrument for the given number of seconds using a reader and a writer thread.
+# arg 1 acquisition mode, a key of RAW_READERS
+# arg 2 VISA resource passed to the raw read function
+# arg 3 results writer, see ResultsFormat.OpenResultsWriter
+# arg 4 number of seconds to take measurements for, the longest capture if a monitor is given
+# arg 5 number of raw blocks the buffer between the threads can hold
+# arg 6 optional ConvergenceMonitor. It is updated by the writer thread as blocks are decoded and the
+#       reader stops once it reports the mean has converged.
+# arg 7 optional Instrumentation.AcquisitionHealth. The reader records the read latencies and failed reads,
+#       the writer the blocks that could not be decoded.
+# arg 8 optional SupplyReadback, serviced by the reader between the reads
+# arg 9 function the first failed read of every kind is printed with
+#
+# Returns a dictionary with the counters of the acquisition
+#   samples        readings written to the results file
+#   errors         reads that raised an exception in the reader
+#   corrupt        blocks that could not be decoded by the writer
+#   dropped        blocks dropped because the buffer was full
+#   droppedBytes   raw bytes of the dropped blocks
+#   highWater      largest number of blocks waiting in the buffer
+#   elapsed        seconds spent acquiring
+# Raises the error of the thread that failed first, for example the results writer running out of disk space.
+# The other thread stops instead of waiting for it.
+def AcquirePipelined(mode, instrument, writer, duration, bufferBlocks=DEFAULT_BUFFER_BLOCKS, monitor=None,
+                     health=None, readback=None, printFunction=print):
+    rawReadFunction, decodeFunction = RAW_READERS[mode]
+    health = health if health is not None else Instrumentation.AcquisitionHealth()
+    buffer = queue.Queue(bufferBlocks)
+    stats  = {"samples": 0, "errors": 0, "corrupt": 0, "dropped": 0, "droppedBytes": 0,
+              "highWater": 0, "elapsed": 0.0}
+
+    # Set when a thread failed, the other one stops instead of waiting for it. The first error is raised
+    # once both threads are done.
+    abort    = threading.Event()
+    failures = []
+
+    def Reader():
+        start = time.monotonic()
+        try:
+            if readback is not None:
+                readback.Start()
+            while (time.monotonic() - start) < duration and not abort.is_set():
+                if monitor is not None and monitor.Done(time.monotonic() - start):
+                    break
+                blockStart = time.monotonic() - start
+                if readback is not None:
+                    readback.Service(blockStart)
+                try:
+                    raw = rawReadFunction(instrument)
+                except Exception as error:
+                    stats["errors"] += 1
+                    if health.Error(error):
+                        printFunction("Exception occurred: " + type(error).__name__ + ", further ones are counted")
+                    continue
+                blockEnd = time.monotonic() - start
+                health.Read(blockEnd - blockStart)
+                try:
+                    buffer.put_nowait((blockStart, blockEnd, raw))
+                except queue.Full:
+                    stats["dropped"]      += 1
+                    stats["droppedBytes"] += len(raw)
+                    continue
+                stats["highWater"] = max(stats["highWater"], buffer.qsize())
+        except Exception as error:
+            failures.append(error)
+            abort.set()
+        finally:
+            stats["elapsed"] = time.monotonic() - start
+            if readback is not None:
+                readback.Stop()
+            # Tell the writer that no more blocks are coming. This is the only place the reader waits on the
+            # buffer, and it gives up if the writer has stopped taking blocks.
+            while not abort.is_set():
+                try:
+                    buffer.put(None, timeout=WRITER_POLL_TIME)
+                    break
+                except queue.Full:
+                    continue
+
+    def Writer():
+        try:
+            finished = False
+            while not finished and not abort.is_set():
+                try:
+                    batch = [buffer.get(timeout=WRITER_POLL_TIME)]
+                except queue.Empty:
+                    continue
+                # Take every block that is already waiting, up to the batch size, so they are written at once.
+                while len(batch) < WRITER_BATCH_BLOCKS:
+                    try:
+                        batch.append(buffer.get_nowait())
+                    except queue.Empty:
+                        break
+                decoded = []
+                for block in batch:
+                    if block is None:
+                        finished = True
+                        continue
+                    blockStart, blockEnd, raw = block
+                    try:
+                        readings = decodeFunction(raw)
+                    except (ValueError, struct.error):
+                        stats["corrupt"] += 1
+                        health.Corrupt()
+                        continue
+                    decoded.append((blockStart, blockEnd, readings))
+                    stats["samples"] += len(readings)
+                    if monitor is not None:
+                        monitor.Update(blockEnd, readings)
+                writer.WriteBlocks(decoded)
+        except Exception as error:
+            failures.append(error)
+            abort.set()
+
+    readerThread = threading.Thread(target=Reader, name="AcquisitionReader")
+    writerThread = threading.Thread(target=Writer, name="AcquisitionWriter")
+    writerThread.start()
+    readerThread.start()
+    readerThread.join()
+    writerThread.join()
+    if failures:
+        raise failures[0]
+    return stats
+
+# Prints the counters returned by AcquirePipelined with printFunction.
+def PrintPipelineStats(stats, printFunction=print):
+    PrintAcquisitionRate(stats["samples"], stats["errors"], stats["elapsed"], printFunction)
+    printFunction("Buffer high water mark " + str(stats["highWater"]) + " blocks, " +
+          str(stats["dropped"]) + " blocks dropped (~" + str(stats["droppedBytes"] // 4) + " samples), " +
+          str(stats["corrupt"]) + " corrupt blocks")
@@ -0,0 +1,314 @@
+# Single file archive of a campaign.
+#
+# A campaign is thousands of folders of results, plots and summaries. The archive packs all of them into
+# one zip file, so a campaign can be copied, shared and stored as one file and still be read without
+# unpacking it. The zip holds
+#   campaign.toc              JSON table of contents, the parameters, sample count and files of every
+#                             experiment, so experiments are found without reading any results
+#   EXP.../results/000000     the readings of an experiment in chunks of CHUNK_READINGS readings
+#   EXP.../EXP....srec        every other file of the experiment folder, plots, summaries, events...
+# Every member is compressed on its own, so reading one chunk of one experiment only decompresses that
+# chunk. A chunk holds the time column (float64 seconds) and then the current column (amps, float32 for
+# binary results and float64 for text results, so nothing is lost). The bytes of every column are
+# shuffled, the first byte of every value first, then the second bytes and so on. Readings that are close
+# to each other share their high bytes, which then compress much better.
+#
+# The readings are stored from the results file PostProcessing.ResultsFilePath picks, for text results
+# with the times rebuilt as PostProcessing.LoadTimes does, or NaN if there is no time base. The .results
+# and .bresults files themselves are not stored, extract rebuilds them in the format they were in, so the
+# float64 readings of text results are written back as text without losing any digits. The .timebase
+# file of text results is stored like the other files.
+#
+#     python Archive.py pack ../Experiments campaign.archive
+#     python Archive.py list campaign.archive --voltages 3.3
+#     python Archive.py extract campaign.archive ../Restored --numbers 05
+#
+# CampaignArchive reads an archive from Python and holds the same loading functions as
+# PostProcessing.ExperimentFolders, so the post processing reads straight from an archive, see the
+# --archive option of PostProcess_Batch.py.
+
+# Used to build file paths and list the experiment folders.
+import os
+# Used to store the table of contents.
+import json
+# Used to hold the archive.
+import zipfile
+# Used to read the files of the experiments stored in the archive.
+import io
+# Used to parse the command line options.
+import argparse
+# Used to hold and process the readings.
+import numpy as np
+
+import Campaign
+import PostProcessing
+import ResultsFormat
+
+# Name of the table of contents in the archive.
+TOC_NAME       = "campaign.toc"
+# Version of the archive layout, stored in the table of contents.
+ARCHIVE_VERSION = 1
+# Number of readings in one chunk of results.
+CHUNK_READINGS = 1 << 18
+# zlib compression level of the members.
+COMPRESS_LEVEL = 6
+# Files of an experiment folder that are stored as chunks of readings instead of files. The .timebase file
+# is only left out when the readings come from binary results, which hold the times themselves.
+RESULTS_EXTENSIONS = [".results", ResultsFormat.BINARY_EXTENSION, ".timebase"]
+# Files that are compressed already and stored as they are.
+STORED_EXTENSIONS  = [".png", ".pdf", ".zip", ".gz"]
+
+# Returns the name of a chunk of results in the archive.
+def ChunkName(experimentName, index):
+    return experimentName + "/results/" + "{0:06d}".format(index)
+
+# Returns the bytes of an array with the bytes of its values shuffled, see the top of this file.
+def ShuffleBytes(values):
+    values = np.ascontiguousarray(values)
+    return np.frombuffer(values.tobytes(), dtype=np.uint8).reshape(-1, values.dtype.itemsize).T.tobytes()
+
+# Rebuilds an array from its shuffled bytes.
+# arg 1 shuffled bytes
+# arg 2 numpy type of the values
+def UnshuffleBytes(data, dtype):
+    dtype = np.dtype(dtype)
+    planes = np.frombuffer(data, dtype=np.uint8).reshape(dtype.itemsize, -1)
+    return np.ascontiguousarray(planes.T).view(dtype).ravel()
+
+# Returns the line of a reading in a text results file. Readings are written with six decimals like
+# ResultsFormat.TextResultsWriter does if that reads back as the same float64 reading, otherwise with the
+# shortest text that does.
+def ReadingText(reading):
+    text = "{0:.6f}".format(reading)
+    return text if float(text) == reading else repr(reading)
+
+# Loads the readings of an experiment to pack them.
+# Returns a tuple of (times in seconds, readings in amps, binary header or None, True if the times are known),
+# None if the experiment has no results.
+def LoadRecords(rootDir, experimentName):
+    path = PostProcessing.ResultsFilePath(rootDir, experimentName)
+    if path is None:
+        return None
+    header = None
+    if path.endswith(ResultsFormat.BINARY_EXTENSION):
+        header, records = ResultsFormat.OpenBinaryResults(path)
+        current = records["current"]
+        # Binary results converted from text results without a time base hold NaN times.
+        if not np.isnan(records["time"]).all():
+            return (records["time"], current, header, True)
+    else:
+        current = np.loadtxt(path, dtype=np.float64, ndmin=1)
+    try:
+        times = PostProcessing.LoadTimes(rootDir, experimentName, len(current))
+        return (times, current, header, True)
+    except ValueError:
+        return (np.full(len(current), np.nan), current, header, False)
+
+# Packs the experiments of a campaign into an archive. The archive is replaced only once it is complete.
+# arg 1 root directory of the experiments
+# arg 2 path of the archive
+# arg 3 names of the experiments to pack, None for every experiment
+# arg 4 optional function called with the name of every experiment once it is packed
+# Returns the table of contents.
+def PackCampaign(rootDir, archivePath, experimentNames=None, progressFunction=None):
+    if experimentNames is None:
+        experimentNames = Campaign.ListExperiments(rootDir)
+    toc = {"version": ARCHIVE_VERSION, "chunkReadings": CHUNK_READINGS, "experiments": {}}
+    with zipfile.ZipFile(archivePath + ".tmp", "w", compression=zipfile.ZIP_DEFLATED,
+                         compresslevel=COMPRESS_LEVEL) as archive:
+        for experimentName in experimentNames:
+            expParams = ResultsFormat.ParseExperimentName(experimentName)
+            entry = {"number": expParams["number"], "type": "SYSTEM" if expParams["config"] else "MCU",
+                     "frequency": expParams["frequency"], "voltage": expParams["voltage"],
+                     "config": expParams["config"], "samples": 0, "chunks": 0, "times": False,
+                     "currentType": None, "header": None, "source": None, "files": []}
+            loaded = LoadRecords(rootDir, experimentName)
+            if loaded is not None:
+                times, current, header, hasTimes = loaded
+                resultsPath = PostProcessing.ResultsFilePath(rootDir, experimentName)
+                entry.update({"samples": len(current), "chunks": -(-len(current) // CHUNK_READINGS),
+                              "times": hasTimes, "currentType": current.dtype.str, "header": header,
+                              "source": {"file": os.path.basename(resultsPath),
+                                         "bytes": os.path.getsize(resultsPath),
+                                         "checksum": Campaign.FileChecksum(resultsPath)}})
+                for index in range(entry["chunks"]):
+                    chunk = slice(index * CHUNK_READINGS, (index + 1) * CHUNK_READINGS)
+                    archive.writestr(ChunkName(experimentName, index),
+                                     ShuffleBytes(np.asarray(times[chunk], dtype="<f8")) +
+                                     ShuffleBytes(current[chunk]))
+            folder = os.path.join(rootDir, experimentName)
+            skipped = RESULTS_EXTENSIONS if entry["header"] is not None else RESULTS_EXTENSIONS[:2]
+            for fileName in sorted(os.listdir(folder)):
+                extension = os.path.splitext(fileName)[1]
+                if extension in skipped or not os.path.isfile(os.path.join(folder, fileName)):
+                    continue
+                archive.write(os.path.join(folder, fileName), experimentName + "/" + fileName,
+                              compress_type=zipfile.ZIP_STORED if extension in STORED_EXTENSIONS else None)
+                entry["files"].append(fileName)
+            toc["experiments"][experimentName] = entry
+            if progressFunction is not None:
+                progressFunction(experimentName)
+        archive.writestr(TOC_NAME, json.dumps(toc, indent=1))
+    os.replace(archivePath + ".tmp", archivePath)
+    return toc
+
+# Reader of a campaign archive. The table of contents is read when the archive is opened, the readings
+# only when they are asked for.
+# arg 1 path of the archive
+class CampaignArchive:
+    def __init__(self, path):
+        self.path    = path
+        self.archive = zipfile.ZipFile(path, "r")
+        self.toc     = json.loads(self.archive.read(TOC_NAME).decode())
+        if self.toc.get("version") != ARCHIVE_VERSION:
+            raise ValueError(path + " has an unknown archive version " + str(self.toc.get("version")))
+        self.chunkReadings = self.toc["chunkReadings"]
+
+    # Returns the names of the archived experiments matching the selection, sorted. None selects everything.
+    # numbers, voltages and frequencies are matched like the --numbers, --voltages and --frequencies
+    # options, types is a list of MCU and SYSTEM.
+    def Experiments(self, numbers=None, voltages=None, frequencies=None, types=None):
+        entries  = self.toc["experiments"]
+        selected = Campaign.FilterExperiments(sorted(entries), numbers, voltages, frequencies)
+        return [name for name in selected if types is None or entries[name]["type"] in types]
+
+    # Returns the table of contents entry of an experiment. Raises KeyError if it is not archived.
+    def Entry(self, experimentName):
+        return self.toc["experiments"][experimentName]
+
+    def HasResults(self, experimentName):
+        entry = self.toc["experiments"].get(experimentName)
+        return entry is not None and entry["samples"] > 0
+
+    # Size of the archived results of an experiment in bytes before compression, 0 if it has none.
+    def ResultsSize(self, experimentName):
+        entry = self.Entry(experimentName)
+        return entry["samples"] * (8 + np.dtype(entry["currentType"]).itemsize) if entry["samples"] else 0
+
+    # Modification time of the results, the time the archive was written.
+    def ResultsTime(self, experimentName):
+        return os.path.getmtime(self.path)
+
+    # Reads one chunk of the results of an experiment.
+    # Returns a tuple of (times in seconds, readings in amps).
+    def ReadChunk(self, experimentName, index):
+        entry = self.Entry(experimentName)
+        data  = self.archive.read(ChunkName(experimentName, index))
+        count = len(data) // (8 + np.dtype(entry["currentType"]).itemsize)
+        return (UnshuffleBytes(data[:8 * count], "<f8"), UnshuffleBytes(data[8 * count:], entry["currentType"]))
+
+    # Reads readings start up to stop of an experiment, only decompressing the chunks holding them.
+    # Returns a tuple of (times in seconds, readings in amps).
+    def ReadRecords(self, experimentName, start=0, stop=None):
+        samples = self.Entry(experimentName)["samples"]
+        stop    = samples if stop is None else min(stop, samples)
+        if start >= stop:
+            return (np.zeros(0, dtype=np.float64), np.zeros(0, dtype=np.float64))
+        first = start // self.chunkReadings
+        last  = (stop - 1) // self.chunkReadings
+        chunks = [self.ReadChunk(experimentName, index) for index in range(first, last + 1)]
+        offset = first * self.chunkReadings
+        times   = np.concatenate([chunk[0] for chunk in chunks])[start - offset:stop - offset]
+        current = np.concatenate([chunk[1] for chunk in chunks])[start - offset:stop - offset]
+        return (times, current)
+
+    # Returns the bytes of a file of an experiment folder. Raises KeyError if it was not archived.
+    def ReadFile(self, experimentName, fileName):
+        return self.archive.read(experimentName + "/" + fileName)
+
+    # Loads the readings of an experiment in milliamps, None if the experiment has no results.
+    def LoadCurrent(self, experimentName):
+        if not self.HasResults(experimentName):
+            return None
+        return np.concatenate(list(self.ReadCurrentChunks(experimentName)))
+
+    # Reads the readings of an experiment one archived chunk at a time.
+    # Yields numpy arrays of the readings in milliamps.
+    def ReadCurrentChunks(self, experimentName):
+        for index in range(self.Entry(experimentName)["chunks"]):
+            yield np.multiply(self.ReadChunk(experimentName, index)[1], 1000, dtype=np.float64)
+
+    # Returns the time of every reading of an experiment in seconds, see PostProcessing.LoadTimes.
+    # Raises ValueError if the times were not known when the experiment was packed.
+    def LoadTimes(self, experimentName, count):
+        entry = self.Entry(experimentName)
+        if not entry["times"] or entry["samples"] != count:
+            raise ValueError("no time base, capture with --results-format binary to keep the time of every reading")
+        return np.concatenate([self.ReadChunk(experimentName, index)[0] for index in range(entry["chunks"])])
+
+    # Returns the supply voltage of an experiment at the given times, see PostProcessing.LoadVoltage.
+    def LoadVoltage(self, experimentName, times):
+        supplyName = experimentName + ".supply"
+        if supplyName in self.Entry(experimentName)["files"]:
+            data = self.ReadFile(experimentName, supplyName)
+            if data:
+                readback = np.loadtxt(io.BytesIO(data), delimiter=",", ndmin=2)
+                return np.interp(times, readback[:, 0], readback[:, 1])
+        return float(ResultsFormat.ParseExperimentName(experimentName)["voltage"])
+
+    # Unpacks an experiment into rootDir/experimentName. The readings are written as binary results, or as
+    # text results if they were packed from text results.
+    def Extract(self, rootDir, experimentName):
+        entry  = self.Entry(experimentName)
+        folder = os.path.join(rootDir, experimentName)
+        os.makedirs(folder, exist_ok=True)
+        for fileName in entry["files"]:
+            with open(os.path.join(folder, fileName), "wb") as extracted:
+                extracted.write(self.ReadFile(experimentName, fileName))
+        if entry["samples"] == 0:
+            return
+        header = entry["header"]
+        if header is None:
+            with open(ResultsFormat.ResultsPrefix(rootDir, experimentName) + ".results", "w") as results:
+                for index in range(entry["chunks"]):
+                    current = self.ReadChunk(experimentName, index)[1]
+                    results.write("".join(ReadingText(reading) + "\n" for reading in current.tolist()))
+            return
+        writer = ResultsFormat.BinaryResultsWriter(ResultsFormat.ResultsPrefix(rootDir, experimentName) +
+                                                   ResultsFormat.BINARY_EXTENSION, header)
+        recordType = np.dtype([("time", "<f8"), ("current", "<f4")])
+        for index in range(entry["chunks"]):
+            times, current = self.ReadChunk(experimentName, index)
+            records = np.empty(len(current), dtype=recordType)
+            records["time"]    = times
+            records["current"] = current
+            writer.WriteRecords(records)
+        writer.Close()
+
+    def Close(self):
+        self.archive.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack a campaign into a single archive file and read it back.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    pack = commands.add_parser("pack", help="pack the experiments folder into an archive")
+    pack.add_argument("root", help="root directory of the experiments")
+    pack.add_argument("archive", help="archive to write")
+    listing = commands.add_parser("list", help="list the archived experiments")
+    listing.add_argument("archive", help="archive to read")
+    extract = commands.add_parser("extract", help="unpack experiments into an experiments folder")
+    extract.add_argument("archive", help="archive to read")
+    extract.add_argument("root", help="root directory the experiments are unpacked into")
+    for command in (pack, listing, extract):
+        command.add_argument("--numbers", nargs="*", default=None, help="only these experiment numbers")
+        command.add_argument("--voltages", nargs="*", default=None, help="only experiments at these voltages")
+        command.add_argument("--frequencies", nargs="*", default=None, help="only experiments at these frequencies")
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        experimentNames = Campaign.FilterExperiments(Campaign.ListExperiments(args.root), args.numbers,
+                                                     args.voltages, args.frequencies)
+        toc = PackCampaign(args.root, args.archive, experimentNames, lambda name: print("Packed " + name))
+        print("Packed " + str(len(toc["experiments"])) + " experiments into " + args.archive + ", " +
+              "{0:.1f}".format(os.path.getsize(args.archive) / 1E6) + " MB")
+    else:
+        campaign = CampaignArchive(args.archive)
+        for experimentName in campaign.Experiments(args.numbers, args.voltages, args.frequencies):
+            entry = campaign.Entry(experimentName)
+            if args.command == "list":
+                print(experimentName.ljust(32) + str(entry["samples"]).rjust(10) + " samples  " +
+                      " ".join(entry["files"]))
+            else:
+                campaign.Extract(args.root, experimentName)
+                print("Extracted " + experimentName)
+        campaign.Close()
@@ -0,0 +1,217 @@
+# Runs experiments on several benches at the same time.
+#
+# Every bench is a power supply or source meter, an HP3457A multimeter and a J-Link attached to its own
+# target. Benches are described in a JSON file, a list with one object per bench.
+#   name               name printed in front of the messages of the bench
+#   supply             model of the power supply, HP66311B or HP6644A
+#   supplyAddress      VISA address of the power supply
+#   multimeterAddress  VISA address of the multimeter
+#   jlinkSerial        serial number of the J-Link of the bench, null if only one bench and one J-Link are
+#                      used. The included file has placeholders, replace them with the serial numbers
+#                      printed on the probes.
+#   voltages           voltages the bench can run experiments at
+#   flashVoltage       voltage the target is flashed at, null to flash at the experiment voltage
+#   multimeterRange    DC current range of the multimeter in amps, null for autorange
+#   nplc               integration time of the multimeter in power line cycles
+#
+# One worker thread runs every bench. The workers share one queue of experiments in the planned order, and
+# every worker takes the next experiment whose voltage its bench supports, so for example system
+# experiments at 3.7V only go to benches that can supply 3.7V. Sets of the experiment matrix that name a
+# bench only go to that bench, see ExperimentMatrix.py. If a bench fails, the experiment it was
+# running is put back in the queue for the other benches.
+
+# Used to read the bench definitions.
+import json
+# Used to run the benches at the same time.
+import threading
+# Used to report a failing bench.
+import traceback
+
+import Acquisition
+import ExperimentRun
+import Flasher
+import Instruments
+import ResultsFormat
+
+# Bench definitions used when no file is given.
+DEFAULT_BENCH_FILE = "Benches.json"
+# Power supply models a bench can use.
+SUPPLY_MODELS = ["HP66311B", "HP6644A"]
+# Optional settings of a bench definition and their defaults.
+BENCH_DEFAULTS = {"jlinkSerial": None, "flashVoltage": None, "multimeterRange": None, "nplc": 1}
+
+# Reads the bench definitions from a JSON file.
+# arg 1 path of the JSON file
+# arg 2 names of the benches to keep, None for every bench
+# Returns a list of bench dictionaries with every optional setting filled in.
+# Raises ValueError if a definition is missing a setting or uses an unknown power supply, or if two benches
+# would flash through the same J-Link, because they share a serial number or have none. Only the kept
+# benches are checked for J-Links. Raises ValueError too if one of the names is not a bench of the file.
+def LoadBenches(path, names=None):
+    with open(path, "r") as benchFile:
+        definitions = json.load(benchFile)
+    benches = []
+    for definition in definitions:
+        for key in ("name", "supply", "supplyAddress", "multimeterAddress", "voltages"):
+            if key not in definition:
+                raise ValueError("bench " + str(definition.get("name")) + " has no " + key)
+        if definition["supply"] not in SUPPLY_MODELS:
+            raise ValueError("bench " + definition["name"] + " uses unknown supply " + definition["supply"])
+        bench = dict(BENCH_DEFAULTS)
+        bench.update(definition)
+        benches.append(bench)
+    if names is not None:
+        unknown = [name for name in names if name not in [bench["name"] for bench in benches]]
+        if unknown:
+            raise ValueError("no bench named " + ", ".join(unknown) + " in " + path)
+        benches = [bench for bench in benches if bench["name"] in names]
+    serials = [str(bench["jlinkSerial"]) for bench in benches]
+    if len(benches) > 1 and "None" in serials:
+        raise ValueError("every bench needs a jlinkSerial when there is more than one, none is given for " +
+                         ", ".join(bench["name"] for bench in benches if bench["jlinkSerial"] is None))
+    for bench, serial in zip(benches, serials):
+        if serials.count(serial) > 1:
+            raise ValueError("bench " + bench["name"] + " shares J-Link " + serial + " with another bench")
+    return benches
+
+# True if the bench can supply the voltage of the experiment.
+# arg 3 optional dictionary of experiment name to the only bench allowed to run it, see
+#       ExperimentMatrix.BenchAssignments. Experiments that are not in it run on any bench.
+def CanRun(bench, experimentName, assignments=None):
+    if assignments is not None and assignments.get(experimentName, bench["name"]) != bench["name"]:
+        return False
+    voltage = float(ResultsFormat.ParseExperimentName(experimentName)["voltage"])
+    return any(abs(voltage - supported) < 1E-6 for supported in bench["voltages"])
+
+# Experiments waiting to run, shared by every bench worker.
+# arg 2 optional dictionary of experiment name to the only bench allowed to run it, see CanRun
+class WorkQueue:
+    def __init__(self, experimentNames, assignments=None):
+        self.pending     = list(experimentNames)
+        self.assignments = assignments
+        self.lock        = threading.Lock()
+
+    # Removes and returns the next experiment the bench can run, None if there is none left.
+    def Take(self, bench):
+        with self.lock:
+            for experimentName in self.pending:
+                if CanRun(bench, experimentName, self.assignments):
+                    self.pending.remove(experimentName)
+                    return experimentName
+        return None
+
+    # Puts an experiment back at the front of the queue.
+    def Return(self, experimentName):
+        with self.lock:
+            self.pending.insert(0, experimentName)
+
+    def Remaining(self):
+        with self.lock:
+            return list(self.pending)
+
+# One bench and the experiments it runs.
+# arg 1 bench dictionary, see LoadBenches
+# arg 2 parsed options of the run script
+# arg 3 CampaignJournal shared by every bench
+# arg 4 root directory of the experiments
+# arg 5 Instrumentation.CampaignMetrics shared by every bench
+class Bench:
+    def __init__(self, definition, args, journal, rootDir, metrics):
+        self.definition = definition
+        self.name       = definition["name"]
+        self.args       = args
+        self.journal    = journal
+        self.metrics    = metrics
+        self.rootDir    = rootDir
+        self.sync       = Instruments.SynchronizerFromArgs(args)
+        # Every bench keeps a J-Link session to its own probe open.
+        self.flasher    = Flasher.FlasherFromArgs(args, definition["jlinkSerial"],
+                                                  "jlinkScript_" + definition["name"] + ".jlink")
+        self.completed  = []
+        self.failed     = None
+
+    def Print(self, message):
+        print("[" + self.name + "] " + message)
+
+    # Opens and sets up the instruments of the bench.
+    def Connect(self):
+        definition = self.definition
+        rm = Instruments.ResourceManagerFromArgs(self.args, {definition["supplyAddress"]:     definition["supply"],
+                                                             definition["multimeterAddress"]: "HP3457A"})
+        self.powerSupply = rm.open_resource(definition["supplyAddress"])
+        self.multimeter  = rm.open_resource(definition["multimeterAddress"], read_termination='\r\n')
+        sync = self.sync
+        if definition["supply"] == "HP66311B":
+            # Power on reset of the source meter, every register in its power on state.
+            for command in ('*RST', '*CLS', 'STAT:PRES', '*SRE 0', '*ESE 0',
+                            'SENS:SWE:POIN 4096', 'SENS:SWE:TINT 15.6E-6'):
+                sync.Write(self.powerSupply, command)
+        else:
+            sync.Write(self.powerSupply, 'OUTP OFF')
+            # A current limit the target should never reach, if it does there is a short.
+            sync.Write(self.powerSupply, 'CURR 0.5')
+            sync.Write(self.powerSupply, 'STAT:PRES 0x0100')
+
+        sync.Delay(0.5)
+        rangeSetting = definition["multimeterRange"]
+        for command in ("RESET", "BEEP OFF", "END ALWAYS",
+                        "DCI" + (" " + str(rangeSetting) if rangeSetting is not None else ""),
+                        "NPLC " + str(definition["nplc"]), "AZERO 0", "DISP OFF", "OFORMAT SREAL"):
+            sync.WriteMultimeter(self.multimeter, command)
+        sync.Delay(0.1)
+        self.multimeter.write("TARM AUTO")
+
+        self.instrument     = self.multimeter
+        self.sampleInterval = 0.0
+        if self.args.acquisition == "burst":
+            Acquisition.ConfigureBurst(self.multimeter, self.args.burst_size)
+            self.readFunction = Acquisition.ReadBurst
+        elif self.args.acquisition == "digitizer":
+            if definition["supply"] != "HP66311B":
+                raise ValueError("bench " + self.name + " has no digitizer")
+            Acquisition.ConfigureDigitizer(self.powerSupply, Acquisition.DIGITIZER_POINTS,
+                                           Acquisition.DIGITIZER_INTERVAL)
+            self.readFunction   = Acquisition.ReadDigitizer
+            self.instrument     = self.powerSupply
+            self.sampleInterval = Acquisition.DIGITIZER_INTERVAL
+        else:
+            self.readFunction = Acquisition.ReadSingle
+
+    # Runs one experiment the same way the setup scripts do, see ExperimentRun.py.
+    def Run(self, experimentName):
+        if ExperimentRun.RunExperiment(experimentName, self.args, self.rootDir, self.journal, self.metrics, self.sync,
+                                       self.flasher, self.powerSupply, self.instrument, self.readFunction,
+                                       self.sampleInterval, self.definition["flashVoltage"],
+                                       {"nplc": self.definition["nplc"], "bench": self.name}, self.name, self.Print):
+            self.completed.append(experimentName)
+
+    # Worker of the bench. Runs experiments from the queue until none is left that the bench can run.
+    # If the bench fails, the experiment is put back in the queue and the bench stops.
+    def RunWorker(self, workQueue):
+        experimentName = None
+        try:
+            self.Connect()
+            experimentName = workQueue.Take(self.definition)
+            while experimentName is not None:
+                self.Run(experimentName)
+                experimentName = workQueue.Take(self.definition)
+        except Exception:
+            self.failed = traceback.format_exc()
+            self.Print("Bench failed, stopping it\n" + self.failed)
+            if experimentName is not None:
+                workQueue.Return(experimentName)
+        self.flasher.Close()
+
+# Runs the experiments on every bench at the same time.
+# arg 7 optional dictionary of experiment name to the only bench allowed to run it, see CanRun
+# Returns a tuple of (list of Bench objects, experiments no bench ran) once every worker finished.
+def RunBenches(definitions, experimentNames, args, journal, rootDir, metrics, assignments=None):
+    benches   = [Bench(definition, args, journal, rootDir, metrics) for definition in definitions]
+    workQueue = WorkQueue(experimentNames, assignments)
+    threads   = [threading.Thread(target=bench.RunWorker, args=(workQueue,), name="Bench-" + bench.name)
+                 for bench in benches]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return (benches, workQueue.Remaining())
@@ -0,0 +1,180 @@
+#! /bin/python
+# Acquisition throughput benchmark.
+#
+# Runs every acquisition mode of the run scripts against the simulated instruments and measures the
+# samples per second, the wall time of one experiment and the time PostProcess_SingleFile.py takes for
+# the results. No bench is needed, so throughput regressions can be caught on a laptop.
+#
+#     python Benchmark.py --seconds 5 --save baseline.json
+#     python Benchmark.py --seconds 5 --baseline baseline.json
+#
+# With --baseline the results are compared against an earlier run and the script exits with an error
+# if any case got slower than the tolerance allows.
+
+# Used to build file paths.
+import os
+# Used to parse the command line options.
+import argparse
+# Used to time the cases.
+import time
+# Used to store and compare the benchmark results.
+import json
+# Used to run the post processing script.
+import subprocess
+# Used to exit with an error code on a regression.
+import sys
+# Used for the scratch experiments folder.
+import tempfile
+import shutil
+
+import Acquisition
+import Instruments
+import ResultsFormat
+
+# Name of the experiment used for every case, a normal MCU experiment name.
+EXPERIMENT_NAME = "EXP00-3_3-48000000"
+
+# Every benchmark case, (name, acquisition mode, pipelined, results format).
+CASES = [("single-text",             "single",    False, "text"),
+         ("burst-text",              "burst",     False, "text"),
+         ("burst-binary",            "burst",     False, "binary"),
+         ("burst-pipelined-binary",  "burst",     True,  "binary"),
+         ("digitizer-text",          "digitizer", False, "text"),
+         ("digitizer-binary",        "digitizer", False, "binary"),
+         ("digitizer-pipelined-binary", "digitizer", True, "binary")]
+
+# Runs one acquisition case against the simulated instruments.
+# Returns a dictionary with the samples, failed reads, samples per second and wall time of the case.
+def RunCase(rm, rootDir, mode, pipelined, resultsFormat, seconds, burstSize):
+    caseStart   = time.monotonic()
+    multimeter  = rm.open_resource(Instruments.HP3457A_ADDRESS, read_termination='\r\n')
+    powerSupply = rm.open_resource(Instruments.HP66311B_ADDRESS)
+    instrument     = multimeter
+    sampleInterval = 0.0
+    readFunction   = Acquisition.ReadSingle
+    if mode == "burst":
+        Acquisition.ConfigureBurst(multimeter, burstSize)
+        readFunction = Acquisition.ReadBurst
+    elif mode == "digitizer":
+        Acquisition.ConfigureDigitizer(powerSupply, Acquisition.DIGITIZER_POINTS, Acquisition.DIGITIZER_INTERVAL)
+        readFunction   = Acquisition.ReadDigitizer
+        instrument     = powerSupply
+        sampleInterval = Acquisition.DIGITIZER_INTERVAL
+    writer = ResultsFormat.OpenResultsWriter(resultsFormat, rootDir, EXPERIMENT_NAME, "simulated", mode, sampleInterval,
+                                             timebase=mode == "digitizer")
+    if pipelined:
+        stats = Acquisition.AcquirePipelined(mode, instrument, writer, seconds)
+        samples, errors, elapsed = stats["samples"], stats["errors"] + stats["corrupt"], stats["elapsed"]
+    else:
+        samples, errors, elapsed = Acquisition.Acquire(readFunction, instrument, writer, seconds)
+    writer.Close()
+    return {"samples":          samples,
+            "errors":           errors,
+            "samplesPerSecond": samples / elapsed if elapsed > 0 else 0.0,
+            "wallTime":         time.monotonic() - caseStart}
+
+# Times PostProcess_SingleFile.py for the results in rootDir. The whole script is timed, including the
+# interpreter start and imports, as that is what every post processing run pays.
+# Returns the seconds taken, or None if the script failed.
+def TimePostProcess(rootDir, postProcessMode):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "PostProcess_SingleFile.py")
+    start  = time.monotonic()
+    result = subprocess.call([sys.executable, script, rootDir, EXPERIMENT_NAME, postProcessMode],
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if result != 0:
+        return None
+    return time.monotonic() - start
+
+# Compares the results against a baseline. Returns a list of the cases that regressed, post processing
+# modes that fail but had a time in the baseline included.
+# Sample rates may drop and times may grow by the tolerance, a fraction, before it counts as a regression.
+def CompareBaseline(results, baseline, tolerance):
+    regressions = []
+    for name, case in results["cases"].items():
+        if name not in baseline.get("cases", {}):
+            continue
+        previous = baseline["cases"][name]["samplesPerSecond"]
+        if case["samplesPerSecond"] < previous * (1 - tolerance):
+            regressions.append(name + ": " + "{0:.1f}".format(case["samplesPerSecond"]) + " samples/s, was " +
+                               "{0:.1f}".format(previous))
+    for name, seconds in results["postprocess"].items():
+        previous = baseline.get("postprocess", {}).get(name)
+        if previous is None:
+            continue
+        # A mode that worked in the baseline and fails now is the worst regression of all.
+        if seconds is None:
+            regressions.append("postprocess " + name + ": failed, was " + "{0:.2f}".format(previous) + " s")
+            continue
+        if seconds > previous * (1 + tolerance):
+            regressions.append("postprocess " + name + ": " + "{0:.2f}".format(seconds) + " s, was " +
+                               "{0:.2f}".format(previous))
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the acquisition path against simulated instruments.")
+    parser.add_argument("--seconds", type=float, default=5.0,
+                        help="seconds every case acquires for (default 5)")
+    parser.add_argument("--burst-size", type=int, default=Acquisition.DEFAULT_BURST_SIZE,
+                        help="readings per burst (default " + str(Acquisition.DEFAULT_BURST_SIZE) + ")")
+    parser.add_argument("--cases", nargs="*", default=None,
+                        help="names of the cases to run (default all)")
+    parser.add_argument("--postprocess", nargs="*", default=["STATS", "PNG"],
+                        help="PostProcess_SingleFile.py modes to time (default STATS PNG)")
+    parser.add_argument("--save", default=None, help="write the results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="compare the results against this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="allowed slowdown against the baseline as a fraction (default 0.1)")
+    Instruments.AddBackendArguments(parser)
+    args = parser.parse_args()
+    # The benchmark always uses the simulated instruments.
+    args.backend = "sim"
+
+    results = {"settings": {"seconds": args.seconds, "burstSize": args.burst_size,
+                            "latency": args.sim_latency, "readingTime": args.sim_reading_time,
+                            "corrupt": args.sim_corrupt, "trace": args.sim_trace},
+               "cases": {}, "postprocess": {}, "postprocessSamples": {}}
+    scratchDir = tempfile.mkdtemp(prefix="benchmark-")
+    # Experiments folder and results format of every case that ran.
+    caseDirs   = {}
+    try:
+        for name, mode, pipelined, resultsFormat in CASES:
+            if args.cases and name not in args.cases:
+                continue
+            # Every case gets its own experiments folder so the post processing can be timed per format.
+            rootDir = os.path.join(scratchDir, name)
+            os.makedirs(os.path.join(rootDir, EXPERIMENT_NAME))
+            case = RunCase(Instruments.ResourceManagerFromArgs(args), rootDir, mode, pipelined, resultsFormat,
+                           args.seconds, args.burst_size)
+            results["cases"][name] = case
+            print("{0:<28} {1:>10.1f} samples/s {2:>9} samples {3:>5} errors {4:>7.2f} s wall".format(
+                  name, case["samplesPerSecond"], case["samples"], case["errors"], case["wallTime"]))
+            caseDirs[name] = (rootDir, resultsFormat)
+
+        # Post processing is timed on the largest capture of each results format.
+        for resultsFormat in ResultsFormat.RESULTS_FORMATS:
+            formatCases = [name for name in caseDirs if caseDirs[name][1] == resultsFormat]
+            if not formatCases:
+                continue
+            largest = max(formatCases, key=lambda name: results["cases"][name]["samples"])
+            for postProcessMode in args.postprocess:
+                key = resultsFormat + "-" + postProcessMode
+                results["postprocess"][key]        = TimePostProcess(caseDirs[largest][0], postProcessMode)
+                results["postprocessSamples"][key] = results["cases"][largest]["samples"]
+    finally:
+        shutil.rmtree(scratchDir, ignore_errors=True)
+
+    for key, seconds in sorted(results["postprocess"].items()):
+        print("postprocess {0:<16} {1}".format(key, "failed" if seconds is None else "{0:.2f} s".format(seconds)) +
+              " for " + str(results["postprocessSamples"][key]) + " samples")
+
+    if args.save is not None:
+        with open(args.save, "w") as saveFile:
+            json.dump(results, saveFile, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline, "r") as baselineFile:
+            regressions = CompareBaseline(results, json.load(baselineFile), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        if regressions:
+            sys.exit(1)
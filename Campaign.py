@@ -0,0 +1,204 @@
+# Campaign bookkeeping shared by the run scripts.
+#
+# Every step of every experiment is appended to a journal, Experiments/campaign.journal. Each line is a
+# JSON record with the experiment name, the step reached, the seconds the step took since the previous
+# record of the experiment and the details of the step.
+#   started    the experiment was picked up, with the bench running it when there are several
+#   flashed    flashing finished, with the seconds it took, the flash sectors written (null if unknown)
+#              and whether they were verified, see Flasher.py
+#   settled    the current settled, with the seconds waited
+#   captured   the capture finished, with the samples, failed reads and seconds captured
+#   validated  the results file holds every captured sample, with its sample count and sha256 checksum
+#   failed     flashing failed or the results file did not validate, with the reason
+#
+# The journal is only ever appended to and every record is flushed to disk before the script moves on, so
+# it survives the script or the bench crashing. With --resume every experiment whose last record is
+# validated, and whose results file still has the checksum recorded, is skipped. Every other experiment
+# is run again from the start.
+#
+# The experiments to run come from the experiment matrix, see ExperimentMatrix.py, and only the ones
+# whose folder exists, that were built, are run. They can be selected with --sets, --match, --numbers,
+# --voltages and --frequencies, and split between machines with --shard.
+
+# Used to build file paths and list the experiments.
+import os
+# Used to store the journal records.
+import json
+# Used to checksum the results files.
+import hashlib
+# Used to time stamp the journal records.
+import time
+# Used to share the journal between the bench workers.
+import threading
+
+import ResultsFormat
+import ExperimentMatrix
+
+# Name of the journal file in the experiments root directory.
+JOURNAL_NAME = "campaign.journal"
+# Steps of an experiment in the order they happen.
+STATES = ["started", "flashed", "settled", "captured", "validated"]
+
+# Adds the journal and experiment selection options to a run script parser.
+def AddCampaignArguments(parser):
+    parser.add_argument("--resume", action="store_true",
+                        help="skip the experiments the journal records as validated")
+    parser.add_argument("--journal", default=None,
+                        help="journal file (default " + JOURNAL_NAME + " in the experiments folder)")
+    parser.add_argument("--numbers", nargs="*", default=None,
+                        help="only run these experiment numbers, for example 00 13A or EXP00")
+    parser.add_argument("--voltages", nargs="*", default=None,
+                        help="only run experiments at these voltages, for example 3.3 or 3_3")
+    parser.add_argument("--frequencies", nargs="*", default=None,
+                        help="only run experiments at these frequencies, for example 48000000 or LF")
+    ExperimentMatrix.AddMatrixArguments(parser)
+
+# Returns the names of every experiment folder under rootDir in sorted order.
+def ListExperiments(rootDir):
+    return sorted(d for d in os.listdir(rootDir)
+                  if d.startswith("EXP") and os.path.isdir(os.path.join(rootDir, d)))
+
+# Returns the experiments matching the numbers, voltages and frequencies. None selects everything.
+def FilterExperiments(experimentNames, numbers=None, voltages=None, frequencies=None):
+    if numbers is not None:
+        numbers = set(number.upper() if number.upper().startswith("EXP") else "EXP" + number.upper()
+                      for number in numbers)
+    if voltages is not None:
+        voltages = set(voltage.replace('_', '.') for voltage in voltages)
+    selected = []
+    for experimentName in experimentNames:
+        expParams = ResultsFormat.ParseExperimentName(experimentName)
+        if numbers is not None and expParams["number"].upper() not in numbers:
+            continue
+        if voltages is not None and expParams["voltage"] not in voltages:
+            continue
+        if frequencies is not None and expParams["frequency"] not in frequencies:
+            continue
+        selected.append(experimentName)
+    return selected
+
+# Returns the sha256 checksum of a file as a hex string.
+def FileChecksum(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as checkedFile:
+        for chunk in iter(lambda: checkedFile.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Returns the path of the results file of an experiment in the given results format.
+def ResultsPath(rootDir, experimentName, resultsFormat):
+    prefix = ResultsFormat.ResultsPrefix(rootDir, experimentName)
+    return prefix + (ResultsFormat.BINARY_EXTENSION if resultsFormat == "binary" else ".results")
+
+# Counts the readings in a results file without loading it.
+def CountSamples(path):
+    if path.endswith(ResultsFormat.BINARY_EXTENSION):
+        header, offset = ResultsFormat.ReadBinaryHeader(path)
+        return (os.path.getsize(path) - offset) // ResultsFormat.BINARY_RECORD_SIZE
+    count = 0
+    with open(path, "rb") as results:
+        for line in results:
+            if line.strip():
+                count += 1
+    return count
+
+# Append only journal of a campaign.
+# arg 1 path of the journal file, created if it does not exist
+class CampaignJournal:
+    def __init__(self, path):
+        self.path = path
+        # Last record of every experiment.
+        self.last = {}
+        # Time the last record of every experiment was written in this run, to time the steps.
+        self.stepStart = {}
+        self.lock      = threading.Lock()
+        if os.path.exists(path):
+            self.Load()
+        self.file = open(path, "a")
+
+    # Replays the journal. A line cut short by a crash is ignored.
+    def Load(self):
+        with open(self.path, "r") as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                self.last[record["experiment"]] = record
+
+    # Appends a record and makes sure it is on disk before returning. Safe to call from several threads.
+    def Record(self, experimentName, state, **details):
+        record = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "experiment": experimentName, "state": state}
+        with self.lock:
+            now = time.monotonic()
+            if experimentName in self.stepStart:
+                record["stepSeconds"] = now - self.stepStart[experimentName]
+            self.stepStart[experimentName] = now
+            record.update(details)
+            self.file.write(json.dumps(record) + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.last[experimentName] = record
+
+    # Last state recorded for an experiment, None if it never started.
+    def State(self, experimentName):
+        record = self.last.get(experimentName)
+        return record["state"] if record is not None else None
+
+    # True if the last run of an experiment validated and its results file is unchanged since.
+    def IsComplete(self, rootDir, experimentName):
+        if self.State(experimentName) != "validated":
+            return False
+        record = self.last[experimentName]
+        path   = os.path.join(rootDir, experimentName, record["file"])
+        return os.path.exists(path) and os.path.getsize(path) == record["bytes"] and \
+               FileChecksum(path) == record["checksum"]
+
+    # Checks that the results file of an experiment holds every captured sample and records the outcome.
+    # Returns True if the results validated.
+    def Validate(self, rootDir, experimentName, resultsFormat, capturedSamples):
+        path = ResultsPath(rootDir, experimentName, resultsFormat)
+        if not os.path.exists(path):
+            self.Record(experimentName, "failed", reason="no results file")
+            return False
+        samples = CountSamples(path)
+        if samples != capturedSamples or samples == 0:
+            self.Record(experimentName, "failed", reason="results file has " + str(samples) + " of " +
+                        str(capturedSamples) + " samples")
+            return False
+        self.Record(experimentName, "validated", file=os.path.basename(path), samples=samples,
+                    bytes=os.path.getsize(path), checksum=FileChecksum(path))
+        return True
+
+    def Close(self):
+        self.file.close()
+
+# Opens the journal of a campaign from the options added by AddCampaignArguments.
+def JournalFromArgs(args, rootDir):
+    return CampaignJournal(args.journal if args.journal is not None else os.path.join(rootDir, JOURNAL_NAME))
+
+# Returns the experiments of the matrix selected by the options of AddMatrixArguments, --numbers,
+# --voltages and --frequencies, in the order of the matrix. The shard is taken after every other option.
+# arg 1 parsed options
+# arg 2 names of the benches whose sets are selected, None for every bench
+def SelectFromMatrix(args, benches=None):
+    experimentNames = (experiment["name"] for experiment in ExperimentMatrix.ExperimentsFromArgs(args, benches))
+    selected = FilterExperiments(experimentNames, args.numbers, args.voltages, args.frequencies)
+    return list(ExperimentMatrix.ShardFromArgs(args, selected))
+
+# Returns the experiments under rootDir a run script should run, after the selection options and, with
+# --resume, without the experiments the journal records as complete. Experiments of the matrix without a
+# folder under rootDir were not built and are left out.
+# arg 4 names of the benches whose sets are run, None for every bench, see ExperimentMatrix.Expand
+def SelectExperiments(args, rootDir, journal, benches=None):
+    selected = SelectFromMatrix(args, benches)
+    experimentNames = [d for d in selected if os.path.isdir(os.path.join(rootDir, d))]
+    if len(experimentNames) < len(selected):
+        print(str(len(selected) - len(experimentNames)) + " of " + str(len(selected)) +
+              " selected experiments are not built and are left out")
+    if not args.resume:
+        return experimentNames
+    remaining = [d for d in experimentNames if not journal.IsComplete(rootDir, d)]
+    print("Resuming, " + str(len(experimentNames) - len(remaining)) + " of " + str(len(experimentNames)) +
+          " experiments already complete")
+    return remaining
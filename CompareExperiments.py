@@ -0,0 +1,67 @@
+#! /bin/python
+# Compares experiments across a campaign from the consolidated dataset, see Dataset.py.
+#
+#     python CompareExperiments.py ../Experiments --build
+#     python CompareExperiments.py ../Experiments --numbers 00 --x frequency --by voltage --plot EXP00.png
+#     python CompareExperiments.py ../Experiments --group number --y median --frequencies LF
+#
+# With --x a statistic is printed against one column, one curve per value of the --by column, and plotted
+# with --plot. With --group the statistic of every group of experiments is printed. The readings are only
+# read with --build, for the experiments whose results changed, and for medians.
+
+# Used to parse the command line options.
+import argparse
+# Used to time the queries.
+import time
+
+import Dataset
+import StatsIndex
+
+parser = argparse.ArgumentParser(description="Compare experiments across a campaign.")
+parser.add_argument("root", help="root directory of the experiments")
+parser.add_argument("--dataset", default=None,
+                    help="dataset folder (default " + Dataset.DATASET_NAME + " in the experiments folder)")
+parser.add_argument("--build", action="store_true", help="bring the dataset up to date before the query")
+parser.add_argument("--archive", default=None,
+                    help="build the dataset from this campaign archive instead of the experiment folders")
+parser.add_argument("--numbers", nargs="*", default=None, help="only these experiment numbers")
+parser.add_argument("--voltages", nargs="*", default=None, help="only experiments at these voltages")
+parser.add_argument("--frequencies", nargs="*", default=None, help="only experiments at these frequencies")
+parser.add_argument("--types", nargs="*", choices=["MCU", "SYSTEM"], default=None,
+                    help="only MCU or SYSTEM experiments")
+parser.add_argument("--x", choices=Dataset.KEY_COLUMNS, default=None, help="column to sweep the statistic against")
+parser.add_argument("--by", choices=Dataset.KEY_COLUMNS, default=None, help="column with one curve per value")
+parser.add_argument("--group", nargs="*", choices=Dataset.KEY_COLUMNS, default=None,
+                    help="columns to group the experiments by (default experiment)")
+parser.add_argument("--y", choices=Dataset.STATISTICS, default="mean", help="statistic to compare (default mean)")
+parser.add_argument("--plot", default=None, help="save a plot of the sweep, PNG or PDF by extension")
+parser.add_argument("--title", default=None, help="title of the plot")
+args = parser.parse_args()
+if args.plot is not None and args.x is None:
+    parser.error("--plot needs --x")
+
+directory = args.dataset if args.dataset is not None else Dataset.DatasetPath(args.root)
+if args.build:
+    start = time.monotonic()
+    rows, read = Dataset.BuildDataset(args.root, directory, args.archive)
+    print("Dataset has " + str(len(rows)) + " experiments and " + str(sum(row["count"] for row in rows)) +
+          " readings, " + str(len(read)) + " read in " + "{0:.1f}".format(time.monotonic() - start) + " s")
+
+start    = time.monotonic()
+dataset  = Dataset.CampaignDataset(directory)
+selected = dataset.Select(args.numbers, args.voltages, args.frequencies, args.types)
+if args.x is not None:
+    sweep = dataset.Sweep(args.x, args.y, args.by, selected)
+    for curve in sorted(sweep, key=StatsIndex.NumericSortKey):
+        if args.by is not None:
+            print(args.by + " " + curve)
+        for x, value in sweep[curve]:
+            print(str(x) + "," + str(value))
+    if args.plot is not None:
+        Dataset.PlotSweep(sweep, args.plot, args.x, args.y, args.by, args.title)
+else:
+    keys = args.group if args.group else ["experiment"]
+    print(",".join(keys + [args.y]))
+    for groupValues, value in dataset.GroupBy(keys, args.y, selected):
+        print(",".join(list(groupValues) + [str(value)]))
+print("{0:.3f}".format(time.monotonic() - start) + " s")
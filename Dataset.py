@@ -0,0 +1,293 @@
+# Consolidated dataset of every reading of a campaign.
+#
+# Comparing operating points means reading the results of many experiments, one file at a time. The
+# dataset holds every reading of the campaign in one column, Experiments/campaign_dataset/current.f4,
+# float32 milliamps one experiment after the other, that is memory mapped instead of read. Next to it
+# experiments.csv has one row per experiment with its parameters, parsed from the experiment name like
+# everywhere else, the position and number of its readings in the column and their count, mean, sum of
+# squared differences from the mean, minimum and maximum.
+#
+# Grouped statistics are computed from the rows with numpy, one pass over the experiments and not over
+# the readings, so the mean current against frequency for every voltage of a whole campaign takes
+# milliseconds. Only medians read the readings, straight from the memory mapped column.
+#     dataset = Dataset.CampaignDataset(Dataset.DatasetPath(rootDir))
+#     sweep = dataset.Sweep("frequency", "mean", "voltage", dataset.Select(numbers=["00"]))
+#     Dataset.PlotSweep(sweep, "EXP00.png", "frequency", "mean", "voltage")
+#
+# Building the dataset reads the results through PostProcessing.OpenResults, so it can be built from the
+# experiment folders or from a campaign archive. Rebuilding it copies the readings of experiments whose
+# results did not change from the previous dataset and only reads the results of the others.
+
+# Used to build file paths.
+import os
+# Used to read and write the experiments table.
+import csv
+# Used to hold and process the readings.
+import numpy as np
+
+import Campaign
+import PostProcessing
+import ResultsFormat
+import Statistics
+import StatsIndex
+
+# Name of the dataset folder in the experiments root directory.
+DATASET_NAME = "campaign_dataset"
+# Name of the column of readings in the dataset folder.
+CURRENT_NAME = "current.f4"
+# Name of the experiments table in the dataset folder.
+TABLE_NAME   = "experiments.csv"
+# Type of the readings in the column, milliamps.
+CURRENT_TYPE = np.dtype("<f4")
+# Columns identifying an experiment.
+KEY_COLUMNS  = StatsIndex.KEY_COLUMNS
+# Columns locating the readings of an experiment in the column of readings.
+SEGMENT_COLUMNS = ["start", "count"]
+# Columns holding the statistics of the readings of an experiment, see Statistics.RunningStats.
+MOMENT_COLUMNS = ["mean", "m2", "min", "max"]
+# Columns describing the results the readings were read from.
+SOURCE_COLUMNS = ["bytes", "mtime"]
+COLUMNS = KEY_COLUMNS + SEGMENT_COLUMNS + MOMENT_COLUMNS + SOURCE_COLUMNS
+# Statistics a group of experiments can be summarized with. The variance and std are of every reading of
+# the group, the same as np.var and np.std of the readings.
+STATISTICS = ["count", "mean", "variance", "std", "min", "max", "median"]
+# Readings copied at once from the previous dataset.
+COPY_READINGS = 1 << 22
+
+# Returns the default path of the dataset of a campaign.
+def DatasetPath(rootDir):
+    return os.path.join(rootDir, DATASET_NAME)
+
+# Loads the experiments table of a dataset. Returns a list of rows in the order of their readings, empty if
+# there is no dataset yet. Positions and statistics are converted to numbers, the parameters are strings.
+def LoadTable(directory):
+    path = os.path.join(directory, TABLE_NAME)
+    if not os.path.exists(path):
+        return []
+    rows = []
+    with open(path, "r", newline="") as tableFile:
+        for row in csv.DictReader(tableFile):
+            for column in SEGMENT_COLUMNS + ["bytes"]:
+                row[column] = int(row[column])
+            for column in MOMENT_COLUMNS + ["mtime"]:
+                row[column] = float(row[column])
+            rows.append(row)
+    return rows
+
+# Writes the experiments table of a dataset.
+def SaveTable(rows, path):
+    with open(path, "w", newline="") as tableFile:
+        writer = csv.DictWriter(tableFile, fieldnames=COLUMNS)
+        writer.writeheader()
+        for row in rows:
+            row = dict(row)
+            for column in MOMENT_COLUMNS + ["mtime"]:
+                row[column] = repr(row[column])
+            writer.writerow(row)
+
+# Opens the column of readings of a dataset read only. Returns an empty array if it holds no readings.
+def OpenCurrent(directory, count):
+    if count == 0:
+        return np.zeros(0, dtype=CURRENT_TYPE)
+    return np.memmap(os.path.join(directory, CURRENT_NAME), dtype=CURRENT_TYPE, mode="r", shape=(count,))
+
+# Builds or brings up to date the dataset of a campaign. The column and the table are replaced only once
+# both are complete.
+# arg 1 root directory of the experiments
+# arg 2 dataset folder, created if it does not exist
+# arg 3 optional path of a campaign archive the results are read from instead of the experiment folders
+# arg 4 optional function called with the name of every experiment whose results were read
+# Returns a tuple of (rows of the table, names of the experiments whose results were read).
+# Experiments without readings are left out.
+def BuildDataset(rootDir, directory, archivePath=None, progressFunction=None):
+    os.makedirs(directory, exist_ok=True)
+    currentPath = os.path.join(directory, CURRENT_NAME)
+    tablePath   = os.path.join(directory, TABLE_NAME)
+    previousRows = LoadTable(directory)
+    previous     = dict((row["experiment"], row) for row in previousRows)
+    previousCurrent = OpenCurrent(directory, sum(row["count"] for row in previousRows)) \
+                      if os.path.exists(currentPath) else None
+    results = PostProcessing.OpenResults(rootDir, archivePath)
+    rows = []
+    read = []
+    position = 0
+    with open(currentPath + ".tmp", "wb") as currentFile:
+        for experimentName in results.Experiments():
+            if not results.HasResults(experimentName):
+                continue
+            source = {"bytes": results.ResultsSize(experimentName), "mtime": results.ResultsTime(experimentName)}
+            row = previous.get(experimentName)
+            if previousCurrent is not None and row is not None and \
+               row["bytes"] == source["bytes"] and row["mtime"] == source["mtime"]:
+                for start in range(row["start"], row["start"] + row["count"], COPY_READINGS):
+                    currentFile.write(previousCurrent[start:min(start + COPY_READINGS,
+                                                                row["start"] + row["count"])].tobytes())
+                row = dict(row)
+            else:
+                moments = Statistics.RunningStats()
+                for chunk in results.ReadCurrentChunks(experimentName):
+                    moments.AddArray(chunk)
+                    currentFile.write(chunk.astype(CURRENT_TYPE).tobytes())
+                if moments.count == 0:
+                    continue
+                expParams = ResultsFormat.ParseExperimentName(experimentName)
+                row = {"experiment": experimentName, "number": expParams["number"],
+                       "type": "SYSTEM" if expParams["config"] else "MCU",
+                       "frequency": expParams["frequency"], "voltage": expParams["voltage"],
+                       "config": expParams["config"], "count": moments.count, "mean": moments.mean,
+                       "m2": moments.m2, "min": moments.minimum, "max": moments.maximum}
+                row.update(source)
+                read.append(experimentName)
+                if progressFunction is not None:
+                    progressFunction(experimentName)
+            row["start"] = position
+            position += row["count"]
+            rows.append(row)
+    results.Close()
+    del previousCurrent
+    SaveTable(rows, tablePath + ".tmp")
+    os.replace(currentPath + ".tmp", currentPath)
+    os.replace(tablePath + ".tmp", tablePath)
+    return (rows, read)
+
+# Every reading of a campaign with the parameters of the experiment it belongs to.
+# arg 1 dataset folder, see BuildDataset
+class CampaignDataset:
+    def __init__(self, directory):
+        self.rows    = LoadTable(directory)
+        self.names   = [row["experiment"] for row in self.rows]
+        self.columns = dict((column, np.array([row[column] for row in self.rows]))
+                            for column in KEY_COLUMNS + SEGMENT_COLUMNS + MOMENT_COLUMNS)
+        if not self.rows:
+            # Empty columns keep their types so the grouped statistics still work.
+            self.columns.update((column, np.zeros(0, dtype=np.int64)) for column in SEGMENT_COLUMNS)
+            self.columns.update((column, np.zeros(0)) for column in MOMENT_COLUMNS)
+        self.current = OpenCurrent(directory, int(self.columns["count"].sum()))
+
+    # Returns the positions in the table of the experiments matching the selection. None selects everything.
+    # numbers, voltages and frequencies are matched like the --numbers, --voltages and --frequencies
+    # options, types is a list of MCU and SYSTEM.
+    def Select(self, numbers=None, voltages=None, frequencies=None, types=None):
+        selected = set(Campaign.FilterExperiments(self.names, numbers, voltages, frequencies))
+        return np.array([index for index, row in enumerate(self.rows)
+                         if row["experiment"] in selected and (types is None or row["type"] in types)],
+                        dtype=np.int64)
+
+    # Returns the readings of an experiment in milliamps, memory mapped.
+    def Current(self, experimentName):
+        row = self.rows[self.names.index(experimentName)]
+        return self.current[row["start"]:row["start"] + row["count"]]
+
+    # Returns a column of the table repeated for every reading of the selected experiments, to tag the
+    # readings returned by Readings.
+    def Tags(self, column, selected=None):
+        selected = self.AllRows(selected)
+        return np.repeat(self.columns[column][selected], self.columns["count"][selected])
+
+    # Returns the readings of the selected experiments in milliamps, one experiment after the other.
+    def Readings(self, selected=None):
+        selected = self.AllRows(selected)
+        if len(selected) == len(self.rows):
+            return self.current
+        return np.concatenate([self.current[self.columns["start"][index]:
+                                            self.columns["start"][index] + self.columns["count"][index]]
+                               for index in selected] + [np.zeros(0, dtype=CURRENT_TYPE)])
+
+    # Returns the selected positions as an array, every experiment if selected is None.
+    def AllRows(self, selected):
+        return np.arange(len(self.rows)) if selected is None else np.asarray(selected, dtype=np.int64)
+
+    # Summarizes groups of experiments.
+    # arg 1 list of table columns the experiments are grouped by, for example ["voltage", "frequency"]
+    # arg 2 statistic of every group, see STATISTICS
+    # arg 3 positions of the experiments in the table, see Select, None for every experiment
+    # Returns a list of (tuple of the group values, statistic), sorted by the group values as numbers first.
+    def GroupBy(self, keys, statistic="mean", selected=None):
+        if statistic not in STATISTICS:
+            raise ValueError("unknown statistic " + statistic)
+        selected = self.AllRows(selected)
+        if len(selected) == 0:
+            return []
+        keyValues = np.stack([self.columns[key][selected].astype(str) for key in keys], axis=1)
+        groups, group = np.unique(keyValues, axis=0, return_inverse=True)
+        group  = group.ravel()
+        count  = self.columns["count"][selected]
+        mean   = self.columns["mean"][selected]
+        # Counts, means and sums of squared differences of the experiments merged per group, the
+        # vectorized form of Statistics.RunningStats.MergeValues.
+        groupCount = np.bincount(group, weights=count)
+        groupMean  = np.bincount(group, weights=count * mean) / groupCount
+        groupM2    = np.bincount(group, weights=self.columns["m2"][selected] + count * (mean - groupMean[group]) ** 2)
+        if statistic == "count":
+            values = groupCount.astype(np.int64)
+        elif statistic == "mean":
+            values = groupMean
+        elif statistic == "variance":
+            values = groupM2 / groupCount
+        elif statistic == "std":
+            values = np.sqrt(groupM2 / groupCount)
+        elif statistic == "min":
+            values = np.full(len(groups), np.inf)
+            np.minimum.at(values, group, self.columns["min"][selected])
+        elif statistic == "max":
+            values = np.full(len(groups), -np.inf)
+            np.maximum.at(values, group, self.columns["max"][selected])
+        else:
+            values = np.array([np.median(self.Readings(selected[group == index])) for index in range(len(groups))])
+        summary = [(tuple(groupValues), value.item()) for groupValues, value in zip(groups.tolist(), values)]
+        return sorted(summary, key=lambda pair: [StatsIndex.NumericSortKey(value) for value in pair[0]])
+
+    # Returns a sweep of a statistic against a column, one curve per value of another column.
+    # arg 1 column on the x axis, for example frequency
+    # arg 2 statistic on the y axis, see STATISTICS
+    # arg 3 column with one curve per value, for example voltage, None for a single curve
+    # arg 4 positions of the experiments in the table, see Select, None for every experiment
+    # Returns a dictionary of curve value ("" for a single curve) to a list of (x, statistic) sorted by x.
+    def Sweep(self, xColumn, statistic="mean", byColumn=None, selected=None):
+        sweep = {}
+        if byColumn is None:
+            for (x,), value in self.GroupBy([xColumn], statistic, selected):
+                sweep.setdefault("", []).append((x, value))
+            return sweep
+        for (curve, x), value in self.GroupBy([byColumn, xColumn], statistic, selected):
+            sweep.setdefault(curve, []).append((x, value))
+        return sweep
+
+# Plots a sweep, one curve per value, and saves the plot. The format follows the extension of the path.
+# arg 1 sweep, see CampaignDataset.Sweep
+# arg 2 path of the plot
+# arg 3 column on the x axis
+# arg 4 statistic on the y axis
+# arg 5 column of the curves, None for a single curve
+# arg 6 optional title
+# Numeric x values are plotted at their value, on a logarithmic axis if they span more than a decade,
+# other values such as LF are plotted as categories.
+def PlotSweep(sweep, plotPath, xColumn, statistic, byColumn=None, title=None):
+    # Plots are only saved, a non interactive backend avoids starting a GUI toolkit.
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    xValues = sorted(set(x for curve in sweep.values() for x, value in curve), key=StatsIndex.NumericSortKey)
+    numeric = all(StatsIndex.NumericSortKey(x)[0] == 0 for x in xValues)
+    figure, axes = plt.subplots()
+    for curve in sorted(sweep, key=StatsIndex.NumericSortKey):
+        points = sweep[curve]
+        xs = [float(x) if numeric else xValues.index(x) for x, value in points]
+        axes.plot(xs, [value for x, value in points], marker="o", linewidth=1,
+                  label=(byColumn + " " + curve) if byColumn is not None else None)
+    if numeric and xValues and float(xValues[0]) > 0 and float(xValues[-1]) > 10 * float(xValues[0]):
+        axes.set_xscale("log")
+    # One tick at every value of the sweep, labeled as in the experiment names.
+    axes.set_xticks([float(x) for x in xValues] if numeric else range(len(xValues)))
+    axes.set_xticklabels(xValues, rotation=45, ha="right")
+    axes.minorticks_off()
+    axes.set_xlabel(xColumn)
+    axes.set_ylabel(statistic + (" (mA)" if statistic not in ["count", "variance"] else ""))
+    if title is not None:
+        axes.set_title(title)
+    if byColumn is not None:
+        axes.legend()
+    axes.grid(True, alpha=0.3)
+    figure.tight_layout()
+    figure.savefig(plotPath, format=os.path.splitext(plotPath)[1][1:].lower() or "png")
+    plt.close(figure)
@@ -0,0 +1,151 @@
+# Charge, energy and activity events of a capture.
+#
+# The sensor and XBee experiments spend most of their time asleep and wake up periodically to read a
+# sensor or transmit. What matters for them is the energy of every wake up, not the statistics of the
+# whole capture. The readings are integrated over time with the trapezoidal rule to get the charge. The
+# current times the voltage is integrated the same way to get the energy, with the voltage the supply
+# measured during the capture if it was read back, see Acquisition.SupplyReadback, otherwise the nominal
+# voltage of the experiment.
+#
+# Activity events are found with two thresholds. An event starts when the current rises to the high
+# threshold and ends when it falls below the low threshold, so noise around a single threshold does not
+# split an event in many. Unless given, the thresholds are placed between the baseline current (the
+# median) and the peak current (the 99.9th percentile) at EVENT_HIGH_FRACTION and EVENT_LOW_FRACTION of
+# the way up. Every step is a vectorized pass over the readings, so the analysis takes linear time.
+#
+# Only complete events are reported, an event cut by the start or the end of the capture is left out.
+# For every event
+#   start         seconds from the start of the capture
+#   duration      seconds the current was above the thresholds
+#   period        seconds to the start of the next event, nan for the last event
+#   duty cycle    duration / period
+#   charge        coulombs drawn during the event
+#   energy        joules drawn during the event
+#   cycle energy  joules drawn from the start of the event to the start of the next event, a whole
+#                 wake and sleep cycle
+#   peak          highest current of the event in milliamps
+
+# Used to process the readings.
+import numpy as np
+
+import ResultsFormat
+
+# Fraction of the way from the baseline to the peak current an event starts at.
+EVENT_HIGH_FRACTION = 0.5
+# Fraction of the way from the baseline to the peak current an event ends at.
+EVENT_LOW_FRACTION  = 0.25
+# Percentile of the readings taken as the peak current.
+PEAK_PERCENTILE     = 99.9
+# Columns of the event lines of a .events file.
+EVENT_COLUMNS = ["start_s", "duration_s", "period_s", "duty_cycle", "charge_C", "energy_J", "cycle_energy_J",
+                 "peak_mA"]
+# Columns of the summary line of a .events file.
+SUMMARY_COLUMNS = ["samples", "duration_s", "voltage_V", "charge_C", "energy_J", "mean_power_W", "low_mA",
+                   "high_mA", "events", "mean_period_s", "mean_duty_cycle", "mean_event_energy_J",
+                   "mean_cycle_energy_J"]
+
+# Returns the cumulative integral over time of a quantity at every reading, 0 at the first reading.
+# arg 1 times of the readings in seconds
+# arg 2 value of the quantity at every reading
+def CumulativeIntegral(times, values):
+    integral = np.empty(len(values), dtype=np.float64)
+    if len(values) == 0:
+        return integral
+    integral[0] = 0.0
+    np.cumsum((values[1:] + values[:-1]) * 0.5 * np.diff(times), out=integral[1:])
+    return integral
+
+# Returns the event thresholds in milliamps as a tuple of (low, high).
+def EventThresholds(current, low=None, high=None):
+    if low is None or high is None:
+        baseline, peak = np.percentile(current, [50, PEAK_PERCENTILE])
+        if high is None:
+            high = baseline + EVENT_HIGH_FRACTION * (peak - baseline)
+        if low is None:
+            low = baseline + EVENT_LOW_FRACTION * (peak - baseline)
+    return (float(low), float(high))
+
+# Finds the activity events with hysteresis.
+# arg 1 readings in milliamps
+# arg 2 current in milliamps an event ends below
+# arg 3 current in milliamps an event starts at
+# Returns a tuple of (index of the first reading of every event, index of the first reading after it).
+def FindEvents(current, low, high):
+    # 1 where the current starts or continues an event, 0 where it ends one and -1 in between, where the
+    # state stays what it was. The state is carried forward from the last reading that set it.
+    mark  = np.where(current >= high, 1, np.where(current < low, 0, -1)).astype(np.int8)
+    index = np.where(mark >= 0, np.arange(len(mark)), 0)
+    np.maximum.accumulate(index, out=index)
+    state = np.where(mark[index] > 0, 1, 0).astype(np.int8)
+    edges  = np.diff(state)
+    starts = np.flatnonzero(edges == 1) + 1
+    ends   = np.flatnonzero(edges == -1) + 1
+    # An event running when the capture starts or ends is incomplete.
+    if len(current) and state[0] == 1:
+        ends = ends[1:]
+    starts = starts[:len(ends)]
+    return (starts, ends)
+
+# Analyzes a capture.
+# arg 1 times of the readings in seconds
+# arg 2 readings in milliamps
+# arg 3 supply voltage in volts, one value or the voltage at every reading
+# arg 4 optional current in milliamps events end below
+# arg 5 optional current in milliamps events start at
+# Returns a dictionary with the SUMMARY_COLUMNS and "eventRows", a 2D array with one row of EVENT_COLUMNS
+# for every event.
+def AnalyzeEvents(times, current, voltage, low=None, high=None):
+    times   = np.asarray(times, dtype=np.float64)
+    current = np.asarray(current, dtype=np.float64)
+    if len(current) < 2:
+        raise ValueError("not enough readings")
+    voltage   = np.broadcast_to(np.asarray(voltage, dtype=np.float64), current.shape)
+    charge    = CumulativeIntegral(times, current / 1000)
+    energy    = CumulativeIntegral(times, current * voltage / 1000)
+    low, high = EventThresholds(current, low, high)
+    starts, ends = FindEvents(current, low, high)
+
+    rows = np.full((len(starts), len(EVENT_COLUMNS)), np.nan)
+    rows[:, 0] = times[starts] - times[0]
+    rows[:, 1] = times[ends] - times[starts]
+    rows[:-1, 2] = np.diff(times[starts])
+    rows[:, 3] = rows[:, 1] / rows[:, 2]
+    rows[:, 4] = charge[ends] - charge[starts]
+    rows[:, 5] = energy[ends] - energy[starts]
+    rows[:-1, 6] = np.diff(energy[starts])
+    if len(starts):
+        rows[:, 7] = np.maximum.reduceat(current, np.column_stack((starts, ends)).ravel())[0::2]
+
+    duration = times[-1] - times[0]
+    summary  = {"samples":    len(current),
+                "duration_s": duration,
+                "voltage_V":  np.mean(voltage),
+                "charge_C":   charge[-1],
+                "energy_J":   energy[-1],
+                "mean_power_W": energy[-1] / duration if duration > 0 else np.nan,
+                "low_mA":     low,
+                "high_mA":    high,
+                "events":     len(starts)}
+    complete = len(starts) > 1
+    summary["mean_period_s"]       = np.mean(rows[:-1, 2]) if complete else np.nan
+    summary["mean_duty_cycle"]     = np.mean(rows[:-1, 3]) if complete else np.nan
+    summary["mean_event_energy_J"] = np.mean(rows[:, 5]) if len(starts) else np.nan
+    summary["mean_cycle_energy_J"] = np.mean(rows[:-1, 6]) if complete else np.nan
+    summary["eventRows"] = rows
+    return summary
+
+# Writes the analysis of a capture to a .events file.
+# The file starts with comment lines, the experiment, the summary columns, the summary values and the event
+# columns, followed by one line for every event. Values that do not exist, like the period of the last
+# event, are written as nan, so the events load with np.loadtxt(path, delimiter=",", ndmin=2).
+def WriteEvents(analysis, eventsPath, experimentName):
+    expParams = ResultsFormat.ParseExperimentName(experimentName)
+    rows = analysis["eventRows"]
+    with open(eventsPath, "w") as eventsFile:
+        eventsFile.write("# " + ",".join([expParams["number"], "SYSTEM" if expParams["config"] else "MCU",
+                                          expParams["frequency"], expParams["voltage"]]) + "\n")
+        eventsFile.write("# " + ",".join(SUMMARY_COLUMNS) + "\n")
+        eventsFile.write("# " + ",".join("{0:.6g}".format(analysis[column]) for column in SUMMARY_COLUMNS) + "\n")
+        eventsFile.write("# " + ",".join(EVENT_COLUMNS) + "\n")
+        if len(rows):
+            np.savetxt(eventsFile, rows, fmt="%.6g", delimiter=",")
@@ -0,0 +1,162 @@
+# Declarative matrix of the experiments of a campaign.
+#
+# Every experiment of the campaign is described once, in a JSON file, Matrix.json next to the scripts by
+# default, instead of in the loops of the build script and again in the folder names the run scripts split.
+# The file holds named sweeps, lists of values shared by several sets, and a list of experiment sets.
+#   name            name of the set, used to select it with --sets
+#   experiments     experiment numbers without EXP, for example "00" or "13A"
+#   frequencies     list of frequencies or the name of a sweep, LF for the low frequency experiments
+#   voltages        list of voltages in volts or the name of a sweep
+#   config          optional suffix of the experiment names, system experiments have one
+#   buildFrequency  optional DCO frequency the executables are built with, for sets whose frequency is
+#                   not a DCO frequency such as LF
+#   bench           optional name of the bench that runs the set, see Benches.json. Setup1 and Setup2 only
+#                   run the sets of their bench, sets without a bench run on any bench that can supply
+#                   their voltage
+#   order           optional nesting of the loops over "experiment", "frequency" and "voltage", outermost
+#                   first (default frequency, voltage, experiment)
+#
+# Expand is a generator, the experiments are produced one at a time in the order of the sets, so the
+# build script, the run scripts and the post processing all walk the same matrix without building a list
+# of every experiment or listing the experiments folder. Every experiment is a dictionary with its "name"
+# in the EXP#-VOLTAGE-FREQUENCY[-config] format, "set", "number" (EXP#), "experiment", "frequency",
+# "voltage" with a decimal point, "config", "bench", "buildFrequency" and the "define" that selects it in
+# the firmware.
+#
+# --sets and --match select a part of the matrix, --match takes shell patterns of experiment names, for
+# example "EXP1[3-9]*" or "*-48000000-*". --shard I/N keeps every Nth experiment starting with the Ith,
+# so N machines given the same matrix and selection with --shard 1/N to N/N split it between them
+# without overlapping. The build script shards executables, experiments that share one are built on the
+# same machine.
+
+# Used to read the matrix.
+import json
+# Used to expand the loops of a set.
+import itertools
+# Used to match experiment names to the --match patterns.
+import fnmatch
+# Used to find the default matrix next to the scripts.
+import os
+
+# Matrix used when no file is given, found next to the scripts whatever the working directory is.
+DEFAULT_MATRIX_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Matrix.json")
+# Loops of a set.
+AXES = ["experiment", "frequency", "voltage"]
+# Optional settings of a set and their defaults.
+SET_DEFAULTS = {"config": "", "buildFrequency": None, "bench": None, "order": ["frequency", "voltage", "experiment"]}
+
+# Adds the matrix options to a parser.
+def AddMatrixArguments(parser):
+    parser.add_argument("--matrix", default=DEFAULT_MATRIX_FILE,
+                        help="JSON file with the experiment matrix (default Matrix.json next to the scripts)")
+    parser.add_argument("--sets", nargs="*", default=None, help="only the experiments of these sets of the matrix")
+    parser.add_argument("--match", nargs="*", default=None,
+                        help="only the experiments whose name matches one of these patterns, for example 'EXP1[3-9]*'")
+    parser.add_argument("--shard", type=ParseShard, default=None,
+                        help="I/N, only the Ith of N equal parts of the selection, to split it between machines")
+
+# Parses a shard, I/N with I from 1 to N. Returns a tuple of (I, N).
+# Raises ValueError if the shard is not in this format.
+def ParseShard(text):
+    index, count = (int(part) for part in text.split("/"))
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError("shard " + text + " is not between 1/N and N/N")
+    return (index, count)
+
+# Reads the matrix from a JSON file.
+# Returns a dictionary with the "sweeps" and the "sets", every optional setting of the sets filled in and
+# their sweeps replaced by the values.
+# Raises ValueError if a set is missing a setting, uses an unknown sweep or loop, or two sets share a name.
+def LoadMatrix(path):
+    with open(path, "r") as matrixFile:
+        definition = json.load(matrixFile)
+    sweeps = definition.get("sweeps", {})
+    sets   = []
+    for setDefinition in definition["sets"]:
+        for key in ("name", "experiments", "frequencies", "voltages"):
+            if key not in setDefinition:
+                raise ValueError("set " + str(setDefinition.get("name")) + " has no " + key)
+        experimentSet = dict(SET_DEFAULTS)
+        experimentSet.update(setDefinition)
+        for key in ("frequencies", "voltages"):
+            if isinstance(experimentSet[key], str):
+                if experimentSet[key] not in sweeps:
+                    raise ValueError("set " + experimentSet["name"] + " uses unknown sweep " + experimentSet[key])
+                experimentSet[key] = sweeps[experimentSet[key]]
+        if sorted(experimentSet["order"]) != sorted(AXES):
+            raise ValueError("set " + experimentSet["name"] + " has order " + str(experimentSet["order"]) +
+                             ", it must hold each of " + ", ".join(AXES) + " once")
+        if any(other["name"] == experimentSet["name"] for other in sets):
+            raise ValueError("two sets are named " + experimentSet["name"])
+        sets.append(experimentSet)
+    return {"sweeps": sweeps, "sets": sets}
+
+# Returns the name of an experiment, EXP#-VOLTAGE-FREQUENCY[-config], with the decimal point of the
+# voltage replaced by an underscore.
+def ExperimentName(experiment, voltage, frequency, config=""):
+    return "EXP" + experiment + "-" + voltage.replace(".", "_") + "-" + frequency + ("-" + config if config else "")
+
+# Expands the matrix one experiment at a time.
+# arg 1 matrix, see LoadMatrix
+# arg 2 names of the sets to expand, None for every set
+# arg 3 shell patterns of experiment names, None for every experiment
+# arg 4 names of the benches whose sets are expanded, None for every bench. Sets without a bench are
+#       always expanded.
+# Yields the experiment dictionaries described at the top of this file.
+def Expand(matrix, sets=None, patterns=None, benches=None):
+    for experimentSet in matrix["sets"]:
+        if sets is not None and experimentSet["name"] not in sets:
+            continue
+        if benches is not None and experimentSet["bench"] is not None and experimentSet["bench"] not in benches:
+            continue
+        axes  = {"experiment": experimentSet["experiments"], "frequency": experimentSet["frequencies"],
+                 "voltage": [str(voltage) for voltage in experimentSet["voltages"]]}
+        order = experimentSet["order"]
+        for values in itertools.product(*(axes[axis] for axis in order)):
+            point = dict(zip(order, values))
+            name  = ExperimentName(point["experiment"], point["voltage"], point["frequency"], experimentSet["config"])
+            if patterns is not None and not any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns):
+                continue
+            yield {"name":       name,
+                   "set":        experimentSet["name"],
+                   "number":     "EXP" + point["experiment"],
+                   "experiment": point["experiment"],
+                   "frequency":  point["frequency"],
+                   "voltage":    point["voltage"],
+                   "config":     experimentSet["config"],
+                   "bench":      experimentSet["bench"],
+                   "buildFrequency": experimentSet["buildFrequency"] or point["frequency"],
+                   "define":     "USER_EXPERIMENT_" + point["experiment"]}
+
+# Keeps one shard of a sequence, lazily.
+# arg 1 iterable
+# arg 2 shard, a tuple of (I, N) as returned by ParseShard, None to keep everything
+# Yields every Nth item starting with the Ith.
+def Shard(items, shard):
+    if shard is None:
+        yield from items
+        return
+    index, count = shard
+    for position, item in enumerate(items):
+        if position % count == index - 1:
+            yield item
+
+# Expands the matrix from the options added by AddMatrixArguments, without --shard, see ShardFromArgs.
+# arg 1 parsed options
+# arg 2 names of the benches whose sets are expanded, None for every bench
+def ExperimentsFromArgs(args, benches=None):
+    return Expand(LoadMatrix(args.matrix), args.sets, args.match, benches)
+
+# Keeps the shard of a sequence given with --shard.
+def ShardFromArgs(args, items):
+    return Shard(items, args.shard)
+
+# Returns the names of every experiment of a matrix, whatever the selection options.
+def MatrixNames(matrix):
+    return set(experiment["name"] for experiment in Expand(matrix))
+
+# Returns the bench of every experiment of the matrix that has one, as a dictionary of experiment name to
+# bench name.
+def BenchAssignments(args):
+    return dict((experiment["name"], experiment["bench"]) for experiment in ExperimentsFromArgs(args)
+                if experiment["bench"] is not None)
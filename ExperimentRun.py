@@ -0,0 +1,121 @@
+# Runs one experiment on a setup, shared by RunExperiments_Setup1.py, RunExperiments_Setup2.py and the bench
+# workers of RunExperiments_Benches.py, so every run script takes the same steps.
+#   power       the supply is set to the flash voltage and turned on
+#   flash       the executable is flashed and verified, the experiment is recorded as failed if it was not
+#   powerCycle  the supply is turned off and on again at the experiment voltage, a hard reset of the target
+#   settle      the capture starts once the current drawn by the target has settled
+#   capture     the readings are taken and written to the results file, with the supply readback if asked
+#   finish      the capture summary and statistics are written and the results are validated
+# Every step is recorded in the journal and timed by the campaign metrics, see Campaign.py and
+# Instrumentation.py.
+
+import Acquisition
+import Flasher
+import ResultsFormat
+
+# Runs one experiment.
+# arg 1 experiment name, EXP#-VOLTAGE-FREQUENCY[-config]
+# arg 2 parsed options of the run script
+# arg 3 root directory of the experiments
+# arg 4 Campaign.CampaignJournal
+# arg 5 Instrumentation.CampaignMetrics
+# arg 6 Instruments.Synchronizer of the setup
+# arg 7 flasher of the setup, see Flasher.FlasherFromArgs
+# arg 8 power supply VISA resource
+# arg 9 VISA resource the readings are taken from, the multimeter or in digitizer mode the source meter
+# arg 10 read function of the acquisition mode, see Acquisition.py
+# arg 11 seconds between two readings, 0 if unknown
+# arg 12 voltage the target is flashed at, None to flash at the experiment voltage
+# arg 13 dictionary of instrument settings written to the header of binary results
+# arg 14 name of the bench running the experiment, None for the setup scripts
+# arg 15 function every message is printed with
+# Returns True if the experiment was captured, False if flashing failed.
+def RunExperiment(experimentName, args, rootDir, journal, metrics, sync, flasher, powerSupply, instrument,
+                  readFunction, sampleInterval, flashVoltage=None, settings=None, benchName=None, printFunction=print):
+    voltage      = float(ResultsFormat.ParseExperimentName(experimentName)["voltage"])
+    flashVoltage = flashVoltage if flashVoltage is not None else voltage
+    printFunction("====================================================================================================")
+    printFunction("Experiment: " + experimentName)
+    printFunction("====================================================================================================")
+    if benchName is not None:
+        journal.Record(experimentName, "started", bench=benchName)
+    else:
+        journal.Record(experimentName, "started")
+    experiment = metrics.Begin(experimentName, benchName)
+    # For flashing to work the target has to run at the flash voltage. If the previous experiment ran at the
+    # same voltage the output is already on and nothing is done.
+    sync.SetVoltage(powerSupply, flashVoltage)
+    sync.OutputOn(powerSupply, flashVoltage, 5)
+    experiment.EndPhase("power")
+    printFunction("Flashing Target")
+    # Only the flash sectors that changed since the previous experiment are programmed and they are verified,
+    # see Flasher.py.
+    flashResult = flasher.Flash(rootDir + "/" + experimentName + "/" + experimentName + ".srec")
+    Flasher.PrintFlashResult(flashResult, printFunction)
+    experiment.EndPhase("flash")
+    experiment.SplitPhase("flash", "jlinkScript", flashResult["scriptSeconds"])
+    journal.Record(experimentName, "flashed", seconds=flashResult["seconds"], written=flashResult["written"],
+                   verified=flashResult["verified"])
+    # Without the right firmware the results would be meaningless, so the experiment is skipped.
+    if not flashResult["ok"]:
+        journal.Record(experimentName, "failed", reason="flashing failed: " + flashResult["message"])
+        metrics.End(experiment)
+        return False
+    # Gives the target time to boot the new firmware. Flashing only returns once it is done, so this is only
+    # needed with fixed delays.
+    sync.Delay(5)
+    # Power cycle the target so it starts from a clean reset at the experiment voltage.
+    printFunction("Setting up power supply")
+    sync.OutputOff(powerSupply, 5)
+    sync.SetVoltage(powerSupply, voltage)
+    sync.OutputOn(powerSupply, voltage, 0.1)
+    experiment.EndPhase("powerCycle")
+    # The target has to be in its main loop when the measurements start, the capture starts once the
+    # measured current has settled.
+    settleSeconds = sync.Settle(readFunction, instrument, 5, printFunction)
+    journal.Record(experimentName, "settled", seconds=settleSeconds)
+    experiment.EndPhase("settle")
+
+    # For text results, a timebase file records when each block of readings was taken. Only digitizer sweeps
+    # have a known sample interval so it is only written in digitizer mode.
+    headerSettings = {"burstSize": args.burst_size}
+    headerSettings.update(settings or {})
+    writer = ResultsFormat.OpenResultsWriter(args.results_format, rootDir, experimentName,
+                                             "HP66311B" if args.acquisition == "digitizer" else "HP3457A",
+                                             args.acquisition, sampleInterval,
+                                             timebase=args.acquisition == "digitizer", settings=headerSettings)
+    # Keep taking measurements for 30 seconds, or with --adaptive until the mean current has converged.
+    monitor = Acquisition.ConvergenceMonitorFromArgs(args, printFunction)
+    # With --readback-seconds the supply measures its own output voltage and current during the capture.
+    readback = Acquisition.SupplyReadbackFromArgs(args, powerSupply, rootDir, experimentName)
+    if args.pipeline:
+        stats = Acquisition.AcquirePipelined(args.acquisition, instrument, writer, args.max_seconds,
+                                             args.buffer_blocks, monitor, experiment.health, readback, printFunction)
+        samples, errors, elapsed = stats["samples"], stats["errors"] + stats["corrupt"], stats["elapsed"]
+    else:
+        samples, errors, elapsed = Acquisition.Acquire(readFunction, instrument, writer, args.max_seconds, monitor,
+                                                       experiment.health, readback, printFunction)
+    writer.Close()
+    journal.Record(experimentName, "captured", samples=samples, errors=errors, seconds=elapsed)
+    experiment.Captured(samples, elapsed, stats["dropped"] if args.pipeline else 0)
+    experiment.EndPhase("capture")
+    # The achieved precision and capture length are kept next to the results.
+    Acquisition.WriteCaptureSummary(ResultsFormat.ResultsPrefix(rootDir, experimentName), monitor, elapsed)
+    # The statistics of the readings were kept during the capture, no STATS post processing is needed.
+    Acquisition.WriteCaptureStats(rootDir, experimentName, monitor)
+    if args.pipeline:
+        Acquisition.PrintPipelineStats(stats, printFunction)
+    else:
+        Acquisition.PrintAcquisitionRate(samples, errors, elapsed, printFunction)
+    Acquisition.PrintConvergence(monitor, elapsed, printFunction)
+    if readback is not None:
+        Acquisition.PrintReadback(readback, printFunction)
+    # Check the results file holds every captured sample before the experiment counts as complete.
+    if not journal.Validate(rootDir, experimentName, args.results_format, samples):
+        printFunction("Results of " + experimentName + " did not validate, it will be run again with --resume")
+    # Just provides a few seconds between experiments.
+    sync.Delay(5)
+    experiment.EndPhase("finish")
+    metrics.End(experiment)
+    printFunction("Experiment Complete")
+    return True
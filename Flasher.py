@@ -0,0 +1,362 @@
+# Flashes the experiment executables onto the MSP432.
+#
+# The run scripts used to write a J-Link Commander script and start jlink for every experiment. That starts
+# a new process, enumerates the probe, connects and erases the whole chip every time, and nobody checked
+# whether flashing worked. Three flashers are available now.
+#   session:   keeps one J-Link connection open for the whole campaign through pylink. Only the 4KB flash
+#              sectors whose contents differ from the image are erased and programmed, every programmed
+#              sector is read back and verified and every J-Link call has a timeout. Sectors the image
+#              does not use are erased if an earlier image left something in them, the whole main flash is
+#              checked on the first flash of a session. The target is connected again for every flash,
+#              it was power cycled since the previous one, the probe stays open.
+#   commander: starts jlink for every experiment like before, stops on the first error and has a timeout.
+#              The whole chip is only erased when the image uses other sectors than the previous one, else
+#              J-Link skips the sectors that already match. Every run of sectors of the image is compared
+#              with the flash by verifybin after it was loaded.
+#   sim:       used with the simulated instruments. Keeps the flash contents in memory and programs them the
+#              same way the session flasher does.
+#
+# Every flash returns a dictionary with the outcome
+#   ok        True if the image was programmed and verified
+#   seconds   seconds the flash took
+#   sectors   flash sectors in the image, None if unknown
+#   written   sectors that had to be programmed, None if unknown
+#   verified  True if the programmed sectors were read back and matched
+#   message   what went wrong if ok is False
+#   scriptSeconds  seconds spent writing the J-Link Commander script, 0 for the other flashers
+
+# Used to time the flashing.
+import time
+# Used to time out J-Link calls.
+import threading
+# Used to run J-Link Commander.
+import subprocess
+
+# Names of the flashers accepted by the run scripts.
+FLASHERS = ["session", "commander"]
+# Device name of the target as J-Link knows it.
+DEVICE = "MSP432P401R"
+# Size of a main flash sector of the MSP432P401R in bytes.
+FLASH_SECTOR_SIZE = 4096
+# Start address and size of the main flash of the MSP432P401R in bytes.
+MAIN_FLASH_START = 0x00000000
+MAIN_FLASH_SIZE  = 256 * 1024
+# Value of erased flash.
+ERASED = 0xFF
+# Default seconds a flash may take before it is abandoned.
+DEFAULT_FLASH_TIMEOUT = 60.0
+# Default SWD speed in kHz.
+DEFAULT_SPEED = 4000
+# Start of the lines J-Link Commander reports an error with.
+COMMANDER_ERRORS = ("****** Error", "ERROR:")
+
+# Adds the flashing options to a run script parser.
+def AddFlashArguments(parser):
+    parser.add_argument("--flasher", choices=FLASHERS, default="session",
+                        help="keep one J-Link session open (session, needs pylink) or start jlink for every "
+                             "experiment (commander), default session")
+    parser.add_argument("--flash-timeout", type=float, default=DEFAULT_FLASH_TIMEOUT,
+                        help="seconds a flash may take (default " + str(DEFAULT_FLASH_TIMEOUT) + ")")
+    parser.add_argument("--jlink-serial", default=None,
+                        help="serial number of the J-Link to use when more than one is connected")
+    parser.add_argument("--jlink-speed", type=int, default=DEFAULT_SPEED,
+                        help="SWD speed in kHz (default " + str(DEFAULT_SPEED) + ")")
+
+# Reads a Motorola S-record file into flash sectors.
+# Returns a dictionary of sector start address to the bytes of the sector. Bytes the file does not set
+# are left erased.
+# Raises ValueError if a record is malformed or its checksum is wrong.
+def LoadSRecord(path):
+    sectors = {}
+    with open(path, "r") as srecFile:
+        for lineNumber, line in enumerate(srecFile, 1):
+            line = line.strip()
+            if not line:
+                continue
+            if line[0] != "S" or len(line) < 4:
+                raise ValueError(path + ":" + str(lineNumber) + " is not an S-record")
+            addressLength = {"1": 2, "2": 3, "3": 4}.get(line[1])
+            if addressLength is None:
+                # Header, count and start address records carry no data.
+                continue
+            record = bytes.fromhex(line[2:])
+            if len(record) != record[0] + 1 or (sum(record[:-1]) + record[-1]) & 0xFF != 0xFF:
+                raise ValueError(path + ":" + str(lineNumber) + " has a bad length or checksum")
+            address = int.from_bytes(record[1:1 + addressLength], "big")
+            for offset, value in enumerate(record[1 + addressLength:-1]):
+                sectorStart = (address + offset) - (address + offset) % FLASH_SECTOR_SIZE
+                if sectorStart not in sectors:
+                    sectors[sectorStart] = bytearray([ERASED] * FLASH_SECTOR_SIZE)
+                sectors[sectorStart][(address + offset) - sectorStart] = value
+    return dict((start, bytes(data)) for start, data in sectors.items())
+
+# Runs a function on another thread and waits at most timeout seconds for it.
+# Returns what the function returned. Raises TimeoutError if it took too long, or what the function raised.
+# The thread still running the function is the thread attribute of the TimeoutError.
+def CallWithTimeout(function, timeout, *args):
+    result = {}
+    def Call():
+        try:
+            result["value"] = function(*args)
+        except Exception as error:
+            result["error"] = error
+    thread = threading.Thread(target=Call, name="FlashCall", daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        error = TimeoutError(getattr(function, "__name__", "J-Link call") + " took longer than " + str(timeout) + " s")
+        error.thread = thread
+        raise error
+    if "error" in result:
+        raise result["error"]
+    return result.get("value")
+
+# Returns the result dictionary of a flash.
+def FlashResult(ok, start, sectors=None, written=None, verified=False, message="", scriptSeconds=0.0):
+    return {"ok": ok, "seconds": time.monotonic() - start, "sectors": sectors, "written": written,
+            "verified": verified, "message": message, "scriptSeconds": scriptSeconds}
+
+# Returns the start address of every sector of the main flash.
+def MainFlashSectors():
+    return range(MAIN_FLASH_START, MAIN_FLASH_START + MAIN_FLASH_SIZE, FLASH_SECTOR_SIZE)
+
+# Programs only the sectors of an image that differ from the target and verifies them. Used by the
+# session and simulated flashers.
+# arg 1 dictionary of sector start address to bytes, see LoadSRecord
+# arg 2 function that reads a sector from the target, (address, size) -> bytes
+# arg 3 function that erases and programs a sector, (address, bytes) -> None
+# arg 4 start addresses of sectors that may still hold an earlier image. Those the image does not use are
+#       erased unless they already are, so nothing of a larger earlier image is left behind.
+# Returns a tuple of (sectors written or erased, True if every one of them read back correctly).
+def ProgramChangedSectors(image, readSector, writeSector, previous=()):
+    blank  = bytes([ERASED] * FLASH_SECTOR_SIZE)
+    target = dict(image)
+    for start in previous:
+        target.setdefault(start, blank)
+    changed = [start for start in sorted(target) if bytes(readSector(start, FLASH_SECTOR_SIZE)) != target[start]]
+    for start in changed:
+        writeSector(start, target[start])
+    verified = all(bytes(readSector(start, FLASH_SECTOR_SIZE)) == target[start] for start in changed)
+    return (len(changed), verified)
+
+# Closes a pylink JLink, None is ignored. A failure to close is ignored, the handle is not used again.
+def CloseJLink(jlink):
+    if jlink is not None:
+        try:
+            jlink.close()
+        except Exception:
+            pass
+
+# Keeps one J-Link connection open for the whole campaign using pylink.
+# arg 1 serial number of the J-Link, None for the only connected J-Link
+# arg 2 SWD speed in kHz
+# arg 3 seconds a flash may take
+class JLinkSession:
+    def __init__(self, serial=None, speed=DEFAULT_SPEED, timeout=DEFAULT_FLASH_TIMEOUT):
+        # Only needed with the session flasher, so the other flashers work without pylink.
+        import pylink
+        self.pylink  = pylink
+        self.serial  = serial
+        self.speed   = speed
+        self.timeout = timeout
+        self.jlink   = None
+        # Sectors programmed by the last flash, None if unknown and the whole main flash has to be checked.
+        self.programmed = None
+        # Tuple of (JLink, thread) of a call that timed out. The DLL is still busy with the handle until
+        # the thread returns, so it is not closed or reused before that.
+        self.stuck      = None
+
+    # Opens the probe if needed and connects to the target. The run scripts power cycle the target between two
+    # flashes and target_connected can still report the connection from before, so the target is always
+    # connected again.
+    # Raises RuntimeError if a call that timed out is still running after another timeout.
+    def Connect(self):
+        if self.stuck is not None:
+            jlink, thread = self.stuck
+            thread.join(self.timeout)
+            if thread.is_alive():
+                raise RuntimeError("an earlier J-Link call that timed out is still running")
+            self.stuck = None
+            CloseJLink(jlink)
+        if self.jlink is None:
+            # Kept before it is opened, so an open that times out is not closed while it runs.
+            jlink = self.pylink.JLink()
+            self.jlink = jlink
+            if self.serial is not None:
+                CallWithTimeout(jlink.open, self.timeout, int(self.serial))
+            else:
+                CallWithTimeout(jlink.open, self.timeout)
+            jlink.set_tif(self.pylink.enums.JLinkInterfaces.SWD)
+        CallWithTimeout(self.jlink.connect, self.timeout, DEVICE, self.speed)
+
+    def ReadSector(self, address, size):
+        return bytes(CallWithTimeout(self.jlink.memory_read8, self.timeout, address, size))
+
+    def WriteSector(self, address, data):
+        CallWithTimeout(self.jlink.flash_write8, self.timeout, address, list(data))
+
+    # Flashes the executable in an S-record file and starts it. Returns the result dictionary.
+    def Flash(self, srecPath):
+        start = time.monotonic()
+        try:
+            image = LoadSRecord(srecPath)
+            self.Connect()
+            CallWithTimeout(self.jlink.halt, self.timeout)
+            previous = self.programmed if self.programmed is not None else MainFlashSectors()
+            written, verified = ProgramChangedSectors(image, self.ReadSector, self.WriteSector, previous)
+            self.programmed = set(image)
+            # Reset and run the new executable.
+            CallWithTimeout(self.jlink.reset, self.timeout, 0, False)
+        except Exception as error:
+            # The connection is in an unknown state, start again on the next flash. A call that timed out
+            # still holds the handle, it is left alone and a new one is opened once the call returned.
+            thread = getattr(error, "thread", None)
+            if thread is not None:
+                self.stuck      = (self.jlink, thread)
+                self.jlink      = None
+                self.programmed = None
+            else:
+                self.Close()
+            return FlashResult(False, start, message=str(error))
+        return FlashResult(verified, start, len(image), written, verified,
+                           "" if verified else "read back does not match the image")
+
+    def Close(self):
+        CloseJLink(self.jlink)
+        self.jlink      = None
+        self.programmed = None
+        # A handle still in use by a call that timed out is abandoned, the process exits without waiting
+        # for it.
+        if self.stuck is not None and not self.stuck[1].is_alive():
+            CloseJLink(self.stuck[0])
+            self.stuck = None
+
+# Groups the sectors of an image into runs of adjacent sectors.
+# Returns a list of tuples of (start address, bytes of the run).
+def SectorRuns(image):
+    runs = []
+    for start in sorted(image):
+        if runs and runs[-1][0] + len(runs[-1][1]) == start:
+            runs[-1] = (runs[-1][0], runs[-1][1] + image[start])
+        else:
+            runs.append((start, image[start]))
+    return runs
+
+# Flashes with J-Link Commander, one jlink process for every experiment.
+# arg 1 serial number of the J-Link, None for the only connected J-Link
+# arg 2 SWD speed in kHz
+# arg 3 seconds a flash may take
+# arg 4 path of the commander script that is written for every flash
+class CommanderFlasher:
+    def __init__(self, serial=None, speed=DEFAULT_SPEED, timeout=DEFAULT_FLASH_TIMEOUT, scriptPath="jlinkScript.jlink"):
+        self.serial     = serial
+        self.speed      = speed
+        self.timeout    = timeout
+        self.scriptPath = scriptPath
+        # Sectors of the last image flashed, None before the first flash or after a failed one.
+        self.sectors    = None
+
+    def Flash(self, srecPath):
+        start = time.monotonic()
+        try:
+            image = LoadSRecord(srecPath)
+        except (IOError, ValueError) as error:
+            return FlashResult(False, start, message=str(error))
+        sectors = set(image)
+        # loadfile leaves the sectors the image does not use alone, the chip is erased when they may hold
+        # something of the previous image.
+        erase = sectors != self.sectors
+        self.sectors = None
+        with open(self.scriptPath, 'w') as file:
+            # Use SWD interface
+            file.write('If SWD\n')
+            file.write('speed ' + str(self.speed) + '\n')
+            file.write('connect\n')
+            file.write('r\n')
+            if erase:
+                file.write('erase\n')
+            # Without the erase, loadfile compares the flash with the file and only programs the sectors that differ.
+            file.write("loadfile " + srecPath + "\n")
+            # Compare the flash with the image, the bytes the image does not set are erased. With -ExitOnError
+            # jlink stops with an error if they differ.
+            for index, (address, data) in enumerate(SectorRuns(image)):
+                binPath = self.scriptPath + "." + str(index) + ".bin"
+                with open(binPath, 'wb') as binFile:
+                    binFile.write(data)
+                file.write("verifybin " + binPath + " 0x{0:08X}\n".format(address))
+            file.write('r\n')
+            file.write('g\n')
+            file.write('exit\n')
+        scriptSeconds = time.monotonic() - start
+        command = ["jlink", "-device", DEVICE, "-ExitOnError", "1", "-CommanderScript", self.scriptPath]
+        if self.serial is not None:
+            command[1:1] = ["-SelectEmuBySN", str(self.serial)]
+        try:
+            completed = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                       timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            return FlashResult(False, start, message="jlink took longer than " + str(self.timeout) + " s",
+                               scriptSeconds=scriptSeconds)
+        except OSError as error:
+            return FlashResult(False, start, message=str(error), scriptSeconds=scriptSeconds)
+        output = completed.stdout.decode(errors="replace")
+        errors = [line.strip() for line in output.splitlines() if line.strip().startswith(COMMANDER_ERRORS)]
+        if completed.returncode != 0 or errors:
+            return FlashResult(False, start, message=errors[-1] if errors else "jlink exit status " +
+                               str(completed.returncode), scriptSeconds=scriptSeconds)
+        self.sectors = sectors
+        # Every verifybin ran without an error, the flash holds the image.
+        return FlashResult(True, start, len(sectors), verified=True, scriptSeconds=scriptSeconds)
+
+    def Close(self):
+        pass
+
+# Flash of a simulated target, used with the simulated instruments.
+# arg 1 seconds programming one sector takes
+class SimulatedFlasher:
+    def __init__(self, sectorTime=0.02):
+        self.sectorTime = sectorTime
+        self.memory     = {}
+
+    def ReadSector(self, address, size):
+        return self.memory.get(address, bytes([ERASED] * size))
+
+    def WriteSector(self, address, data):
+        time.sleep(self.sectorTime)
+        self.memory[address] = bytes(data)
+
+    def Flash(self, srecPath):
+        start = time.monotonic()
+        try:
+            image = LoadSRecord(srecPath)
+        except (IOError, ValueError) as error:
+            return FlashResult(False, start, message=str(error))
+        written, verified = ProgramChangedSectors(image, self.ReadSector, self.WriteSector, list(self.memory))
+        return FlashResult(verified, start, len(image), written, verified)
+
+    def Close(self):
+        pass
+
+# Returns the flasher selected by the options added with AddFlashArguments.
+# serial overrides --jlink-serial, for benches with their own J-Link. scriptPath is the commander script.
+def FlasherFromArgs(args, serial=None, scriptPath="jlinkScript.jlink"):
+    serial = serial if serial is not None else args.jlink_serial
+    if getattr(args, "backend", "visa") == "sim":
+        return SimulatedFlasher()
+    if args.flasher == "session":
+        try:
+            return JLinkSession(serial, args.jlink_speed, args.flash_timeout)
+        except ImportError:
+            print("pylink is not installed, flashing with jlink for every experiment")
+    return CommanderFlasher(serial, args.jlink_speed, args.flash_timeout, scriptPath)
+
+# Prints the outcome of a flash with printFunction.
+def PrintFlashResult(result, printFunction=print):
+    if not result["ok"]:
+        printFunction("Flashing failed after " + "{0:.1f}".format(result["seconds"]) + " s: " + result["message"])
+        return
+    sectors = ""
+    if result["written"] is not None:
+        sectors = ", " + str(result["written"]) + " of " + str(result["sectors"]) + " sectors programmed"
+    printFunction("Flashed in " + "{0:.1f}".format(result["seconds"]) + " s" + sectors +
+          (", verified" if result["verified"] else ""))
@@ -4,116 +4,294 @@
 import os
 # Used for working with file.
 import shutil
+# Used to run make and capture its output and return code.
+import subprocess
+# Used to parse the command line options.
+import argparse
+# Used to run several builds at the same time.
+import multiprocessing
+# Used to exit with an error code when a build fails.
+import sys
+# Used to compute the keys of the build cache.
+import hashlib
+
+import ExperimentMatrix
+
+# Root folder of the firmware project. make is executed in this folder.
+FIRMWARE_DIR    = "../Firmware"
+# Root folder where each experiment gets its own folder.
+EXPERIMENTS_DIR = "../Experiments"
+# Folder used by parallel builds. Each worker gets its own copy of the firmware
+# project in here so that concurrent builds never share a Build folder.
+WORKERS_DIR     = "../BuildWorkers"
+# Folder of the build cache. Every executable that was built is stored in here under its build key,
+# the hash of the firmware project, the toolchain version and the compile time defines.
+CACHE_DIR       = "../BuildCache"
+
+# Firmware folder used by the current process. In serial mode this is the real firmware
+# folder, in parallel mode each worker process points it at its own private copy.
+workerFirmwareDir = FIRMWARE_DIR
+
+# Called once in every worker process of the parallel build pool.
+# Creates a private copy of the firmware project for the worker. The build folder is
+# not copied as it is regenerated by make.
+def InitBuildWorker(workersDir):
+    global workerFirmwareDir
+    workerFirmwareDir = os.path.join(workersDir, "worker-" + str(os.getpid()))
+    if os.path.exists(workerFirmwareDir):
+        shutil.rmtree(workerFirmwareDir)
+    shutil.copytree(FIRMWARE_DIR, workerFirmwareDir, ignore=shutil.ignore_patterns("Build"))
+
+# Returns the compile time defines passed to make for an experiment.
+# arg 1 is frequency
+# arg 2 is experiment define
+#
+# Voltage is not a compile time define, it is only set by the power supply when the experiment is run.
+# Experiments that only differ by voltage or by the config suffix therefore share the same defines and
+# the same executable.
+def CompileDefines(frequency, experimentNumber):
+    return ("CMD_LINE_DEFINED_FREQUENCY=EXP_DCO_" + frequency,
+            "CMD_LINE_DEFINED_EXPERIMENT=" + experimentNumber)
 
 # arg 1 EXP0-${v}-${f}
-# arg 2 is frequency
-# arg 3 is experiment define
-def CompileExperiment(fullExperimentName, frequency, experimentNumber):
-    # Create the name for output files. 
-    # Two output files will be created. The first is an AXF file. An AXF is needed for debugging 
+# arg 2 is the compile time defines returned by CompileDefines
+# arg 3 is the number of jobs passed to make. None passes a bare -j to make.
+#
+# Returns a tuple of (experiment name, True if build succeeded, error message).
+def CompileExperiment(fullExperimentName, defines, makeJobs=None):
+    # Create the name for output files.
+    # Two output files will be created. The first is an AXF file. An AXF is needed for debugging
     # as it contains all debug information.
-    outputAXF  = "../Experiments/" + fullExperimentName + "/" + fullExperimentName + ".axf"
+    outputAXF  = EXPERIMENTS_DIR + "/" + fullExperimentName + "/" + fullExperimentName + ".axf"
     # The srec file is used for flashing. An srec contains no debugging information.hjj
-    outputSREC = "../Experiments/" + fullExperimentName + "/" + fullExperimentName + ".srec"
+    outputSREC = EXPERIMENTS_DIR + "/" + fullExperimentName + "/" + fullExperimentName + ".srec"
+    # The output of make is saved next to the executables so a failed build can be inspected.
+    outputLOG  = EXPERIMENTS_DIR + "/" + fullExperimentName + "/" + fullExperimentName + ".buildlog"
 
     # Creates directory with for experiments.
-    # Experiments folder will be created in the root folder an found under 
+    # Experiments folder will be created in the root folder an found under
     # the directory "Experiments"
-    directoryCMD = "../Experiments/" + fullExperimentName
+    directoryCMD = EXPERIMENTS_DIR + "/" + fullExperimentName
     if not os.path.exists(directoryCMD):
-        os.mkdir(directoryCMD)
+        os.makedirs(directoryCMD, exist_ok=True)
 
-    # Each experiment generates its own executable. To make it simple to generate 
+    # Each experiment generates its own executable. To make it simple to generate
     # the executables, compile time defines are used so that one and only one experiment is included in the executable.
     #
     # To force a compile, touch the Experiments.c file. This is the file that takes the compile time defines
     # and enables or disables features that are to be used or not used during the experiment.
-    # The following command will execute in the system shell
-    os.system("touch ../Firmware/Firmware/L5_Application/Experiments/Experiments.c")
+    os.utime(workerFirmwareDir + "/Firmware/L5_Application/Experiments/Experiments.c")
     # Generate the command that will be used to compile.
-    # The software is built by using make build tool along with the frequency and voltage settings that are provided for the 
+    # The software is built by using make build tool along with the frequency and experiment settings that are provided for the
     # experiment. The following make command that is generated informs make where the executable should be built and passes
-    # the experiment configurations as compile time defines. 
-    makeCommand = "make -C  ../Firmware/ build -j CMD_LINE_DEFINED_FREQUENCY=EXP_DCO_" + frequency + " CMD_LINE_DEFINED_EXPERIMENT=" + experimentNumber
-    # Actually issue the make command in the system shell.
-    os.system(makeCommand)
-    # Move the generated axf and srec to the appropriate experiment folder. The move will rename the executable to have the 
-    # name calculated earlier so that the default axf and srec names are not used. 
-    shutil.move("../Firmware/Build/Debug/MastersProject.axf ", outputAXF)
-    shutil.move("../Firmware/Build/Debug/MastersProject.srec", outputSREC)
-
-# Range of frequencies that the MCU will be tested at.
-frequency = ['1500000', '3000000', '6000000', '12000000', '24000000', '48000000']
-# Range of voltages that the MCU will be tested at.
-voltage   = ['1_85', '2_0', '3_3']
-
-
-
-
-# Active and low power mode tests
-experimentSet1 = ['00', '02', '04', '05', '06', '07', '08', '10', '11']
-#Low frequency just runs at different voltages
-experimentSet2 = ['01', '03', '09', '12']
-
-
-# The following two experiments generators look at just the MCU performance.
-for f in frequency:
-    for v in voltage:
-        for exp in experimentSet1:
-            fullExperimentName = "EXP"+exp+"-"+v+"-"+f
-            CompileExperiment(fullExperimentName,f, "USER_EXPERIMENT_"+exp)
-
-for v in voltage:
-    for exp in experimentSet2:
-        fullExperimentName = "EXP"+exp+"-"+v+"-LF"
-        CompileExperiment(fullExperimentName, str(3000000), "USER_EXPERIMENT_"+exp)
-
-# The following two experiment generators look at the whole system performance.
-for f in frequency:
-    for v in voltage:
-        for exp in experimentSet1:
-            fullExperimentName = "EXP"+exp+"-"+v+"-"+f+"-MyConfig"
-            CompileExperiment(fullExperimentName,f, "USER_EXPERIMENT_"+exp)
-
-#Low frequency just runs at different voltages
-for v in voltage:
-    for exp in experimentSet2:
-        fullExperimentName = "EXP"+exp+"-"+v+"-LF-MyExperiment"
-        CompileExperiment(fullExperimentName, str(3000000), "USER_EXPERIMENT_"+exp)
-
-
-
-# Experiments for XBee, HDC1080, and OPT3001 timed reads
-experimentSetSensors = ['13A', '13B', '14', '15', 
-                        '16A', '16B', '17', '18', '19', '20', '21', '22',
-                        '23A', '23B', '24', '25', '26', '27', '28', '29',
-                        '37'
-                        ]
-for exp in experimentSetSensors:
-    for f in frequency:    
-        fullExperimentName = "EXP"+exp+"-"+"3_7"+"-"+f+"-MyConfig"
-        CompileExperiment(fullExperimentName,f, "USER_EXPERIMENT_"+exp)
-
-# Active and low power mode tests with XBee
-experimentSetXBee = ['30A','30B', '31', '32', '33', '34', '35', '36']
-for f in frequency:
-        for exp in experimentSetXBee:
-            fullExperimentName = "EXP"+exp+"-"+"3_7"+"-"+f+"-MyConfig"
-            CompileExperiment(fullExperimentName,f, "USER_EXPERIMENT_"+exp)
-
-
- # XBee tests at 9600 baud
-experimentSetXBee1 = ['70','71', '72', '73', '74', '75', '76', '77', '78', '79', '80', '81', '82']
-for exp in experimentSetXBee1:
-    for f in frequency:
-        fullExperimentName = "EXP"+exp+"-"+"3_7"+"-"+f+"-MyConfig"
-        CompileExperiment(fullExperimentName,f, "USER_EXPERIMENT_"+exp)
-
-# XBee tests at 115200 baud
-experimentSetXBee2 = ['83','84', '85', '86', '87', '88', '89', '90', '91', '92', '93', '94', '95']
-for exp in experimentSetXBee2:
-    for f in frequency:    
-        fullExperimentName = "EXP"+exp+"-"+"3_7"+"-"+f+"-MyConfig"
-        CompileExperiment(fullExperimentName,f, "USER_EXPERIMENT_"+exp)
+    # the experiment configurations as compile time defines.
+    makeCommand = ["make", "-C", workerFirmwareDir, "build",
+                   "-j" if makeJobs is None else "-j" + str(makeJobs)] + list(defines)
+    # Actually issue the make command. The output is written to the build log of the experiment
+    # and the return code is checked so failed builds are reported.
+    with open(outputLOG, "w") as log:
+        returnCode = subprocess.call(makeCommand, stdout=log, stderr=subprocess.STDOUT)
+    if returnCode != 0:
+        return (fullExperimentName, False, "make returned " + str(returnCode) + ", see " + outputLOG)
+
+    # Move the generated axf and srec to the appropriate experiment folder. The move will rename the executable to have the
+    # name calculated earlier so that the default axf and srec names are not used.
+    builtAXF  = workerFirmwareDir + "/Build/Debug/MastersProject.axf"
+    builtSREC = workerFirmwareDir + "/Build/Debug/MastersProject.srec"
+    if not os.path.exists(builtAXF) or not os.path.exists(builtSREC):
+        return (fullExperimentName, False, "make did not produce MastersProject.axf/srec, see " + outputLOG)
+    shutil.move(builtAXF, outputAXF)
+    shutil.move(builtSREC, outputSREC)
+    return (fullExperimentName, True, "")
+
+# Used by the process pool, unpacks one entry of the build plan.
+def CompileExperimentJob(job):
+    return CompileExperiment(*job, makeJobs=1)
+
+# Gives an experiment a set of executables that were already built. sourcePrefix is the path of the
+# executables without the .axf/.srec extension, either in another experiment folder or in the build cache.
+# A hard link is used so no extra disk space is used. If the file system does not support hard links
+# the files are copied instead.
+def LinkExperiment(sourcePrefix, fullExperimentName):
+    directoryCMD = EXPERIMENTS_DIR + "/" + fullExperimentName
+    if not os.path.exists(directoryCMD):
+        os.makedirs(directoryCMD, exist_ok=True)
+    for extension in (".axf", ".srec"):
+        target = directoryCMD + "/" + fullExperimentName + extension
+        if os.path.exists(target):
+            if os.path.samefile(sourcePrefix + extension, target):
+                continue
+            os.remove(target)
+        try:
+            os.link(sourcePrefix + extension, target)
+        except OSError:
+            shutil.copy2(sourcePrefix + extension, target)
+
+# Hashes every file of the firmware project except the generated Build folder.
+# The hash changes whenever any source file, header, linker script or makefile changes.
+def HashFirmwareTree(firmwareDir):
+    treeHash = hashlib.sha256()
+    for root, dirs, files in os.walk(firmwareDir):
+        # Walk the folders in a fixed order so the hash does not depend on the file system.
+        dirs.sort()
+        if root == firmwareDir and "Build" in dirs:
+            dirs.remove("Build")
+        for fileName in sorted(files):
+            filePath = os.path.join(root, fileName)
+            treeHash.update(os.path.relpath(filePath, firmwareDir).replace(os.sep, "/").encode())
+            with open(filePath, "rb") as sourceFile:
+                for block in iter(lambda: sourceFile.read(1 << 20), b""):
+                    treeHash.update(block)
+    return treeHash.hexdigest()
+
+# Returns the version string reported by the compiler and by make. If a tool can not be found
+# the string "unknown" is used for it, which still gives a stable key on the same machine.
+def ToolchainVersion(compiler):
+    versions = []
+    for tool in (compiler, "make"):
+        try:
+            versions.append(subprocess.check_output([tool, "--version"], stderr=subprocess.STDOUT).decode(errors="replace"))
+        except (OSError, subprocess.CalledProcessError):
+            versions.append(tool + " unknown")
+    return "\n".join(versions)
+
+# Key of an executable in the build cache. Two builds with the same key are identical.
+def BuildKey(treeHash, toolchainVersion, defines):
+    key = hashlib.sha256()
+    key.update(treeHash.encode())
+    key.update(toolchainVersion.encode())
+    key.update("\n".join(defines).encode())
+    return key.hexdigest()
+
+# Path of the executables of a key in the build cache, without the .axf/.srec extension.
+def CachePrefix(key):
+    return CACHE_DIR + "/" + key + "/MastersProject"
+
+# True if the build cache holds both executables for the key.
+def InCache(key):
+    return os.path.exists(CachePrefix(key) + ".axf") and os.path.exists(CachePrefix(key) + ".srec")
+
+# True if the executables in the experiment folder were built with the key.
+# The key of the last build is saved in the EXP#-VOLTAGE-FREQUENCY.buildkey file.
+def IsExperimentCurrent(fullExperimentName, key):
+    prefix = EXPERIMENTS_DIR + "/" + fullExperimentName + "/" + fullExperimentName
+    if not os.path.exists(prefix + ".axf") or not os.path.exists(prefix + ".srec"):
+        return False
+    try:
+        with open(prefix + ".buildkey", "r") as keyFile:
+            return keyFile.read().strip() == key
+    except OSError:
+        return False
+
+# Adds the executables of a freshly built experiment to the build cache.
+def StoreInCache(key, fullExperimentName):
+    os.makedirs(CACHE_DIR + "/" + key, exist_ok=True)
+    for extension in (".axf", ".srec"):
+        source = EXPERIMENTS_DIR + "/" + fullExperimentName + "/" + fullExperimentName + extension
+        # Copy to a temporary name first so an interrupted copy never leaves a half written
+        # executable in the cache.
+        shutil.copy2(source, CachePrefix(key) + extension + ".tmp")
+        os.replace(CachePrefix(key) + extension + ".tmp", CachePrefix(key) + extension)
+
+# Links the executables of a key from the build cache into an experiment folder and records the key.
+def CheckoutFromCache(key, fullExperimentName):
+    LinkExperiment(CachePrefix(key), fullExperimentName)
+    with open(EXPERIMENTS_DIR + "/" + fullExperimentName + "/" + fullExperimentName + ".buildkey", "w") as keyFile:
+        keyFile.write(key + "\n")
+
+# Groups the (experiment name, defines) pairs of the experiment list by their defines.
+# Returns a list of (defines, [experiment names]) in the order the defines first appear. The first
+# experiment of every group is the one that gets compiled, all others are linked to its executables.
+def PlanBuilds(experiments):
+    plan = {}
+    for fullExperimentName, defines in experiments:
+        plan.setdefault(defines, []).append(fullExperimentName)
+    return list(plan.items())
+
+# Builds the list of the experiments that have to be generated.
+# arg 1 experiments of the matrix to build, see ExperimentMatrix.Expand
+# Each entry is (experiment name, compile time defines).
+def ExperimentList(experiments):
+    return [(experiment["name"], CompileDefines(experiment["buildFrequency"], experiment["define"]))
+            for experiment in experiments]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate an executable for each experiment.")
+    # With one job the experiments are built one after the other in the firmware folder.
+    # With more than one job, a pool of worker processes is used and every worker builds
+    # in its own copy of the firmware project.
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of experiments built at the same time (default 1)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="ignore the build cache and rebuild every executable")
+    parser.add_argument("--compiler", default="arm-none-eabi-gcc",
+                        help="compiler whose version is part of the build cache key (default arm-none-eabi-gcc)")
+    # The experiments come from the matrix, --sets, --match and --shard select a part of it.
+    ExperimentMatrix.AddMatrixArguments(parser)
+    args = parser.parse_args()
+
+    experiments = ExperimentList(ExperimentMatrix.ExperimentsFromArgs(args))
+    # Only one executable is compiled for every unique set of defines. Shards split the executables, so
+    # experiments sharing an executable are built on the same machine.
+    plan = list(ExperimentMatrix.ShardFromArgs(args, PlanBuilds(experiments)))
+
+    # The firmware project and the toolchain are the same for every experiment, so they are
+    # only hashed once.
+    treeHash         = HashFirmwareTree(FIRMWARE_DIR)
+    toolchainVersion = ToolchainVersion(args.compiler)
+
+    # Executables whose key is already in the experiment folders or in the build cache are not compiled.
+    experimentResults = []
+    cacheHits   = 0
+    cacheMisses = 0
+    buildJobs   = []
+    buildGroups = []
+    for defines, names in plan:
+        key = BuildKey(treeHash, toolchainVersion, defines)
+        if not args.no_cache and InCache(key):
+            for fullExperimentName in names:
+                if not IsExperimentCurrent(fullExperimentName, key):
+                    CheckoutFromCache(key, fullExperimentName)
+                experimentResults.append((fullExperimentName, True, ""))
+            cacheHits += len(names)
+        else:
+            buildJobs.append((names[0], defines))
+            buildGroups.append((key, names))
+            cacheMisses += len(names)
+
+    print("Compiling " + str(len(buildJobs)) + " executables for " + str(cacheMisses) + " experiments")
+    if args.jobs <= 1:
+        buildResults = [CompileExperiment(*job) for job in buildJobs]
+    elif buildJobs:
+        os.makedirs(WORKERS_DIR, exist_ok=True)
+        with multiprocessing.Pool(args.jobs, initializer=InitBuildWorker, initargs=(WORKERS_DIR,)) as pool:
+            buildResults = []
+            for result in pool.imap(CompileExperimentJob, buildJobs):
+                buildResults.append(result)
+                print("[" + str(len(buildResults)) + "/" + str(len(buildJobs)) + "] " + result[0] +
+                      (" OK" if result[1] else " FAILED"))
+        shutil.rmtree(WORKERS_DIR, ignore_errors=True)
+    else:
+        buildResults = []
 
+    # A successful build is stored in the build cache and every experiment of the group gets the
+    # cached executables. If the compile failed, every experiment of the group is reported as failed.
+    for (key, names), (builtName, succeeded, message) in zip(buildGroups, buildResults):
+        if succeeded:
+            StoreInCache(key, builtName)
+            for fullExperimentName in names:
+                CheckoutFromCache(key, fullExperimentName)
+                experimentResults.append((fullExperimentName, True, ""))
+        else:
+            experimentResults.append((builtName, False, message))
+            for fullExperimentName in names[1:]:
+                experimentResults.append((fullExperimentName, False, "shares the failed build of " + builtName))
 
+    # Report every experiment that failed to build.
+    failedBuilds = [result for result in experimentResults if not result[1]]
+    print("Built " + str(len(experimentResults) - len(failedBuilds)) + " of " + str(len(experimentResults)) + " experiments")
+    print("Build cache: " + str(cacheHits) + " hits, " + str(cacheMisses) + " misses")
+    for name, succeeded, message in failedBuilds:
+        print("FAILED " + name + ": " + message)
+    if failedBuilds:
+        sys.exit(1)
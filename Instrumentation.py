@@ -0,0 +1,243 @@
+# Timing and acquisition health of a campaign.
+#
+# The journal of the campaign only records what step every experiment reached, see Campaign.py. The
+# metrics log, Experiments/campaign.metrics, records where the bench time went and how healthy the
+# acquisition was, one JSON record per line for every experiment
+#   experiment       experiment name
+#   bench            bench that ran it, if run by RunExperiments_Benches.py
+#   phases           seconds spent in every phase, see PHASES
+#   samples          readings captured
+#   samplesPerSecond readings captured per second of capture
+#   latency          statistics and histogram of the seconds every instrument read took
+#   errors           failed reads by exception type
+#   corrupt          blocks that could not be decoded
+#   dropped          blocks dropped because the pipeline buffer was full
+# When the run script ends a summary record of the whole run is appended and printed.
+
+# Used to store the metrics records.
+import json
+# Used to time the phases.
+import time
+# Used for the latency histogram bins.
+import math
+# Used to share the log between the bench workers.
+import threading
+# Used to build the default path of the log.
+import os
+
+# Name of the metrics log in the experiments root directory.
+METRICS_NAME = "campaign.metrics"
+# Phases of an experiment in the order they happen.
+#   power       the supply is set to the flash voltage and turned on
+#   jlinkScript the J-Link Commander script is written, only with the commander flasher
+#   flash       the target is flashed
+#   powerCycle  the target is powered off and on at the experiment voltage
+#   settle      the current settles
+#   capture     the readings are captured and the results closed
+#   finish      the summaries are written and the results validated
+PHASES = ["power", "jlinkScript", "flash", "powerCycle", "settle", "capture", "finish"]
+# Smallest read latency with a bin of its own in seconds, faster reads are counted in the first bin.
+LATENCY_MIN = 1E-5
+# Bins of the latency histogram per decade of latency.
+LATENCY_BINS_PER_DECADE = 5
+# Number of bins, 10us up to 100s. Slower reads are counted in the last bin.
+LATENCY_BINS = 7 * LATENCY_BINS_PER_DECADE
+
+# Adds the metrics options to a run script parser.
+def AddMetricsArguments(parser):
+    parser.add_argument("--metrics", default=None,
+                        help="metrics log (default " + METRICS_NAME + " in the experiments folder)")
+
+# Histogram of read latencies with logarithmic bins.
+class LatencyHistogram:
+    def __init__(self):
+        self.counts  = [0] * LATENCY_BINS
+        self.count   = 0
+        self.total   = 0.0
+        self.minimum = math.inf
+        self.maximum = 0.0
+
+    def Add(self, seconds):
+        if seconds <= LATENCY_MIN:
+            index = 0
+        else:
+            index = min(LATENCY_BINS - 1, int(math.log10(seconds / LATENCY_MIN) * LATENCY_BINS_PER_DECADE))
+        self.counts[index] += 1
+        self.count   += 1
+        self.total   += seconds
+        self.minimum  = min(self.minimum, seconds)
+        self.maximum  = max(self.maximum, seconds)
+
+    # Upper edge of a bin in seconds.
+    def BinEdge(self, index):
+        return LATENCY_MIN * 10 ** ((index + 1) / LATENCY_BINS_PER_DECADE)
+
+    # Upper edge of the bin holding the q quantile, 0 to 1. None if nothing was added.
+    def Quantile(self, q):
+        if self.count == 0:
+            return None
+        total = 0
+        for index, count in enumerate(self.counts):
+            total += count
+            if total > q * (self.count - 1):
+                return self.BinEdge(index)
+        return self.BinEdge(LATENCY_BINS - 1)
+
+    # Returns a dictionary with the statistics and the non empty bins as [upper edge in seconds, count].
+    def Summary(self):
+        return {"count": self.count,
+                "mean":  self.total / self.count if self.count else None,
+                "min":   self.minimum if self.count else None,
+                "max":   self.maximum if self.count else None,
+                "p50":   self.Quantile(0.5),
+                "p99":   self.Quantile(0.99),
+                "bins":  [[self.BinEdge(index), count] for index, count in enumerate(self.counts) if count]}
+
+# Health counters of one acquisition. Read is called by the thread talking to the instrument and Corrupt
+# by the thread decoding, so both can run at the same time.
+class AcquisitionHealth:
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.errors  = {}
+        self.corrupt = 0
+        self.dropped = 0
+
+    # Records the seconds one successful read took.
+    def Read(self, seconds):
+        self.latency.Add(seconds)
+
+    # Counts a failed read. Returns True for the first failure of its exception type, so only that one
+    # needs to be printed.
+    def Error(self, error):
+        name = type(error).__name__
+        self.errors[name] = self.errors.get(name, 0) + 1
+        return self.errors[name] == 1
+
+    # Counts a block that could not be decoded.
+    def Corrupt(self):
+        self.corrupt += 1
+
+# Timing and health of one experiment.
+# arg 1 experiment name
+# arg 2 bench name, None outside of RunExperiments_Benches.py
+class ExperimentMetrics:
+    def __init__(self, experimentName, bench=None):
+        self.experimentName = experimentName
+        self.bench          = bench
+        self.phases         = {}
+        self.phaseStart     = time.monotonic()
+        self.health         = AcquisitionHealth()
+        self.samples        = 0
+        self.captureSeconds = 0.0
+
+    # Records the seconds since the previous phase ended as the phase that just ended.
+    def EndPhase(self, phase):
+        now = time.monotonic()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self.phaseStart
+        self.phaseStart = now
+
+    # Moves seconds of a phase that were spent on a part of it to another phase.
+    def SplitPhase(self, phase, part, seconds):
+        if seconds:
+            self.phases[phase] = self.phases.get(phase, 0.0) - seconds
+            self.phases[part]  = self.phases.get(part, 0.0) + seconds
+
+    # Records the readings captured and the seconds the capture took.
+    def Captured(self, samples, seconds, dropped=0):
+        self.samples        = samples
+        self.captureSeconds = seconds
+        self.health.dropped = dropped
+
+    # Returns the metrics record of the experiment.
+    def Record(self):
+        health = self.health
+        record = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "experiment": self.experimentName,
+                  "phases": dict((phase, self.phases[phase]) for phase in PHASES if phase in self.phases),
+                  "samples": self.samples,
+                  "samplesPerSecond": self.samples / self.captureSeconds if self.captureSeconds > 0 else None,
+                  "latency": health.latency.Summary(), "errors": dict(health.errors),
+                  "corrupt": health.corrupt, "dropped": health.dropped}
+        if self.bench is not None:
+            record["bench"] = self.bench
+        return record
+
+# JSON lines metrics log of a campaign, appended to by every run.
+# arg 1 path of the log, created if it does not exist
+class CampaignMetrics:
+    def __init__(self, path):
+        self.path    = path
+        self.records = []
+        self.start   = time.monotonic()
+        self.lock    = threading.Lock()
+        self.file    = open(path, "a")
+
+    # Starts the metrics of an experiment.
+    def Begin(self, experimentName, bench=None):
+        return ExperimentMetrics(experimentName, bench)
+
+    # Appends the record of an experiment once it ended, whether it completed or not.
+    # Safe to call from several threads.
+    def End(self, experiment):
+        record = experiment.Record()
+        with self.lock:
+            self.file.write(json.dumps(record) + "\n")
+            self.file.flush()
+            self.records.append(record)
+
+    # Returns the summary of every experiment recorded by this run.
+    def Summary(self):
+        phases = dict((phase, sum(record["phases"].get(phase, 0.0) for record in self.records)) for phase in PHASES)
+        rates  = [(record["samplesPerSecond"], record["experiment"]) for record in self.records
+                  if record["samplesPerSecond"] is not None]
+        latencies = [record["latency"]["p99"] for record in self.records if record["latency"]["p99"] is not None]
+        errors = {}
+        for record in self.records:
+            for name, count in record["errors"].items():
+                errors[name] = errors.get(name, 0) + count
+        return {"summary":          True,
+                "time":             time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "experiments":      len(self.records),
+                "seconds":          time.monotonic() - self.start,
+                "phases":           phases,
+                "samples":          sum(record["samples"] for record in self.records),
+                "meanSamplesPerSecond": sum(rate for rate, name in rates) / len(rates) if rates else None,
+                "slowest":          min(rates)[1] if rates else None,
+                "slowestSamplesPerSecond": min(rates)[0] if rates else None,
+                "p99Latency":       max(latencies) if latencies else None,
+                "errors":           errors,
+                "corrupt":          sum(record["corrupt"] for record in self.records),
+                "dropped":          sum(record["dropped"] for record in self.records)}
+
+    # Appends the summary of the run to the log, prints it and closes the log.
+    def Close(self):
+        summary = self.Summary()
+        with self.lock:
+            self.file.write(json.dumps(summary) + "\n")
+            self.file.close()
+        PrintSummary(summary)
+
+# Opens the metrics log of a campaign from the options added by AddMetricsArguments.
+def MetricsFromArgs(args, rootDir):
+    return CampaignMetrics(args.metrics if args.metrics is not None else os.path.join(rootDir, METRICS_NAME))
+
+# Prints the summary of a run, see CampaignMetrics.Summary.
+def PrintSummary(summary):
+    if summary["experiments"] == 0:
+        return
+    print("Metrics of " + str(summary["experiments"]) + " experiments in " + "{0:.1f}".format(summary["seconds"]) + " s")
+    total = sum(summary["phases"].values())
+    for phase in PHASES:
+        seconds = summary["phases"][phase]
+        if seconds > 0:
+            print("  " + phase.ljust(12) + "{0:9.1f}".format(seconds) + " s " +
+                  "{0:5.1f}".format(100 * seconds / total if total > 0 else 0.0) + " %")
+    if summary["meanSamplesPerSecond"] is not None:
+        print("  " + str(summary["samples"]) + " samples, " + "{0:.1f}".format(summary["meanSamplesPerSecond"]) +
+              " samples/s on average, slowest " + summary["slowest"] + " at " +
+              "{0:.1f}".format(summary["slowestSamplesPerSecond"]) + " samples/s")
+    if summary["p99Latency"] is not None:
+        print("  99% of reads took less than " + "{0:.2f}".format(summary["p99Latency"] * 1000) +
+              " ms in every experiment")
+    print("  " + str(sum(summary["errors"].values())) + " failed reads" +
+          "".join(", " + str(count) + " " + name for name, count in sorted(summary["errors"].items())) + ", " +
+          str(summary["corrupt"]) + " corrupt blocks, " + str(summary["dropped"]) + " dropped blocks")
@@ -0,0 +1,245 @@
+# Instrument access shared by the run scripts.
+#
+# The run scripts open their instruments through ResourceManager instead of calling visa directly. With the
+# visa backend the real instruments on the GPIB bus are used. With the sim backend the instruments are
+# replaced by the simulated instruments of SimulatedInstruments.py, so the whole acquisition path can be
+# run and tuned without the bench.
+#
+# The Synchronizer replaces the fixed delays the run scripts used between commands. SCPI instruments are
+# asked *OPC? after every command, the multimeter status byte is polled, power changes wait for the
+# measured output voltage and captures start as soon as the measured current has settled.
+
+# Used to time the polling.
+import time
+
+# GPIB address of the HP66311B source meter used by RunExperiments_Setup1.py.
+HP66311B_ADDRESS = 'GPIB0::5::INSTR'
+# GPIB address of the HP6644A power supply used by RunExperiments_Setup2.py.
+HP6644A_ADDRESS  = 'GPIB0::14::INSTR'
+# GPIB address of the HP3457A multimeter used by both setups.
+HP3457A_ADDRESS  = 'GPIB0::22::INSTR'
+
+# Names of the backends accepted by the run scripts.
+BACKENDS = ["visa", "sim"]
+
+# Adds the options that select and configure the instrument backend to a run script parser.
+def AddBackendArguments(parser):
+    import SimulatedInstruments
+    parser.add_argument("--backend", choices=BACKENDS, default="visa",
+                        help="talk to the real instruments (visa) or to simulated ones (sim), default visa")
+    parser.add_argument("--sim-latency", type=float, default=SimulatedInstruments.DEFAULT_LATENCY,
+                        help="seconds every simulated GPIB transaction takes (default " +
+                             str(SimulatedInstruments.DEFAULT_LATENCY) + ")")
+    parser.add_argument("--sim-reading-time", type=float, default=SimulatedInstruments.DEFAULT_READING_TIME,
+                        help="seconds a simulated multimeter reading takes (default " +
+                             str(SimulatedInstruments.DEFAULT_READING_TIME) + ")")
+    parser.add_argument("--sim-corrupt", type=float, default=0.0,
+                        help="fraction of simulated reads that return corrupt data (default 0)")
+    parser.add_argument("--sim-trace", default=None,
+                        help=".results or .bresults file replayed by the simulated instruments, "
+                             "a synthetic trace is used otherwise")
+
+# Returns the resource manager used to open the instruments.
+# arg 1 "visa" or "sim"
+# arg 2 for the sim backend, the seconds every transaction takes
+# arg 3 for the sim backend, the fraction of reads that return corrupt data
+# arg 4 for the sim backend, optional recorded trace file
+# arg 5 for the sim backend, the seconds a multimeter reading takes
+# arg 6 for the sim backend, optional dictionary of GPIB address to instrument model, see
+#       SimulatedInstruments.MODELS. By default the instruments of the two setups are simulated.
+def ResourceManager(backend="visa", latency=None, corruptRate=0.0, tracePath=None, readingTime=None, models=None):
+    if backend == "visa":
+        # Only needed for the real instruments, so the simulation runs on machines without VISA.
+        import visa
+        return visa.ResourceManager()
+    import SimulatedInstruments
+    trace = SimulatedInstruments.CurrentTrace(tracePath)
+    options = {"corruptRate": corruptRate, "trace": trace}
+    if latency is not None:
+        options["latency"] = latency
+    if readingTime is not None:
+        options["readingTime"] = readingTime
+    if models is None:
+        models = {HP66311B_ADDRESS: "HP66311B", HP6644A_ADDRESS: "HP6644A", HP3457A_ADDRESS: "HP3457A"}
+    return SimulatedInstruments.SimulatedResourceManager(
+        dict((address, SimulatedInstruments.MODELS[model]) for address, model in models.items()), **options)
+
+# Returns the resource manager selected by the options added with AddBackendArguments.
+def ResourceManagerFromArgs(args, models=None):
+    return ResourceManager(args.backend, args.sim_latency, args.sim_corrupt, args.sim_trace, args.sim_reading_time,
+                           models)
+
+# Delay the run scripts originally used after every setup command, in seconds.
+COMMAND_DELAY = 0.1
+# Bit of the HP3457A serial poll status byte that is set when the multimeter is ready for instructions.
+HP3457A_READY = 0x10
+# Bit of the serial poll status byte of the SCPI power supplies that is set when an answer is ready to be read.
+SCPI_MESSAGE_AVAILABLE = 0x10
+
+# Waits until a SCPI instrument has finished every command sent to it.
+# *OPC? only answers once all pending operations are complete.
+def WaitForCompletion(instrument):
+    return instrument.query('*OPC?').strip() == '1'
+
+# Waits until the HP3457A is ready for the next instruction by polling its status byte.
+# The multimeter is not a SCPI instrument and does not understand *OPC?.
+# Returns False if the multimeter was not ready within the timeout.
+def WaitForReady(multimeter, timeout):
+    start = time.monotonic()
+    while (time.monotonic() - start) < timeout:
+        if multimeter.read_stb() & HP3457A_READY:
+            return True
+        time.sleep(0.001)
+    return False
+
+# Polls the output voltage of a power supply until it is within tolerance of the target.
+# arg 1 power supply VISA resource, HP66311B or HP6644A
+# arg 2 target voltage
+# arg 3 allowed difference in volts
+# arg 4 maximum seconds to wait
+# Returns True if the voltage reached the target within the timeout.
+def WaitForOutputVoltage(powerSupply, target, tolerance, timeout):
+    start = time.monotonic()
+    while (time.monotonic() - start) < timeout:
+        if abs(float(powerSupply.query('MEAS:VOLT?')) - target) <= tolerance:
+            return True
+    return False
+
+# Reads current from an instrument until the current has stabilized.
+# The readings are grouped in windows of settleWindow seconds. The current is stable once the mean of a
+# window differs from the mean of the previous window by less than the relative tolerance, or by less
+# than the absolute floor for very small currents. Readings taken while settling are discarded.
+# arg 1 read function of the acquisition mode, see Acquisition.py
+# arg 2 VISA resource passed to the read function
+# Returns a tuple of (True if the current settled before maxTime, seconds waited).
+def WaitForSettle(readFunction, instrument, window, tolerance, floor, minTime, maxTime):
+    start        = time.monotonic()
+    previousMean = None
+    windowStart  = start
+    windowSum    = 0.0
+    windowCount  = 0
+    while (time.monotonic() - start) < maxTime:
+        try:
+            readings = readFunction(instrument)
+        except Exception:
+            continue
+        windowSum   += sum(readings)
+        windowCount += len(readings)
+        now = time.monotonic()
+        if (now - windowStart) < window or windowCount == 0:
+            continue
+        mean = windowSum / windowCount
+        if previousMean is not None and (now - start) >= minTime:
+            if abs(mean - previousMean) <= max(tolerance * abs(previousMean), floor):
+                return (True, now - start)
+        previousMean = mean
+        windowStart  = now
+        windowSum    = 0.0
+        windowCount  = 0
+    return (False, time.monotonic() - start)
+
+# Adds the options that control instrument synchronization to a run script parser.
+def AddSyncArguments(parser):
+    parser.add_argument("--fixed-delays", action="store_true",
+                        help="use the original fixed sleeps instead of *OPC?, status and settle polling")
+    parser.add_argument("--settle-window", type=float, default=0.5,
+                        help="seconds of current averaged per settle window (default 0.5)")
+    parser.add_argument("--settle-tolerance", type=float, default=0.02,
+                        help="relative change between two windows that counts as settled (default 0.02)")
+    parser.add_argument("--settle-floor", type=float, default=1E-7,
+                        help="absolute change in amps that counts as settled for tiny currents (default 1E-7)")
+    parser.add_argument("--settle-min", type=float, default=1.0,
+                        help="minimum seconds to wait for the current to settle (default 1)")
+    parser.add_argument("--settle-max", type=float, default=5.0,
+                        help="maximum seconds to wait for the current to settle (default 5)")
+
+# Synchronizes the run scripts with the instruments.
+# With fixedDelays the original fixed sleeps are used. Otherwise every command waits for the instrument
+# to report completion, power changes wait for the measured output voltage and the capture starts once
+# the measured current has settled, so no time is spent waiting longer than needed.
+class Synchronizer:
+    def __init__(self, fixedDelays=False, settleWindow=0.5, settleTolerance=0.02, settleFloor=1E-7,
+                 settleMin=1.0, settleMax=5.0, timeout=10.0):
+        self.fixedDelays     = fixedDelays
+        self.settleWindow    = settleWindow
+        self.settleTolerance = settleTolerance
+        self.settleFloor     = settleFloor
+        self.settleMin       = settleMin
+        self.settleMax       = settleMax
+        self.timeout         = timeout
+        # Last voltage set on the power supply and the voltage the output was last turned on at, so
+        # repeated settings can be skipped. None until known.
+        self.voltage         = None
+        self.outputVoltage   = None
+
+    # Sends a command to a SCPI instrument, the power supply or source meter.
+    def Write(self, instrument, command):
+        instrument.write(command)
+        if self.fixedDelays:
+            time.sleep(COMMAND_DELAY)
+        else:
+            WaitForCompletion(instrument)
+
+    # Sends a command to the HP3457A multimeter.
+    def WriteMultimeter(self, multimeter, command):
+        multimeter.write(command)
+        if self.fixedDelays:
+            time.sleep(COMMAND_DELAY)
+        elif not WaitForReady(multimeter, self.timeout):
+            print("Multimeter not ready after " + command)
+
+    # A delay that is only needed when nothing can be polled instead.
+    def Delay(self, seconds):
+        if self.fixedDelays:
+            time.sleep(seconds)
+
+    # Sets the output voltage of the power supply. Nothing is sent if the supply is already set to it.
+    def SetVoltage(self, powerSupply, voltage):
+        if voltage == self.voltage:
+            return
+        self.Write(powerSupply, 'VOLT ' + "{0:g}".format(voltage))
+        self.voltage = voltage
+
+    # Turns the power supply output on and waits until the output reached the voltage.
+    # fixedDelay is the sleep used with fixed delays. Nothing is done if the output is already on at the
+    # voltage, so consecutive experiments at the same voltage do not wait again. With fixed delays the
+    # output is always switched on and the full delay is waited, like the original scripts did.
+    def OutputOn(self, powerSupply, voltage, fixedDelay):
+        if not self.fixedDelays and self.outputVoltage == voltage and self.voltage == voltage:
+            return
+        powerSupply.write('OUTP ON')
+        if self.fixedDelays:
+            time.sleep(fixedDelay)
+        else:
+            WaitForCompletion(powerSupply)
+            if not WaitForOutputVoltage(powerSupply, voltage, 0.02 * voltage, self.timeout):
+                print("Output did not reach " + str(voltage) + "V")
+        self.outputVoltage = voltage
+
+    # Turns the power supply output off and waits until the output is discharged.
+    def OutputOff(self, powerSupply, fixedDelay):
+        self.outputVoltage = None
+        powerSupply.write('OUTP OFF')
+        if self.fixedDelays:
+            time.sleep(fixedDelay)
+        else:
+            WaitForCompletion(powerSupply)
+            if not WaitForOutputVoltage(powerSupply, 0.0, 0.1, self.timeout):
+                print("Output did not discharge")
+
+    # Waits for the current drawn by the target to settle before the capture starts. The outcome is printed
+    # with printFunction. Returns the seconds waited.
+    def Settle(self, readFunction, instrument, fixedDelay, printFunction=print):
+        if self.fixedDelays:
+            time.sleep(fixedDelay)
+            return fixedDelay
+        settled, seconds = WaitForSettle(readFunction, instrument, self.settleWindow, self.settleTolerance,
+                                         self.settleFloor, self.settleMin, self.settleMax)
+        printFunction(("Current settled" if settled else "Current did not settle") + " after " +
+              "{0:.1f}".format(seconds) + " s")
+        return seconds
+
+# Returns the synchronizer selected by the options added with AddSyncArguments.
+def SynchronizerFromArgs(args):
+    return Synchronizer(args.fixed_delays, args.settle_window, args.settle_tolerance, args.settle_floor,
+                        args.settle_min, args.settle_max)
@@ -0,0 +1,114 @@
+#! /bin/python
+# Post processes every experiment under the Experiments root in one run.
+#
+# PostProcess_SingleFile.py handles one experiment and one output per run, so post processing a campaign
+# starts the interpreter, imports the libraries and parses the same results file once for every output of
+# every experiment. This script loads the results of every experiment once, generates every requested
+# output from them and spreads the experiments over a pool of processes.
+#
+#     python PostProcess_Batch.py ../Experiments
+#     python PostProcess_Batch.py ../Experiments --modes STATS -j 8 --voltages 3.3
+#
+# The experiments come from the experiment matrix, see ExperimentMatrix.py, and only the ones with results
+# are processed. --sets, --match and --shard select them like in the run scripts. Experiments with results
+# that are not in the matrix are listed and left out.
+#
+# Outputs newer than their results are not generated again unless --force is given. With --index the
+# statistics index of the campaign is brought up to date as well, see StatsIndex.py.
+#
+# With --archive the results are read straight from a campaign archive, see Archive.py, and the outputs are
+# written to the experiment folders under the root directory, which are created if needed.
+#     python PostProcess_Batch.py ../Outputs --archive campaign.archive --modes STATS
+
+# Used to parse the command line options.
+import argparse
+# Used to spread the experiments over several processes.
+import multiprocessing
+# Used to time the run.
+import time
+# Used to exit with an error code if an output failed.
+import sys
+
+import Campaign
+import ExperimentMatrix
+import PostProcessing
+import StatsIndex
+
+# Processes one experiment in a worker process.
+# job is (root directory, experiment name, outputs, campaign archive or None).
+def ProcessJob(job):
+    rootDir, experimentName, modes, archivePath = job
+    try:
+        return PostProcessing.ProcessExperiment(rootDir, experimentName, modes, archivePath)
+    except Exception as error:
+        return (experimentName, [], [("LOAD", type(error).__name__ + ": " + str(error))])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Post process every experiment in the experiments folder.")
+    parser.add_argument("root", help="root directory of the experiments")
+    parser.add_argument("--modes", nargs="*", choices=PostProcessing.OUTPUT_MODES, default=PostProcessing.OUTPUT_MODES,
+                        help="outputs to generate (default every output)")
+    parser.add_argument("-j", "--jobs", type=int, default=multiprocessing.cpu_count(),
+                        help="number of experiments processed at the same time (default one per CPU)")
+    parser.add_argument("--force", action="store_true",
+                        help="generate outputs even if they are newer than their results")
+    parser.add_argument("--numbers", nargs="*", default=None, help="only process these experiment numbers")
+    parser.add_argument("--voltages", nargs="*", default=None, help="only process experiments at these voltages")
+    parser.add_argument("--frequencies", nargs="*", default=None,
+                        help="only process experiments at these frequencies")
+    parser.add_argument("--index", action="store_true",
+                        help="update the statistics index of the campaign, " + StatsIndex.INDEX_NAME)
+    parser.add_argument("--archive", default=None,
+                        help="read the results from this campaign archive instead of the experiment folders")
+    # The experiments come from the matrix, --sets, --match and --shard select a part of it.
+    ExperimentMatrix.AddMatrixArguments(parser)
+    args = parser.parse_args()
+    if args.archive is not None and args.index:
+        parser.error("--index reads the experiment folders and cannot be used with --archive")
+
+    start = time.monotonic()
+    results = PostProcessing.OpenResults(args.root, args.archive)
+    # Folders of an older matrix, or renamed by hand, would otherwise be left out without a word.
+    matrixNames = ExperimentMatrix.MatrixNames(ExperimentMatrix.LoadMatrix(args.matrix))
+    unmatched   = [name for name in results.Experiments() if name not in matrixNames and results.HasResults(name)]
+    if unmatched:
+        print(str(len(unmatched)) + " experiments with results are not in " + args.matrix + " and are left out:")
+        for experimentName in unmatched:
+            print("    " + experimentName)
+    jobs = []
+    for experimentName in Campaign.SelectFromMatrix(args):
+        if not results.HasResults(experimentName):
+            continue
+        modes = [mode for mode in args.modes
+                 if args.force or not PostProcessing.IsOutputCurrent(args.root, experimentName, mode, results)]
+        if modes:
+            jobs.append((args.root, experimentName, modes, args.archive))
+    # Large experiments first so a long one does not end up last on its own.
+    jobs.sort(key=lambda job: -results.ResultsSize(job[1]))
+    results.Close()
+    print("Processing " + str(len(jobs)) + " experiments")
+
+    generated = 0
+    failures  = []
+    if jobs:
+        with multiprocessing.Pool(max(1, min(args.jobs, len(jobs)))) as pool:
+            for experimentName, done, failed in pool.imap_unordered(ProcessJob, jobs):
+                generated += len(done)
+                for mode, message in failed:
+                    failures.append(experimentName + " " + mode + ": " + message)
+                    print("FAILED " + failures[-1])
+
+    if args.index:
+        # Only the experiments whose results changed are read.
+        with multiprocessing.Pool(max(1, args.jobs)) as pool:
+            rows, recomputed, failed = StatsIndex.UpdateIndex(args.root, StatsIndex.IndexPath(args.root),
+                                                              pool.imap_unordered)
+        print("Index has " + str(len(rows)) + " experiments, " + str(len(recomputed)) + " recomputed")
+        for experimentName, message in failed:
+            failures.append(experimentName + " INDEX: " + message)
+            print("FAILED " + failures[-1])
+
+    print("Generated " + str(generated) + " outputs in " + "{0:.1f}".format(time.monotonic() - start) + " s, " +
+          str(len(failures)) + " failed")
+    if failures:
+        sys.exit(1)
@@ -0,0 +1,333 @@
+# Post processing shared by PostProcess_SingleFile.py and PostProcess_Batch.py.
+#
+# The results of an experiment are loaded once and every requested output is generated from them.
+#   PDF    plot of the readings in PDF format
+#   PNG    plot of the readings in PNG format
+#   STATS  one CSV line with the statistics of the readings
+#   EVENTS charge, energy and activity events of the capture, see Events.py
+# matplotlib is only imported when a plot is generated, so generating statistics does not pay for importing
+# the plotting libraries. Plots show the minimum and maximum of bins of readings, so their size and the
+# time taken to draw them do not grow with the capture length and spikes stay visible.
+#
+# Statistics are computed from fixed size chunks of the results, so the memory used does not depend on the
+# size of the results file, see Statistics.StreamStatistics.
+#
+# The results are read through ExperimentFolders, the folders under the experiments root, or through a
+# campaign archive, see Archive.CampaignArchive. Both have the same loading functions, the outputs are
+# always written to the experiment folders under the root directory.
+
+# Used to check which results files exist.
+import os
+# Used to read text results in chunks.
+import itertools
+# Used to read the capture summary.
+import json
+# Used to hold and process the readings.
+import numpy as np
+
+import Campaign
+import ResultsFormat
+import Statistics
+import Events
+
+# Outputs that can be generated.
+OUTPUT_MODES = ["PDF", "PNG", "STATS", "EVENTS"]
+# File extension of every output.
+OUTPUT_EXTENSIONS = {"PDF": ".pdf", "PNG": ".png", "STATS": ".stats", "EVENTS": ".events"}
+# Number of readings processed at once when results are read in chunks.
+CHUNK_READINGS    = 1 << 20
+# Number of readings averaged before plotting.
+ROLLING_POINTS    = 2
+# Readings are decimated to the minimum and maximum of this many bins before plotting, about twice the
+# width of a plot in pixels.
+PLOT_BINS         = 2000
+
+# Returns the path of an output of an experiment.
+def OutputPath(rootDir, experimentName, mode):
+    return ResultsFormat.ResultsPrefix(rootDir, experimentName) + OUTPUT_EXTENSIONS[mode]
+
+# Returns the path of the results file of an experiment that would be loaded, None if there is none.
+# If the experiment has both binary and text results, it was captured again in the other format, or the
+# text results were converted, and the newer file is used. Binary results are used if both are as old.
+def ResultsFilePath(rootDir, experimentName):
+    prefix = ResultsFormat.ResultsPrefix(rootDir, experimentName)
+    paths  = [path for path in (prefix + ResultsFormat.BINARY_EXTENSION, prefix + ".results") if os.path.exists(path)]
+    if not paths:
+        return None
+    return max(paths, key=os.path.getmtime)
+
+# Size of the results file of an experiment in bytes, 0 if it has none.
+def ResultsSize(rootDir, experimentName):
+    path = ResultsFilePath(rootDir, experimentName)
+    return os.path.getsize(path) if path is not None else 0
+
+# Loads the readings of an experiment in milliamps.
+# Binary results are memory mapped, the current column is used without reading the whole file into memory
+# first. Otherwise the text results file is parsed.
+# Returns a numpy array of the readings, None if the experiment has no results.
+def LoadCurrent(rootDir, experimentName):
+    path = ResultsFilePath(rootDir, experimentName)
+    if path is None:
+        return None
+    if path.endswith(ResultsFormat.BINARY_EXTENSION):
+        header, records = ResultsFormat.OpenBinaryResults(path)
+        # Measurements are in amps. Convert the numbers to milliamps.
+        return np.multiply(records["current"], 1000, dtype=np.float64)
+    # The results file only contains a single measurement in amps, with one entry per line.
+    return np.loadtxt(path, dtype=np.float64, ndmin=1) * 1000
+
+# Returns the time of every reading of an experiment in seconds since the start of the capture.
+# arg 1 root directory of the experiments
+# arg 2 experiment name
+# arg 3 number of readings
+# Binary results hold the time of every reading. For text results, and binary results converted from text
+# results without a time base whose times are NaN, the times are rebuilt from the .timebase file of
+# digitizer captures, or spread evenly over the capture length in the .capture summary.
+# Raises ValueError if neither exists.
+def LoadTimes(rootDir, experimentName, count):
+    path   = ResultsFilePath(rootDir, experimentName)
+    prefix = ResultsFormat.ResultsPrefix(rootDir, experimentName)
+    if path is not None and path.endswith(ResultsFormat.BINARY_EXTENSION):
+        header, records = ResultsFormat.OpenBinaryResults(path)
+        times = np.asarray(records["time"], dtype=np.float64)
+        if not np.isnan(times).all():
+            return times
+    if os.path.exists(prefix + ".timebase"):
+        # One line per sweep with its start time, the sample interval and the number of readings.
+        blocks = np.loadtxt(prefix + ".timebase", delimiter=",", ndmin=2)
+        if len(blocks) and np.all(blocks[:, 1] > 0) and int(blocks[:, 2].sum()) == count:
+            sizes  = blocks[:, 2].astype(np.int64)
+            offset = np.arange(count) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+            return np.repeat(blocks[:, 0], sizes) + offset * np.repeat(blocks[:, 1], sizes)
+    if os.path.exists(prefix + ".capture"):
+        with open(prefix + ".capture", "r") as captureFile:
+            capture = json.load(captureFile)
+        if capture.get("samples") == count and capture.get("duration"):
+            return np.arange(count) * (capture["duration"] / count)
+    raise ValueError("no time base, capture with --results-format binary to keep the time of every reading")
+
+# Returns the supply voltage of an experiment at the given times in volts.
+# If the supply output was read back during the capture the measured voltage is interpolated to the times,
+# see Acquisition.SupplyReadback. Otherwise the nominal voltage of the experiment name is returned.
+def LoadVoltage(rootDir, experimentName, times):
+    supplyPath = ResultsFormat.ResultsPrefix(rootDir, experimentName) + ".supply"
+    if os.path.exists(supplyPath) and os.path.getsize(supplyPath) > 0:
+        readback = np.loadtxt(supplyPath, delimiter=",", ndmin=2)
+        return np.interp(times, readback[:, 0], readback[:, 1])
+    return float(ResultsFormat.ParseExperimentName(experimentName)["voltage"])
+
+# Reads the readings of a results file in chunks of at most chunkSize readings.
+# Yields numpy arrays of the readings in milliamps.
+def ReadCurrentChunks(path, chunkSize=CHUNK_READINGS):
+    if path.endswith(ResultsFormat.BINARY_EXTENSION):
+        header, records = ResultsFormat.OpenBinaryResults(path)
+        for start in range(0, len(records), chunkSize):
+            yield np.multiply(records["current"][start:start + chunkSize], 1000, dtype=np.float64)
+        return
+    with open(path, "r") as results:
+        while True:
+            lines = list(itertools.islice(results, chunkSize))
+            if not lines:
+                return
+            # loadtxt skips blank lines.
+            chunk = np.loadtxt(lines, dtype=np.float64, ndmin=1)
+            if len(chunk):
+                yield chunk * 1000
+
+# Results of the experiments in their folders under the root directory, see Archive.CampaignArchive for the
+# results of an archived campaign.
+class ExperimentFolders:
+    def __init__(self, rootDir):
+        self.rootDir = rootDir
+
+    # Returns the names of the experiments matching the selection, sorted, see Campaign.FilterExperiments.
+    def Experiments(self, numbers=None, voltages=None, frequencies=None):
+        return Campaign.FilterExperiments(Campaign.ListExperiments(self.rootDir), numbers, voltages, frequencies)
+
+    def HasResults(self, experimentName):
+        return ResultsFilePath(self.rootDir, experimentName) is not None
+
+    def ResultsSize(self, experimentName):
+        return ResultsSize(self.rootDir, experimentName)
+
+    # Modification time of the results file of an experiment.
+    def ResultsTime(self, experimentName):
+        return os.path.getmtime(ResultsFilePath(self.rootDir, experimentName))
+
+    def LoadCurrent(self, experimentName):
+        return LoadCurrent(self.rootDir, experimentName)
+
+    def ReadCurrentChunks(self, experimentName):
+        return ReadCurrentChunks(ResultsFilePath(self.rootDir, experimentName))
+
+    def LoadTimes(self, experimentName, count):
+        return LoadTimes(self.rootDir, experimentName, count)
+
+    def LoadVoltage(self, experimentName, times):
+        return LoadVoltage(self.rootDir, experimentName, times)
+
+    def Close(self):
+        pass
+
+# Opens the results of a campaign.
+# arg 1 root directory of the experiments
+# arg 2 optional path of a campaign archive the results are read from instead of the experiment folders
+def OpenResults(rootDir, archivePath=None):
+    if archivePath is None:
+        return ExperimentFolders(rootDir)
+    import Archive
+    return Archive.CampaignArchive(archivePath)
+
+# Computes the statistics of chunks of readings, see Statistics.StreamStatistics.Summary.
+def ComputeStats(chunks):
+    statistics = Statistics.StreamStatistics()
+    for chunk in chunks:
+        statistics.Add(chunk)
+    return statistics.Summary()
+
+# Title of a plot, EXP#: Voltage: XXX Frequency: YYY
+def PlotTitle(experimentName):
+    expParams = ResultsFormat.ParseExperimentName(experimentName)
+    return expParams["number"] + ": " + "Voltage: " + expParams["voltage"] + " " + "Frequency: " + expParams["frequency"]
+
+# Rolling average of the readings over a window of points, computed from cumulative sums in O(n).
+# Returns len(y) - points + 1 averages, like np.convolve with mode='valid'.
+def RollingAverage(y, points):
+    sums = np.cumsum(y, dtype=np.float64)
+    sums = np.concatenate(([0.0], sums))
+    return (sums[points:] - sums[:-points]) / points
+
+# Decimates readings to the minimum and maximum of every bin, so a plot of millions of readings has about
+# as many points as the plot has pixels and still shows every spike.
+# arg 1 readings
+# arg 2 number of bins
+# Returns a tuple of (sample numbers, readings) with the minimum and maximum of every bin in the order they
+# occur, or every reading if there are fewer than two per bin.
+def MinMaxEnvelope(y, bins):
+    if len(y) <= 2 * bins:
+        return (np.arange(len(y)), y)
+    binSize = -(-len(y) // bins)
+    starts  = np.arange(0, len(y), binSize)
+    minimum = np.minimum.reduceat(y, starts)
+    maximum = np.maximum.reduceat(y, starts)
+    # Index of the minimum and maximum of every bin, to keep them in the order they occur.
+    padded  = np.pad(y, (0, len(starts) * binSize - len(y)), mode="edge").reshape(len(starts), binSize)
+    minFirst = np.argmin(padded, axis=1) <= np.argmax(padded, axis=1)
+    samples  = np.empty(2 * len(starts), dtype=np.int64)
+    values   = np.empty(2 * len(starts), dtype=y.dtype)
+    centers  = starts + binSize // 2
+    samples[0::2] = centers
+    samples[1::2] = centers
+    values[0::2]  = np.where(minFirst, minimum, maximum)
+    values[1::2]  = np.where(minFirst, maximum, minimum)
+    return (samples, values)
+
+# Plots the readings and saves the plot.
+# arg 1 readings in milliamps
+# arg 2 path of the plot
+# arg 3 "pdf" or "png"
+# arg 4 experiment name, used for the title
+def WritePlot(y, plotPath, plotFormat, experimentName):
+    # Plots are only saved, a non interactive backend avoids starting a GUI toolkit.
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    y = RollingAverage(y, ROLLING_POINTS)
+    sample, y = MinMaxEnvelope(y, PLOT_BINS)
+
+    plt.plot(sample, y, label="HP3457A", linewidth=0.5)
+    plt.ticklabel_format(axis="y", style="sci", scilimits=(0, 0))
+    plt.xlabel('Sample')
+    plt.ylabel('Current')
+    plt.title(PlotTitle(experimentName))
+    plt.legend()
+    plt.savefig(plotPath, format=plotFormat)
+    plt.close()
+
+# Writes the statistics of the readings as one CSV line, in this order
+# experiment number, MCU or SYSTEM, frequency, voltage, mean, median, mode, range, variance,
+# standard deviation, minimum, maximum
+# The median and mode are within Statistics.DEFAULT_RELATIVE_ACCURACY of the true values, the mode is the
+# most common value to that accuracy.
+def WriteStats(summary, statsPath, experimentName):
+    if summary["count"] == 0:
+        raise ValueError("no readings")
+    expParams = experimentName.split('-')
+    # Some experiments focus on just the MCU performance, while others focus on the system performance.
+    # System experiments have a configuration after the frequency.
+    fields = [expParams[0], "MCU" if len(expParams) == 3 else "SYSTEM", expParams[2], expParams[1].replace('_', '.'),
+              "{0:.4f}".format(summary["mean"]),
+              "{0:.4f}".format(summary["median"]),
+              "{0:.4f}".format(summary["mode"]),
+              "{0:.4f}".format(summary["range"]),
+              "{0:.6f}".format(summary["variance"]),
+              "{0:.6f}".format(summary["std"]),
+              "{0:.4f}".format(summary["min"]),
+              "{0:.4f}".format(summary["max"])]
+    with open(statsPath, "w") as statstream:
+        statstream.write(",".join(fields) + "\n")
+
+# Generates one output of an experiment.
+# arg 1 root directory of the experiments
+# arg 2 experiment name
+# arg 3 output, see OUTPUT_MODES
+# arg 4 readings in milliamps if they are already loaded. Otherwise plots and events load the results and
+#       statistics are computed from chunks of the results file.
+# arg 5 results the readings are loaded from, see OpenResults. The experiment folders under rootDir if None.
+def GenerateOutput(rootDir, experimentName, mode, y=None, results=None):
+    if results is None:
+        results = ExperimentFolders(rootDir)
+    outputPath = OutputPath(rootDir, experimentName, mode)
+    if mode == "STATS":
+        chunks = [y] if y is not None else results.ReadCurrentChunks(experimentName)
+        WriteStats(ComputeStats(chunks), outputPath, experimentName)
+        return
+    if y is None:
+        y = results.LoadCurrent(experimentName)
+    if mode == "EVENTS":
+        times   = results.LoadTimes(experimentName, len(y))
+        voltage = results.LoadVoltage(experimentName, times)
+        Events.WriteEvents(Events.AnalyzeEvents(times, y, voltage), outputPath, experimentName)
+        return
+    WritePlot(y, outputPath, mode.lower(), experimentName)
+
+# True if an output exists and is newer than the results it was generated from.
+# arg 4 results the readings are loaded from, see OpenResults. The experiment folders under rootDir if None.
+def IsOutputCurrent(rootDir, experimentName, mode, results=None):
+    if results is None:
+        results = ExperimentFolders(rootDir)
+    outputPath = OutputPath(rootDir, experimentName, mode)
+    return results.HasResults(experimentName) and os.path.exists(outputPath) and \
+           os.path.getmtime(outputPath) >= results.ResultsTime(experimentName)
+
+# Loads the results of an experiment once and generates every requested output.
+# arg 1 root directory of the experiments
+# arg 2 experiment name
+# arg 3 list of outputs, see OUTPUT_MODES
+# arg 4 optional path of a campaign archive the results are read from, the outputs are still written to
+#       the experiment folders under rootDir
+# Returns a tuple of (experiment name, outputs generated, list of (output, error message) that failed).
+# An experiment without results generates nothing.
+def ProcessExperiment(rootDir, experimentName, modes, archivePath=None):
+    results = OpenResults(rootDir, archivePath)
+    try:
+        if not results.HasResults(experimentName):
+            return (experimentName, [], [])
+        # Plots and events need every reading, statistics alone are computed from chunks without loading the whole file.
+        y = None
+        if any(mode != "STATS" for mode in modes):
+            y = results.LoadCurrent(experimentName)
+            if len(y) == 0:
+                return (experimentName, [], [])
+        os.makedirs(os.path.join(rootDir, experimentName), exist_ok=True)
+        generated = []
+        failed    = []
+        for mode in modes:
+            try:
+                GenerateOutput(rootDir, experimentName, mode, y, results)
+                generated.append(mode)
+            except Exception as error:
+                failed.append((mode, type(error).__name__ + ": " + str(error)))
+        return (experimentName, generated, failed)
+    finally:
+        results.Close()
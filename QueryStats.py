@@ -0,0 +1,53 @@
+#! /bin/python
+# Prints statistics from the consolidated statistics index of a campaign, see StatsIndex.py.
+#
+#     python QueryStats.py ../Experiments --update
+#     python QueryStats.py ../Experiments --numbers 05 --voltages 2.0 --x frequency --y mean
+#
+# Without --x every selected row is printed. With --x and --y one column is printed against the other,
+# sorted by the first. Only the index is read, the results are only read with --update and only for the
+# experiments whose results changed since the index was last updated.
+
+# Used to parse the command line options.
+import argparse
+# Used to exit with an error code if an experiment could not be indexed.
+import sys
+
+import StatsIndex
+
+parser = argparse.ArgumentParser(description="Query the statistics index of a campaign.")
+parser.add_argument("root", help="root directory of the experiments")
+parser.add_argument("--index", default=None,
+                    help="index file (default " + StatsIndex.INDEX_NAME + " in the experiments folder)")
+parser.add_argument("--update", action="store_true",
+                    help="bring the index up to date before the query")
+parser.add_argument("--numbers", nargs="*", default=None, help="only these experiment numbers")
+parser.add_argument("--voltages", nargs="*", default=None, help="only experiments at these voltages")
+parser.add_argument("--frequencies", nargs="*", default=None, help="only experiments at these frequencies")
+parser.add_argument("--types", nargs="*", choices=["MCU", "SYSTEM"], default=None,
+                    help="only MCU or SYSTEM experiments")
+parser.add_argument("--x", choices=StatsIndex.KEY_COLUMNS, default=None, help="column to print the statistic against")
+parser.add_argument("--y", choices=StatsIndex.STAT_COLUMNS, default="mean", help="statistic to print (default mean)")
+args = parser.parse_args()
+
+indexPath = args.index if args.index is not None else StatsIndex.IndexPath(args.root)
+failed = []
+if args.update:
+    rows, recomputed, failed = StatsIndex.UpdateIndex(args.root, indexPath)
+    print("Index has " + str(len(rows)) + " experiments, " + str(len(recomputed)) + " recomputed")
+    for experimentName, message in failed:
+        print("FAILED " + experimentName + ": " + message)
+else:
+    rows = StatsIndex.LoadIndex(indexPath)
+
+selected = StatsIndex.Query(rows, args.numbers, args.voltages, args.frequencies, args.types)
+if args.x is not None:
+    for x, y in StatsIndex.Series(selected, args.x, args.y):
+        print(str(x) + "," + str(y))
+else:
+    columns = StatsIndex.KEY_COLUMNS[:1] + StatsIndex.KEY_COLUMNS[2:5] + StatsIndex.STAT_COLUMNS
+    print(",".join(columns))
+    for row in selected:
+        print(",".join(str(row[column]) for column in columns))
+if failed:
+    sys.exit(1)
@@ -0,0 +1,244 @@
+# Writers and readers for the experiment results files.
+#
+# Two formats are supported.
+#   text:   EXP#-VOLTAGE-FREQUENCY.results, one reading in amps per line. This is the original format.
+#           In digitizer mode an EXP#-VOLTAGE-FREQUENCY.timebase file is written next to it.
+#   binary: EXP#-VOLTAGE-FREQUENCY.bresults, a small header followed by packed records. Every record
+#           holds the time of the reading in seconds since the start of the capture (float64, taken from
+#           a monotonic clock) and the reading in amps (float32). Records are written in large chunks
+#           during acquisition and the file can be opened with np.memmap without copying the data.
+#
+# Layout of a binary results file, all values little endian.
+#   8 bytes   magic "EXPRES01"
+#   4 bytes   uint32 length of the JSON header in bytes, including padding
+#   n bytes   JSON header, padded with spaces so the records start on a 16 byte boundary
+#   12 bytes  per record, float64 time followed by float32 current
+#
+# The converter turns existing text results into binary results
+#     python ResultsFormat.py ROOT_DIR [EXPERIMENT_NAME ...]
+# Without experiment names every experiment under ROOT_DIR that has a .results file is converted.
+
+# Used to build file paths and find experiments.
+import os
+# Used to pack the length of the header.
+import struct
+# Used to store the header.
+import json
+# Used to read the command line of the converter.
+import sys
+# Used to read text results in chunks.
+import itertools
+# Used to build the records of binary results.
+import numpy as np
+
+# First bytes of every binary results file.
+BINARY_MAGIC      = b"EXPRES01"
+# Extension of binary results files.
+BINARY_EXTENSION  = ".bresults"
+# Bytes of one record of a binary results file.
+BINARY_RECORD_SIZE = 12
+# Number of records buffered before a chunk is written to disk.
+CHUNK_RECORDS     = 65536
+# Layout of a record of a binary results file.
+RECORD_TYPE       = np.dtype([("time", "<f8"), ("current", "<f4")])
+# Names of the formats accepted by the run scripts.
+RESULTS_FORMATS   = ["text", "binary"]
+
+# Returns the path of a results file of an experiment without extension.
+def ResultsPrefix(rootDir, experimentName):
+    return rootDir + "/" + experimentName + "/" + experimentName
+
+# Splits an experiment name in the EXP#-VOLTAGE-FREQUENCY[-config] format into its parts.
+# Returns a dictionary with the experiment "number" (EXP#), "voltage" with a decimal point, "frequency"
+# and "config", empty strings for missing parts.
+def ParseExperimentName(experimentName):
+    expParams = experimentName.split('-')
+    return {"number":    expParams[0],
+            "voltage":   expParams[1].replace('_', '.') if len(expParams) > 1 else "",
+            "frequency": expParams[2] if len(expParams) > 2 else "",
+            "config":    "-".join(expParams[3:])}
+
+# Builds the header of a binary results file from the experiment name, following the
+# EXP#-VOLTAGE-FREQUENCY[-config] format, and the acquisition settings. settings is an optional
+# dictionary with any other sample configuration worth keeping, for example the burst size.
+def ExperimentHeader(experimentName, instrument, acquisition, sampleInterval, settings=None):
+    expParams = ParseExperimentName(experimentName)
+    return {"experiment":     experimentName,
+            "number":         expParams["number"],
+            "voltage":        expParams["voltage"],
+            "frequency":      expParams["frequency"],
+            "config":         expParams["config"],
+            "instrument":     instrument,
+            "acquisition":    acquisition,
+            "sampleInterval": sampleInterval,
+            "settings":       settings if settings is not None else {},
+            "units":          "A"}
+
+# Returns the times of the readings of a block as a numpy array.
+# If the sample interval is known the readings are spaced by it from the start of the block. Otherwise the
+# readings are spread evenly between the time the block was requested and the time it was received.
+def BlockTimes(blockStart, blockEnd, sampleInterval, count):
+    if sampleInterval > 0:
+        return blockStart + np.arange(count) * sampleInterval
+    step = (blockEnd - blockStart) / count if count else 0.0
+    return blockStart + np.arange(1, count + 1) * step
+
+# Writes readings in the original text format.
+# arg 1 path of the .results file
+# arg 2 optional path of the .timebase file. One line is written for every block of readings with the time the
+#       block was requested (seconds since the start of the acquisition), the sample interval and the
+#       number of readings in the block.
+# arg 3 time between two readings of a block in seconds, written to the timebase file.
+class TextResultsWriter:
+    def __init__(self, resultsPath, timebasePath=None, sampleInterval=0.0):
+        self.results        = open(resultsPath, 'w', 1)
+        self.timebase       = open(timebasePath, 'w') if timebasePath is not None else None
+        self.sampleInterval = sampleInterval
+
+    # Writes every reading of one block at once.
+    def WriteBlock(self, blockStart, blockEnd, readings):
+        self.WriteBlocks([(blockStart, blockEnd, readings)])
+
+    # Writes several blocks of readings at once. Each block is (start time, end time, readings).
+    def WriteBlocks(self, blocks):
+        lines    = []
+        timeLine = []
+        for blockStart, blockEnd, readings in blocks:
+            lines.extend(["{0:.6f}\n".format(reading) for reading in readings])
+            timeLine.append("{0:.6f},{1:.3e},{2}\n".format(blockStart, self.sampleInterval, len(readings)))
+        self.results.write("".join(lines))
+        if self.timebase is not None:
+            self.timebase.write("".join(timeLine))
+
+    def Close(self):
+        self.results.close()
+        if self.timebase is not None:
+            self.timebase.close()
+
+# Writes readings in the binary format.
+# arg 1 path of the .bresults file
+# arg 2 header dictionary, see ExperimentHeader
+class BinaryResultsWriter:
+    def __init__(self, path, header):
+        self.sampleInterval = header.get("sampleInterval", 0.0)
+        self.file           = open(path, 'wb')
+        # Record arrays of the blocks not written yet and their number of records.
+        self.pending        = []
+        self.pendingRecords = 0
+        headerBytes = json.dumps(header).encode()
+        # Pad the header so the records start on a 16 byte boundary.
+        padding = (-(len(BINARY_MAGIC) + 4 + len(headerBytes))) % 16
+        headerBytes += b" " * padding
+        self.file.write(BINARY_MAGIC + struct.pack("<I", len(headerBytes)) + headerBytes)
+
+    def WriteBlock(self, blockStart, blockEnd, readings):
+        self.WriteBlocks([(blockStart, blockEnd, readings)])
+
+    # Every block becomes one record array, the records are buffered and written to disk in chunks of
+    # CHUNK_RECORDS.
+    def WriteBlocks(self, blocks):
+        for blockStart, blockEnd, readings in blocks:
+            records = np.empty(len(readings), dtype=RECORD_TYPE)
+            records["time"]    = BlockTimes(blockStart, blockEnd, self.sampleInterval, len(readings))
+            records["current"] = readings
+            self.pending.append(records)
+            self.pendingRecords += len(records)
+        if self.pendingRecords >= CHUNK_RECORDS:
+            self.Flush()
+
+    # Writes a numpy record array with "time" and "current" columns in the record layout as it is.
+    def WriteRecords(self, records):
+        self.Flush()
+        self.file.write(records.tobytes())
+
+    # Writes every buffered record to disk.
+    def Flush(self):
+        if self.pending:
+            self.file.write(np.concatenate(self.pending).tobytes())
+            self.pending        = []
+            self.pendingRecords = 0
+
+    def Close(self):
+        self.Flush()
+        self.file.close()
+
+# Opens the results writer of an experiment for the run scripts.
+# arg 1 results format, "text" or "binary"
+# arg 2 root directory of the experiments
+# arg 3 experiment name
+# arg 4 name of the instrument the readings come from, stored in the binary header
+# arg 5 acquisition mode, stored in the binary header
+# arg 6 time between two readings of a block in seconds, 0 if unknown
+# arg 7 True to write a .timebase file next to text results
+# arg 8 optional dictionary of other sample settings, stored in the binary header
+def OpenResultsWriter(resultsFormat, rootDir, experimentName, instrument, acquisition, sampleInterval,
+                      timebase=False, settings=None):
+    prefix = ResultsPrefix(rootDir, experimentName)
+    if resultsFormat == "binary":
+        return BinaryResultsWriter(prefix + BINARY_EXTENSION,
+                                   ExperimentHeader(experimentName, instrument, acquisition, sampleInterval, settings))
+    return TextResultsWriter(prefix + ".results", prefix + ".timebase" if timebase else None, sampleInterval)
+
+# Reads the header of a binary results file.
+# Returns a tuple of (header dictionary, offset of the first record).
+def ReadBinaryHeader(path):
+    with open(path, 'rb') as resultsFile:
+        if resultsFile.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+            raise ValueError(path + " is not a binary results file")
+        headerLength = struct.unpack("<I", resultsFile.read(4))[0]
+        header = json.loads(resultsFile.read(headerLength).decode())
+    return (header, len(BINARY_MAGIC) + 4 + headerLength)
+
+# Opens a binary results file without copying the data.
+# Returns a tuple of (header dictionary, memory mapped record array). The columns of the record array are
+# "time" in seconds and "current" in amps.
+def OpenBinaryResults(path):
+    header, offset = ReadBinaryHeader(path)
+    count = (os.path.getsize(path) - offset) // RECORD_TYPE.itemsize
+    if count == 0:
+        return (header, np.zeros(0, dtype=RECORD_TYPE))
+    return (header, np.memmap(path, dtype=RECORD_TYPE, mode='r', offset=offset, shape=(count,)))
+
+# Converts the text results of an experiment to the binary format. If a .timebase file exists the sweep
+# start times are used for the record times, otherwise the times are unknown and stored as NaN. The text
+# results are read one sweep, or CHUNK_RECORDS readings, at a time.
+# Returns the path of the binary file or None if the experiment has no text results.
+def ConvertTextResults(rootDir, experimentName):
+    prefix = ResultsPrefix(rootDir, experimentName)
+    if not os.path.exists(prefix + ".results"):
+        return None
+    sampleInterval = 0.0
+    blocks = []
+    if os.path.exists(prefix + ".timebase"):
+        with open(prefix + ".timebase", "r") as timebase:
+            for line in timebase:
+                blockStart, interval, count = line.strip().split(",")
+                blocks.append((float(blockStart), int(count)))
+                sampleInterval = float(interval)
+    header = ExperimentHeader(experimentName, "unknown", "converted", sampleInterval)
+    writer = BinaryResultsWriter(prefix + BINARY_EXTENSION, header)
+    with open(prefix + ".results", "r") as results:
+        readings = (float(line) for line in results if line.strip())
+        if blocks:
+            for blockStart, count in blocks:
+                writer.WriteBlock(blockStart, blockStart, np.fromiter(itertools.islice(readings, count), np.float64))
+        else:
+            nan   = float("nan")
+            chunk = np.fromiter(itertools.islice(readings, CHUNK_RECORDS), np.float64)
+            while len(chunk):
+                writer.WriteBlock(nan, nan, chunk)
+                chunk = np.fromiter(itertools.islice(readings, CHUNK_RECORDS), np.float64)
+    writer.Close()
+    return prefix + BINARY_EXTENSION
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python ResultsFormat.py ROOT_DIR [EXPERIMENT_NAME ...]")
+        sys.exit(1)
+    rootDir = sys.argv[1]
+    experimentNames = sys.argv[2:] if len(sys.argv) > 2 else sorted(os.listdir(rootDir))
+    for experimentName in experimentNames:
+        if os.path.isdir(rootDir + "/" + experimentName):
+            converted = ConvertTextResults(rootDir, experimentName)
+            if converted is not None:
+                print("Converted " + experimentName)
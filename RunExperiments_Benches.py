@@ -0,0 +1,97 @@
+#! /bin/python
+# Runs the experiments of the experiment matrix on several benches at the same time.
+#
+# This script replaces running RunExperiments_Setup1.py and RunExperiments_Setup2.py one after the other.
+# The benches are read from a JSON file, Benches.json by default, see Benches.py. Every bench runs the
+# experiments it can supply the voltage of, and the sets of the matrix that name it, so a campaign takes
+# roughly as long divided by the number of benches. The options are the same as the options of the setup
+# scripts.
+
+# Used to exit after a dry run.
+import sys
+# Used to parse the command line options.
+import argparse
+# Used to interface with the many different instruments, either through VISA or simulated.
+import Instruments
+# Acquisition routines shared by every run script.
+import Acquisition
+# Writers for the results files.
+import ResultsFormat
+# Journal of the campaign and experiment selection.
+import Campaign
+# Orders the experiments and estimates the campaign duration.
+import Scheduler
+# Bench definitions and the bench workers.
+import Benches
+# Flashes the experiment executables.
+import Flasher
+# Times every phase and records the health of the acquisition.
+import Instrumentation
+# Benches the sets of the experiment matrix run on.
+import ExperimentMatrix
+
+parser = argparse.ArgumentParser(description="Run the experiments of the matrix on every bench.")
+parser.add_argument("--benches", default=Benches.DEFAULT_BENCH_FILE,
+                    help="JSON file with the bench definitions (default " + Benches.DEFAULT_BENCH_FILE + ")")
+parser.add_argument("--only", nargs="*", default=None,
+                    help="names of the benches to use (default every bench)")
+parser.add_argument("--acquisition", choices=Acquisition.ACQUISITION_MODES + ["digitizer"], default="single",
+                    help="acquisition mode, digitizer needs HP66311B benches (default single)")
+parser.add_argument("--burst-size", type=int, default=Acquisition.DEFAULT_BURST_SIZE,
+                    help="readings per burst in burst mode (default " + str(Acquisition.DEFAULT_BURST_SIZE) + ")")
+parser.add_argument("--pipeline", action="store_true",
+                    help="read and write the results on separate threads")
+parser.add_argument("--buffer-blocks", type=int, default=Acquisition.DEFAULT_BUFFER_BLOCKS,
+                    help="blocks buffered between the reader and writer threads (default " +
+                         str(Acquisition.DEFAULT_BUFFER_BLOCKS) + ")")
+parser.add_argument("--results-format", choices=ResultsFormat.RESULTS_FORMATS, default="text",
+                    help="format of the results file (default text)")
+Instruments.AddBackendArguments(parser)
+Instruments.AddSyncArguments(parser)
+Acquisition.AddCaptureArguments(parser)
+Campaign.AddCampaignArguments(parser)
+Scheduler.AddScheduleArguments(parser)
+Flasher.AddFlashArguments(parser)
+Instrumentation.AddMetricsArguments(parser)
+args = parser.parse_args()
+Acquisition.CheckCaptureArguments(parser, args)
+
+# Only the benches given with --only are used, their J-Links are checked once they are selected.
+try:
+    definitions = Benches.LoadBenches(args.benches, args.only)
+except ValueError as error:
+    parser.error(str(error))
+
+journal = Campaign.JournalFromArgs(args, "../Experiments")
+# Sets of the matrix that belong to a bench only run on that bench, see ExperimentMatrix.py.
+assignments = ExperimentMatrix.BenchAssignments(args)
+directoryList = Campaign.SelectExperiments(args, "../Experiments", journal,
+                                           [definition["name"] for definition in definitions])
+# Experiments no bench can supply the voltage of are left out.
+unsupported = [d for d in directoryList
+               if not any(Benches.CanRun(definition, d, assignments) for definition in definitions)]
+for d in unsupported:
+    print("No bench can run " + d)
+directoryList = [d for d in directoryList if d not in unsupported]
+directoryList = Scheduler.ScheduleFromArgs(args, directoryList, journal.path, None, None, args.max_seconds,
+                                           len(definitions))
+if args.dry_run:
+    for definition in definitions:
+        print(definition["name"] + ": " + str(len([d for d in directoryList if Benches.CanRun(definition, d, assignments)])) +
+              " experiments it can run")
+    journal.Close()
+    sys.exit(0)
+
+metrics = Instrumentation.MetricsFromArgs(args, "../Experiments")
+print("Connecting to " + str(len(definitions)) + " benches")
+benches, remaining = Benches.RunBenches(definitions, directoryList, args, journal, "../Experiments", metrics,
+                                        assignments)
+journal.Close()
+metrics.Close()
+
+for bench in benches:
+    print(bench.name + ": " + str(len(bench.completed)) + " experiments" + (", failed" if bench.failed else ""))
+for d in remaining:
+    print("Not run: " + d)
+if remaining or unsupported or any(bench.failed for bench in benches):
+    sys.exit(1)
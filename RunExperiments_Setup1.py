@@ -1,29 +1,90 @@
 #! /bin/python
-# Used to read files on the system.
-# and to run system shell commands.
-import os
-# Used to interface with the many different instruments. 
-import visa
-# Used to track how long an experiment collects data and also to add delays to the program.
-import time
+# Used to interface with the many different instruments, either through VISA or simulated.
+import Instruments
+# Used to parse the command line options.
+import argparse
+# Acquisition routines shared by both run scripts.
+import Acquisition
+# Writers for the results files.
+import ResultsFormat
+# Journal of the campaign and experiment selection.
+import Campaign
+# Orders the experiments and estimates the campaign duration.
+import Scheduler
+# Flashes the experiment executables.
+import Flasher
+# Steps of an experiment shared by every run script.
+import ExperimentRun
+# Times every phase and records the health of the acquisition.
+import Instrumentation
+# Used to exit after a dry run.
+import sys
+
+parser = argparse.ArgumentParser(description="Run the experiments of the matrix that run on Setup1.")
+# single transfers one reading per GPIB transaction, burst transfers a block of readings per transaction.
+# digitizer reads current sweeps from the HP66311B source meter instead of the multimeter.
+parser.add_argument("--acquisition", choices=Acquisition.ACQUISITION_MODES + ["digitizer"], default="single",
+                    help="acquisition mode (default single)")
+parser.add_argument("--burst-size", type=int, default=Acquisition.DEFAULT_BURST_SIZE,
+                    help="readings per burst in burst mode (default " + str(Acquisition.DEFAULT_BURST_SIZE) + ")")
+# Runs the acquisition with a reader thread talking to the instruments and a writer thread writing
+# the results, see Acquisition.AcquirePipelined.
+parser.add_argument("--pipeline", action="store_true",
+                    help="read and write the results on separate threads")
+parser.add_argument("--buffer-blocks", type=int, default=Acquisition.DEFAULT_BUFFER_BLOCKS,
+                    help="blocks buffered between the reader and writer threads (default " +
+                         str(Acquisition.DEFAULT_BUFFER_BLOCKS) + ")")
+# text writes the original one reading per line .results file, binary writes a .bresults file
+# with a header and a timestamp for every reading, see ResultsFormat.py.
+parser.add_argument("--results-format", choices=ResultsFormat.RESULTS_FORMATS, default="text",
+                    help="format of the results file (default text)")
+# Selects the real instruments or the simulated instruments, see Instruments.py.
+Instruments.AddBackendArguments(parser)
+# Selects *OPC? and settle polling or the original fixed delays, see Instruments.Synchronizer.
+Instruments.AddSyncArguments(parser)
+# Fixed or adaptive capture length, see Acquisition.ConvergenceMonitor.
+Acquisition.AddCaptureArguments(parser)
+# Resume a campaign from its journal and select the experiments to run, see Campaign.py.
+Campaign.AddCampaignArguments(parser)
+# Order of the experiments and dry runs, see Scheduler.py.
+Scheduler.AddScheduleArguments(parser)
+# Persistent J-Link session or one jlink process per experiment, see Flasher.py.
+Flasher.AddFlashArguments(parser)
+# Log of the time spent in every phase and the acquisition health, see Instrumentation.py.
+Instrumentation.AddMetricsArguments(parser)
+args = parser.parse_args()
+Acquisition.CheckCaptureArguments(parser, args)
 
 # The root directory for each experiment executable is located in the 
-# "Experiments" folder. 
-directoryList=os.listdir("../Experiments")
+# "Experiments" folder. Every step of every experiment is recorded in the journal of the campaign.
+journal = Campaign.JournalFromArgs(args, "../Experiments")
+# Only the sets of the matrix that run on this setup, see ExperimentMatrix.py.
+directoryList = Campaign.SelectExperiments(args, "../Experiments", journal, ["Setup1"])
+# The target is flashed at 3.3V and runs at the experiment voltage. Experiments are ordered to change the supply voltage as
+# little as possible.
+directoryList = Scheduler.ScheduleFromArgs(args, directoryList, journal.path, 3.3, None, args.max_seconds)
+if args.dry_run:
+    journal.Close()
+    sys.exit(0)
+metrics = Instrumentation.MetricsFromArgs(args, "../Experiments")
 
 # Informs the user that the script will now try and connect to the test equipment.
 print("Connecting to test equipment")
 # Create an instance of the python pyVISA object. This is required so that the installed VISA 
-# bindings can be used within python. 
-rm = visa.ResourceManager()
+# bindings can be used within python. With the sim backend the instruments are simulated.
+rm = Instruments.ResourceManagerFromArgs(args)
+# Waits for the instruments to finish each step instead of sleeping for a fixed time.
+sync = Instruments.SynchronizerFromArgs(args)
+# One J-Link connection is kept open for the whole campaign.
+flasher = Flasher.FlasherFromArgs(args)
 # The GPIB adapter that I used is assigned to GPIB0. The following assumes that your GPIB adapter
 # will also be assigned GPIB0.
 # This is an HP66311B DC source meter.
 # The source meter is fixed to be on address 5.
-powerSupply = rm.open_resource('GPIB0::5::INSTR')
+powerSupply = rm.open_resource(Instruments.HP66311B_ADDRESS)
 # HP3467A bench multimeter.
 # The multimeter is fixed to be on address 22.
-multimeter   = rm.open_resource('GPIB0::22::INSTR', read_termination='\r\n')
+multimeter   = rm.open_resource(Instruments.HP3457A_ADDRESS, read_termination='\r\n')
 
 
 
@@ -35,147 +96,65 @@ multimeter   = rm.open_resource('GPIB0::22::INSTR', read_termination='\r\n')
 # Perform power on reset sequence. The following commands will reset the source meter so that 
 # all registers are put into there power on state.
 # See user manual page 75 for more information.
-powerSupply.write('*RST')
-time.sleep(0.1)
-powerSupply.write('*CLS')
-time.sleep(0.1)
-powerSupply.write('STAT:PRES')
-time.sleep(0.1)
-powerSupply.write('*SRE 0')
-time.sleep(0.1)
-powerSupply.write('*ESE 0')
-time.sleep(0.1)
+sync.Write(powerSupply, '*RST')
+sync.Write(powerSupply, '*CLS')
+sync.Write(powerSupply, 'STAT:PRES')
+sync.Write(powerSupply, '*SRE 0')
+sync.Write(powerSupply, '*ESE 0')
 
 # Set the number of points to use for a measurement. 
 # Use full size of buffer for data measurements
-powerSupply.write('SENS:SWE:POIN 4096');
-time.sleep(0.1)
+sync.Write(powerSupply, 'SENS:SWE:POIN 4096')
 # Use the fastest sample rate
-powerSupply.write('SENS:SWE:TINT 15.6E-6');
-time.sleep(0.1)
+sync.Write(powerSupply, 'SENS:SWE:TINT 15.6E-6')
 
 
 # Setup the multimeter
-time.sleep(0.5)
+sync.Delay(0.5)
 # Puts multimeter into its default power on state.
-multimeter.write("RESET")
+sync.WriteMultimeter(multimeter, "RESET")
 # Disable multimeter beeping. 
-multimeter.write("BEEP OFF")
-time.sleep(0.1)
+sync.WriteMultimeter(multimeter, "BEEP OFF")
 #mandatory for reading from instrument
-multimeter.write("END ALWAYS") 
-time.sleep(0.1)
+sync.WriteMultimeter(multimeter, "END ALWAYS")
 # Set measurment mode to DC current. 
-multimeter.write("DCI")
-time.sleep(0.1)
+sync.WriteMultimeter(multimeter, "DCI")
 # Set the integration time to 1 cycle
-multimeter.write("NPLC 1")
-time.sleep(0.1)
+sync.WriteMultimeter(multimeter, "NPLC 1")
 # Disable auto zeroing. 
-multimeter.write("AZERO 0")
-time.sleep(0.1)
+sync.WriteMultimeter(multimeter, "AZERO 0")
 # Disable the display
-multimeter.write("DISP OFF") 
-time.sleep(0.1)
+sync.WriteMultimeter(multimeter, "DISP OFF")
 # Set output format to signed real numbers. 
-multimeter.write("OFORMAT SREAL")
-time.sleep(0.1)
+sync.WriteMultimeter(multimeter, "OFORMAT SREAL")
 
 
-time.sleep(0.1)
+sync.Delay(0.1)
 # Start measurements
 multimeter.write("TARM AUTO") 
 
-# Want to run experiments for every file in the experimental directory.
-for d in directoryList:
-    # Experiment folders have the following name format
-    # EXP#-VOLTAGE-FREQUENCY-DCDC. Split the file name and extract each part. 
-    # # these values will be used for saving experimental data 
-    # and to also setup the experiment.
-    expParams=d.split('-')
-    
-    # Extracts experiment settings
-    expNumber = expParams[0]
-    # The value for voltage will also be used to set the power supply.
-    voltage   = expParams[1].replace('_','.')
-    frequency = expParams[2]
-    print("====================================================================================================")
-    print("Experiment: " + d)
-    print("====================================================================================================")
-    # Creates a jlink script needed to flash a MSP432
-    # The following script will allow the MSP432 to be flashed with the software thats required for the specified
-    # experiment. 
-    with open('jlinkScript.jlink', 'w') as file:  # Use file to refer to the file object
-        # Use SDW interface
-        file.write('If SWD\n')
-        # SWD speed is 4k Hz
-        file.write('speed 4000\n')
-        # Connect to MSP432
-        file.write('connect\n')
-        # Reset MSP432
-        file.write('r\n')
-        # Erase flash on MSP432
-        file.write("erase\n")
-        # Flash experiment executable onto the MSP432
-        file.write("loadfile ../Experiments/" + d + "/" + d + ".srec\n")
-        # Reset the MSP432
-        file.write('r\n')
-        # Start MSP432
-        file.write('g\n')
-        # Exit flash script
-        file.write('exit\n')
+# In burst mode the multimeter only takes readings when the script triggers a burst.
+# In digitizer mode the readings come from the source meter, the multimeter is not read.
+acquisitionInstrument = multimeter
+sampleInterval        = 0.0
+if args.acquisition == "burst":
+    Acquisition.ConfigureBurst(multimeter, args.burst_size)
+    readFunction = Acquisition.ReadBurst
+elif args.acquisition == "digitizer":
+    Acquisition.ConfigureDigitizer(powerSupply, Acquisition.DIGITIZER_POINTS, Acquisition.DIGITIZER_INTERVAL)
+    readFunction          = Acquisition.ReadDigitizer
+    acquisitionInstrument = powerSupply
+    sampleInterval        = Acquisition.DIGITIZER_INTERVAL
+else:
+    readFunction = Acquisition.ReadSingle
 
-    # Set power supply voltage to 3.3V. For flashing to work, the device MUST run at 3.3V
-    powerSupply.write('VOLT 3.3')
-    # Turn on the power supply output.
-    powerSupply.write('OUTP ON')
-    # Give time for the MSP432 to power up.
-    time.sleep(5)
-    # Start flashing process for the MSP432
-    print("Flashing Target")
-    # Inform the user what experiment is being flashed to the MSP432.
-    print("Experiment: " + expParams[0] + "Voltage: " + expParams[1] + "\tFrequency: " + expParams[2])
-    # Start the jlink program through the system shell. 
-    # Two arguments are given. The first is the device, SEGGER recommends that device be provided
-    #     jlink at the command line. The second arguet is the script that was generated earlier.
-    os.system("jlink -device MSP432P401R -CommanderScript jlinkScript.jlink")
-    # Wait a few seconds after the MSP432 has been flashed. This gives some time for the system to boot up
-    # with the new firmware. 
-    time.sleep(5)
-    # Turn off the power supply.
-    powerSupply.write('OUTP OFF')
-    # Delay added to make sure that MSP432 is truly off. 
-    time.sleep(5)
-    # Set up the experiment based on the parameters.
-    print("Setting Up Experiment")
-    print("Setting up power supply")
-    # Set the power suply to the voltage requested for the experiment. 
-    powerSupply.write('VOLT ' + voltage)
-    time.sleep(0.1)
-    # Turn the power supply output on.
-    powerSupply.write('OUTP ON')
-    time.sleep(0.1)
-    print("Finished setting up power supply")
-    # Give time for the micro controller to setup. Want the micro to be in the while(1) loop when we start taking measurements.
-    time.sleep(5)
-    # Capture the time that the experiment is starting. 
-    start = time.time()
-    with open("../Experiments/" + d + '/' + d + '.results', 'w',1) as results:  # Use file to refer to the file object
-        # Keep taking measurements for 30 seconds. 
-        while (time.time() - start) < 30:
-            # Sometimes the data returned from the source meter can be corrupted. The try and except blocks make sure that 
-            # if corrupt data is received, then the system will skip. Without the try and catch the system would hard fault
-            # and the xperiment would end. 
-            try:
-                # Convert the received signed binary number to a float. Write the data to the experiments results file. 
-                results.write("{0:.6f}".format(multimeter.read_binary_values(datatype='f', is_big_endian=True,header_fmt='empty')[0]))
-                # Add a newline to the output file.
-                results.write("\n")
-            except:
-                # Inform the user that an error occured. If here then some corrupt data was received.
-                print("Exception occurred")
-    # Experiment is complete.
-    # Delay here was added arbitrarily. Just provides a few seconds between experiments.
-    time.sleep(5)
-    print("Experiment Complete")
+# Want to run experiments for every file in the experimental directory. The target is flashed at 3.3V, the
+# steps of every experiment are in ExperimentRun.py.
+for d in directoryList:
+    ExperimentRun.RunExperiment(d, args, "../Experiments", journal, metrics, sync, flasher, powerSupply,
+                                acquisitionInstrument, readFunction, sampleInterval, 3.3, {"nplc": 1})
 
+flasher.Close()
+journal.Close()
+# Prints where the time went and the health of every acquisition.
+metrics.Close()
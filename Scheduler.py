@@ -0,0 +1,138 @@
+# Orders the experiments of a campaign to save bench time and estimates how long the campaign takes.
+#
+# Every experiment flashes the target at the flash voltage and then runs at the experiment voltage. The
+# power supply only has to be set to a new voltage, and the output only has to wait for it, when the
+# voltage differs from the one before. The plan runs every experiment at the flash voltage first, one
+# after the other without touching the supply, and then the other experiments grouped by voltage.
+# Within a group the experiments are ordered by number, frequency and configuration.
+#
+# The time of every step of an experiment comes from the campaign journal, see Campaign.py. Experiments
+# that ran before are estimated from their own history, the others from the average of every experiment,
+# or from default step times if the journal is empty.
+#
+# With --dry-run the plan and the estimate are printed and the script exits without touching the
+# instruments.
+
+# Used to find the journal.
+import os
+# Used to read the journal records.
+import json
+
+# Names of the orders accepted by the run scripts.
+ORDERS = ["plan", "name"]
+# Seconds of every step of an experiment used when the journal has no history.
+DEFAULT_STEP_SECONDS = {"flashed": 12.0, "settled": 8.0, "validated": 0.5}
+
+# Adds the scheduling options to a run script parser.
+def AddScheduleArguments(parser):
+    parser.add_argument("--order", choices=ORDERS, default="plan",
+                        help="run the experiments in the planned order or sorted by name (default plan)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="print the plan and the estimated duration without running anything")
+
+# Returns the voltage an experiment runs at, from its name or fixed by the setup.
+def ExperimentVoltage(experimentName, fixedVoltage=None):
+    if fixedVoltage is not None:
+        return fixedVoltage
+    return float(experimentName.split('-')[1].replace('_', '.'))
+
+# Sort key of an experiment in the plan.
+def PlanKey(experimentName, flashVoltage, fixedVoltage=None):
+    voltage   = ExperimentVoltage(experimentName, fixedVoltage)
+    expParams = experimentName.split('-')
+    return (voltage != flashVoltage, voltage, expParams[0], "-".join(expParams[2:]))
+
+# Returns the experiments in the planned order.
+# arg 1 experiment names
+# arg 2 voltage the target is flashed at, None if it is flashed at the experiment voltage
+# arg 3 voltage every experiment runs at, None if it comes from the experiment name
+def PlanOrder(experimentNames, flashVoltage, fixedVoltage=None):
+    if flashVoltage is None:
+        return sorted(experimentNames, key=lambda d: PlanKey(d, ExperimentVoltage(d, fixedVoltage), fixedVoltage))
+    return sorted(experimentNames, key=lambda d: PlanKey(d, flashVoltage, fixedVoltage))
+
+# Counts the voltage changes and power cycles of running the experiments in the given order.
+# Returns a tuple of (voltage changes, power cycles).
+def CountTransitions(experimentNames, flashVoltage, fixedVoltage=None):
+    changes = 0
+    current = None
+    for experimentName in experimentNames:
+        voltage = ExperimentVoltage(experimentName, fixedVoltage)
+        for setting in (flashVoltage if flashVoltage is not None else voltage, voltage):
+            if setting != current:
+                changes += 1
+                current  = setting
+    # The target is powered off and on again after every flash.
+    return (changes, len(experimentNames))
+
+# Collects the step times recorded in a campaign journal.
+# Returns a tuple of (dictionary of step to list of seconds, dictionary of experiment to its last
+# dictionary of step to seconds).
+def StepHistory(journalPath):
+    steps       = {}
+    experiments = {}
+    if not os.path.exists(journalPath):
+        return (steps, experiments)
+    with open(journalPath, "r") as journalFile:
+        for line in journalFile:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if "stepSeconds" not in record:
+                continue
+            steps.setdefault(record["state"], []).append(record["stepSeconds"])
+            experiments.setdefault(record["experiment"], {})[record["state"]] = record["stepSeconds"]
+    return (steps, experiments)
+
+# Estimates the seconds an experiment takes.
+# arg 1 experiment name
+# arg 2 step history returned by StepHistory
+# arg 3 seconds captured when there is no history, the longest capture
+def EstimateSeconds(experimentName, history, captureSeconds):
+    steps, experiments = history
+    own = experiments.get(experimentName, {})
+    total = 0.0
+    for step, default in list(DEFAULT_STEP_SECONDS.items()) + [("captured", captureSeconds)]:
+        if step in own:
+            total += own[step]
+        elif steps.get(step):
+            total += sum(steps[step]) / len(steps[step])
+        else:
+            total += default
+    return total
+
+# Formats seconds as hours, minutes and seconds.
+def FormatDuration(seconds):
+    seconds = int(round(seconds))
+    return "{0}:{1:02d}:{2:02d}".format(seconds // 3600, (seconds // 60) % 60, seconds % 60)
+
+# Orders the experiments selected by a run script and prints the plan.
+# arg 1 parsed options, see AddScheduleArguments
+# arg 2 experiment names, in any order. --order name and the name order figure of the plan sort them.
+# arg 3 path of the campaign journal with the step history
+# arg 4 voltage the target is flashed at, None if it is flashed at the experiment voltage
+# arg 5 voltage every experiment runs at, None if it comes from the experiment name
+# arg 6 seconds captured when there is no history
+# arg 7 number of benches running the experiments at the same time
+# Returns the experiments in the order they should run.
+def ScheduleFromArgs(args, experimentNames, journalPath, flashVoltage, fixedVoltage, captureSeconds, benches=1):
+    byName  = sorted(experimentNames)
+    ordered = PlanOrder(experimentNames, flashVoltage, fixedVoltage) if args.order == "plan" else byName
+    history = StepHistory(journalPath)
+    total   = 0.0
+    for experimentName in ordered:
+        seconds = EstimateSeconds(experimentName, history, captureSeconds)
+        total  += seconds
+        if args.dry_run:
+            print("{0:<40} {1:>6.1f} s  ends at {2}".format(experimentName, seconds, FormatDuration(total)))
+    changes, cycles = CountTransitions(ordered, flashVoltage, fixedVoltage)
+    unordered, _    = CountTransitions(byName, flashVoltage, fixedVoltage)
+    print(str(len(ordered)) + " experiments, " + str(changes) + " voltage changes (" + str(unordered) +
+          " in name order), " + str(cycles) + " power cycles")
+    if benches > 1:
+        print("Estimated campaign duration " + FormatDuration(total / benches) + " on " + str(benches) +
+              " benches, " + FormatDuration(total) + " on one")
+    else:
+        print("Estimated campaign duration " + FormatDuration(total))
+    return ordered
@@ -0,0 +1,274 @@
+# Simulated versions of the bench instruments so the acquisition path can be tested and tuned without
+# the physical bench.
+#
+# The simulated instruments accept the same commands the run scripts send over GPIB and answer reads the way
+# the real instruments do.
+#   HP3457A  multimeter, single readings (TARM AUTO, END ALWAYS) and bursts (NRDGS n, TARM SGL, END ON),
+#            SREAL output.
+#   HP66311B source meter, output control and readback, digitizer sweeps (SENS:SWE:POIN/TINT, INIT:NAME ACQ, TRIG:ACQ, FETC:ARR:CURR?)
+#            returned as IEEE 488.2 blocks of REAL,32.
+#   HP6644A  power supply, output control and MEAS:VOLT?/MEAS:CURR? readback, several queries can be sent
+#            in one message separated by semicolons.
+#
+# Every transaction with an instrument waits for a configurable latency, multimeter readings take a
+# configurable time each, and a configurable fraction of the reads return corrupt data. The current
+# returned comes from a CurrentTrace, either synthetic or recorded from an earlier experiment.
+
+# Used to wait for the simulated instrument latency.
+import time
+# Used to add noise to the synthetic trace and to pick reads to corrupt.
+import random
+# Used to pack readings into the instrument output formats.
+import struct
+
+# Default time a GPIB transaction takes in seconds.
+DEFAULT_LATENCY      = 0.002
+# Default time the multimeter takes for one reading in seconds.
+DEFAULT_READING_TIME = 0.0005
+
+# Current drawn by the simulated target over time.
+# arg 1 optional path of a .results or .bresults file. The readings of the file are replayed in a loop,
+#       one reading per readingInterval seconds. Without a file a synthetic trace is used, a sleep current
+#       with noise and a short active burst at a fixed period, like the timed read experiments.
+# arg 2 time between two recorded readings in seconds, only used for recorded traces.
+class CurrentTrace:
+    def __init__(self, recordedPath=None, readingInterval=DEFAULT_READING_TIME, seed=0):
+        self.random          = random.Random(seed)
+        self.readingInterval = readingInterval
+        self.recorded        = LoadTrace(recordedPath) if recordedPath is not None else None
+        # Synthetic trace settings, all currents in amps and times in seconds.
+        self.sleepCurrent    = 0.0009
+        self.activeCurrent   = 0.020
+        self.noise           = 0.00002
+        self.period          = 0.5
+        self.activeTime      = 0.005
+        self.start           = time.monotonic()
+
+    # Current at t seconds after the trace started.
+    def Value(self, t):
+        if self.recorded is not None:
+            return self.recorded[int(t / self.readingInterval) % len(self.recorded)]
+        current = self.activeCurrent if (t % self.period) < self.activeTime else self.sleepCurrent
+        return current + self.random.gauss(0.0, self.noise)
+
+    # count readings spaced interval seconds apart, starting at t.
+    def Values(self, t, interval, count):
+        return [self.Value(t + i * interval) for i in range(count)]
+
+    # Seconds since the trace started.
+    def Now(self):
+        return time.monotonic() - self.start
+
+# Loads the readings of a recorded .results or .bresults file as a list of amps.
+def LoadTrace(path):
+    if path.endswith(".bresults"):
+        import ResultsFormat
+        header, records = ResultsFormat.OpenBinaryResults(path)
+        readings = [float(value) for value in records["current"]]
+    else:
+        with open(path, "r") as results:
+            readings = [float(line) for line in results if line.strip()]
+    if not readings:
+        raise ValueError(path + " has no readings")
+    return readings
+
+# Behaviour shared by every simulated instrument.
+# arg 1 seconds every transaction takes
+# arg 2 fraction of reads that return corrupt data, 0 to 1
+# arg 3 CurrentTrace the instrument measures
+# arg 4 seconds a single reading takes
+class SimulatedInstrument:
+    def __init__(self, latency=DEFAULT_LATENCY, corruptRate=0.0, trace=None, readingTime=DEFAULT_READING_TIME, seed=0):
+        self.latency     = latency
+        self.readingTime = readingTime
+        self.corruptRate = corruptRate
+        self.trace       = trace if trace is not None else CurrentTrace(seed=seed)
+        self.random      = random.Random(seed)
+        self.commands    = []
+        self.timeout     = 2000
+
+    # Waits for the latency of one transaction.
+    def Transaction(self, extraTime=0.0):
+        if self.latency + extraTime > 0:
+            time.sleep(self.latency + extraTime)
+
+    # True if the next read should return corrupt data.
+    def Corrupt(self):
+        return self.corruptRate > 0 and self.random.random() < self.corruptRate
+
+    def write(self, command):
+        self.Transaction()
+        self.commands.append(command)
+        self.Command(command.strip())
+
+    # Handles a command, overridden by each instrument.
+    def Command(self, command):
+        pass
+
+    def read_raw(self, size=None):
+        raise IOError("instrument has no data to read")
+
+    # Serial poll. The simulated instruments are always ready for the next instruction.
+    def read_stb(self):
+        self.Transaction()
+        return 0x10
+
+    def read(self):
+        return self.read_raw().decode().strip()
+
+    def query(self, command):
+        self.write(command)
+        return self.read()
+
+    # Decodes a raw read the way pyvisa does for the formats used by the run scripts.
+    def read_binary_values(self, datatype='f', is_big_endian=False, header_fmt='ieee', **kwargs):
+        raw = self.read_raw()
+        if header_fmt == 'ieee':
+            digits = int(raw[1:2])
+            length = int(raw[2:2 + digits])
+            raw    = raw[2 + digits:2 + digits + length]
+        if len(raw) % 4 != 0 or len(raw) == 0:
+            raise ValueError("binary data of " + str(len(raw)) + " bytes")
+        return list(struct.unpack((">" if is_big_endian else "<") + str(len(raw) // 4) + datatype, raw))
+
+    def query_binary_values(self, command, datatype='f', is_big_endian=False, header_fmt='ieee', **kwargs):
+        self.write(command)
+        return self.read_binary_values(datatype=datatype, is_big_endian=is_big_endian, header_fmt=header_fmt)
+
+    def close(self):
+        pass
+
+# Simulated HP3457A multimeter.
+class SimulatedHP3457A(SimulatedInstrument):
+    def __init__(self, **kwargs):
+        SimulatedInstrument.__init__(self, **kwargs)
+        self.arm         = "AUTO"
+        self.readings    = 1
+        self.armed       = False
+
+    def Command(self, command):
+        words = command.upper().split()
+        if not words:
+            return
+        if words[0] == "TARM" and len(words) > 1:
+            self.arm   = words[1]
+            self.armed = words[1] == "SGL"
+        elif words[0] == "NRDGS" and len(words) > 1:
+            self.readings = int(words[1].split(",")[0])
+        elif words[0] == "RESET":
+            self.arm      = "AUTO"
+            self.readings = 1
+
+    # A single reading in TARM AUTO, or every reading of an armed burst in TARM SGL.
+    def read_raw(self, size=None):
+        if self.arm == "AUTO":
+            count = 1
+        elif self.armed:
+            count = self.readings
+            self.armed = False
+        else:
+            # The real multimeter would time out waiting for a trigger.
+            self.Transaction()
+            raise IOError("VI_ERROR_TMO: multimeter was not triggered")
+        self.Transaction(count * self.readingTime)
+        raw = struct.pack(">" + str(count) + "f",
+                          *self.trace.Values(self.trace.Now(), self.readingTime, count))
+        if self.Corrupt():
+            raw = raw[:-1]
+        return raw
+
+# Simulated HP66311B source meter with its digitizer.
+class SimulatedHP66311B(SimulatedInstrument):
+    def __init__(self, **kwargs):
+        SimulatedInstrument.__init__(self, **kwargs)
+        self.points   = 4096
+        self.interval = 15.6E-6
+        self.sweep    = None
+        self.pending  = None
+        self.voltage  = 0.0
+        self.output   = False
+
+    # A message can hold several commands separated by semicolons, the answers of its queries are returned
+    # in one line separated by semicolons.
+    def Command(self, command):
+        if ";" in command:
+            answers = []
+            for part in command.split(";"):
+                self.pending = None
+                self.Command(part.strip().lstrip(":"))
+                if self.pending is not None:
+                    answers.append(self.pending)
+            self.pending = ";".join(answers) if answers else None
+            return
+        upper = command.upper()
+        if upper.startswith("SENS:SWE:POIN"):
+            self.points = int(float(upper.split()[1]))
+        elif upper.startswith("SENS:SWE:TINT"):
+            self.interval = float(upper.split()[1])
+        elif upper.startswith("TRIG:ACQ") and not upper.startswith("TRIG:ACQ:"):
+            # The sweep starts now and takes points * interval seconds.
+            self.sweep = self.trace.Now()
+        elif upper.startswith("FETC:ARR:CURR?"):
+            self.pending = "SWEEP"
+        elif upper.startswith("VOLT") and len(upper.split()) > 1:
+            self.voltage = float(upper.split()[1])
+        elif upper.startswith("OUTP") and len(upper.split()) > 1:
+            self.output = upper.split()[1] in ("ON", "1")
+        elif upper.startswith("*OPC?"):
+            self.pending = "1"
+        elif upper.startswith("MEAS:VOLT?"):
+            self.pending = "{0:.6f}".format(self.voltage if self.output else 0.0)
+        elif upper.startswith("MEAS:CURR?"):
+            self.pending = "{0:.9f}".format(self.trace.Value(self.trace.Now()) if self.output else 0.0)
+
+    def read_raw(self, size=None):
+        pending, self.pending = self.pending, None
+        if pending is None:
+            self.Transaction()
+            raise IOError("VI_ERROR_TMO: query was not sent")
+        if pending != "SWEEP":
+            self.Transaction()
+            return (pending + "\n").encode()
+        start = self.sweep if self.sweep is not None else self.trace.Now()
+        # FETC waits until the sweep is complete.
+        remaining = start + self.points * self.interval - self.trace.Now()
+        self.Transaction(max(remaining, 0.0))
+        data = struct.pack(">" + str(self.points) + "f", *self.trace.Values(start, self.interval, self.points))
+        length = str(len(data))
+        raw = ("#" + str(len(length)) + length).encode() + data + b"\n"
+        if self.Corrupt():
+            raw = raw[:len(raw) // 2]
+        return raw
+
+# Simulated HP6644A power supply. It has the same output control and readback as the HP66311B
+# but no digitizer.
+class SimulatedHP6644A(SimulatedHP66311B):
+    def Command(self, command):
+        upper = command.upper()
+        if upper.startswith("SENS:SWE") or upper.startswith("TRIG:ACQ") or upper.startswith("FETC:ARR"):
+            return
+        SimulatedHP66311B.Command(self, command)
+
+# Simulated instrument class of every instrument model.
+MODELS = {"HP3457A":  SimulatedHP3457A,
+          "HP66311B": SimulatedHP66311B,
+          "HP6644A":  SimulatedHP6644A}
+
+# Stand in for visa.ResourceManager that opens simulated instruments.
+# arg 1 dictionary of GPIB address to simulated instrument class
+# arg 2 keyword arguments passed to every simulated instrument
+class SimulatedResourceManager:
+    def __init__(self, instrumentTypes, **options):
+        self.instrumentTypes = instrumentTypes
+        self.options         = options
+
+    def open_resource(self, address, **kwargs):
+        if address not in self.instrumentTypes:
+            raise IOError("no simulated instrument at " + address)
+        return self.instrumentTypes[address](**self.options)
+
+    def list_resources(self):
+        return tuple(self.instrumentTypes.keys())
+
+    def close(self):
+        pass
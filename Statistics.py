@@ -0,0 +1,202 @@
+# Running statistics shared by the acquisition and the post processing.
+#
+# RunningStats keeps the count, mean, variance, minimum and maximum of a stream of readings without
+# storing the readings. Blocks of readings are added with a numerically stable one pass update, and two
+# RunningStats can be merged, so statistics of chunks computed separately can be combined.
+#
+# QuantileSketch estimates the median, percentiles and mode of a stream of readings in bounded memory.
+# Readings are counted in logarithmic buckets, every bucket covers values within a fixed relative
+# accuracy of each other, so any quantile it returns is within that relative accuracy of a reading at
+# that rank. The number of buckets only depends on the range of the readings, not on how many there are.
+#
+# StreamStatistics combines both and is what the .stats files are computed with.
+
+# Used for the square root and infinity.
+import math
+# Used for the normal distribution quantiles of confidence intervals.
+import statistics
+
+# Count, mean, variance, minimum and maximum of a stream of readings.
+class RunningStats:
+    def __init__(self):
+        self.count   = 0
+        self.mean    = 0.0
+        # Sum of the squared differences from the mean.
+        self.m2      = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    # Adds a block of readings. The block statistics are computed first and then merged, which is
+    # both faster and more stable than adding the readings one by one.
+    def Add(self, readings):
+        count = len(readings)
+        if count == 0:
+            return
+        mean = math.fsum(readings) / count
+        m2   = math.fsum([(reading - mean) ** 2 for reading in readings])
+        self.MergeValues(count, mean, m2, min(readings), max(readings))
+
+    # Adds a numpy array of readings, the vectorized version of Add for large chunks.
+    def AddArray(self, values):
+        import numpy as np
+        count = len(values)
+        if count == 0:
+            return
+        mean = float(np.mean(values, dtype=np.float64))
+        m2   = float(np.sum(np.square(values - mean, dtype=np.float64)))
+        self.MergeValues(count, mean, m2, float(np.min(values)), float(np.max(values)))
+
+    # Adds the statistics of another RunningStats.
+    def Merge(self, other):
+        self.MergeValues(other.count, other.mean, other.m2, other.minimum, other.maximum)
+
+    # Merges the statistics of a block of count readings (Chan et al. parallel variance).
+    def MergeValues(self, count, mean, m2, minimum, maximum):
+        if count == 0:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean    += delta * count / total
+        self.m2      += m2 + delta * delta * self.count * count / total
+        self.count    = total
+        self.minimum  = min(self.minimum, minimum)
+        self.maximum  = max(self.maximum, maximum)
+
+    # Population variance, the same as np.var.
+    def Variance(self):
+        return self.m2 / self.count if self.count else 0.0
+
+    # Sample variance, used for confidence intervals.
+    def SampleVariance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def StandardDeviation(self):
+        return math.sqrt(self.Variance())
+
+    def Range(self):
+        return self.maximum - self.minimum if self.count else 0.0
+
+# Returns the two sided normal quantile of a confidence level, 1.96 for 0.95.
+def ConfidenceQuantile(confidence):
+    return statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+
+# Default relative accuracy of the quantiles of a QuantileSketch.
+DEFAULT_RELATIVE_ACCURACY = 0.0005
+# Default magnitude below which a reading is counted as zero by a QuantileSketch.
+DEFAULT_MIN_VALUE         = 1E-9
+
+# Mergeable quantile estimate of a stream of readings.
+# arg 1 relative accuracy of the estimates, 0.0005 returns values within 0.05% of the true reading
+# arg 2 readings with a smaller magnitude are counted as 0
+class QuantileSketch:
+    def __init__(self, relativeAccuracy=DEFAULT_RELATIVE_ACCURACY, minValue=DEFAULT_MIN_VALUE):
+        self.relativeAccuracy = relativeAccuracy
+        self.minValue         = minValue
+        self.gamma            = (1 + relativeAccuracy) / (1 - relativeAccuracy)
+        self.logGamma         = math.log(self.gamma)
+        # Bucket index to count, for positive readings and for the magnitude of negative readings.
+        self.positive         = {}
+        self.negative         = {}
+        self.zero             = 0
+        self.count            = 0
+
+    # Adds a block of readings, a list or numpy array. Readings that are not finite are ignored.
+    def Add(self, values):
+        import numpy as np
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        magnitude = np.abs(values)
+        self.zero  += int(np.count_nonzero(magnitude < self.minValue))
+        self.count += len(values)
+        for store, selected in ((self.positive, values >= self.minValue), (self.negative, values <= -self.minValue)):
+            if not selected.any():
+                continue
+            keys = np.ceil(np.log(magnitude[selected]) / self.logGamma).astype(np.int64)
+            buckets, counts = np.unique(keys, return_counts=True)
+            for key, count in zip(buckets.tolist(), counts.tolist()):
+                store[key] = store.get(key, 0) + count
+
+    # Adds the readings counted by another QuantileSketch with the same accuracy.
+    def Merge(self, other):
+        if other.gamma != self.gamma or other.minValue != self.minValue:
+            raise ValueError("sketches with different accuracies can not be merged")
+        for store, otherStore in ((self.positive, other.positive), (self.negative, other.negative)):
+            for key, count in otherStore.items():
+                store[key] = store.get(key, 0) + count
+        self.zero  += other.zero
+        self.count += other.count
+
+    # Value that represents a bucket, within the relative accuracy of every reading in it.
+    def BucketValue(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    # Buckets as (value, count) from the smallest to the largest value.
+    def Buckets(self):
+        buckets  = [(-self.BucketValue(key), self.negative[key]) for key in sorted(self.negative, reverse=True)]
+        if self.zero:
+            buckets.append((0.0, self.zero))
+        buckets += [(self.BucketValue(key), self.positive[key]) for key in sorted(self.positive)]
+        return buckets
+
+    # Estimate of the q quantile, 0 to 1. NaN if no readings were added.
+    def Quantile(self, q):
+        if self.count == 0:
+            return math.nan
+        rank  = q * (self.count - 1)
+        total = 0
+        for value, count in self.Buckets():
+            total += count
+            if total > rank:
+                return value
+        return self.Buckets()[-1][0]
+
+    # The most common value, the value of the bucket holding the most readings. NaN if there are none.
+    def Mode(self):
+        buckets = self.Buckets()
+        if not buckets:
+            return math.nan
+        return max(buckets, key=lambda bucket: bucket[1])[0]
+
+# Count, mean, variance, minimum, maximum and quantiles of a stream of readings, added in chunks.
+# The minimum and maximum are exact, the median, mode and percentiles come from a QuantileSketch.
+class StreamStatistics:
+    def __init__(self, relativeAccuracy=DEFAULT_RELATIVE_ACCURACY, minValue=DEFAULT_MIN_VALUE):
+        self.moments = RunningStats()
+        self.sketch  = QuantileSketch(relativeAccuracy, minValue)
+
+    # Adds a chunk of readings, a list or numpy array.
+    def Add(self, values):
+        import numpy as np
+        values = np.asarray(values, dtype=np.float64)
+        self.moments.AddArray(values)
+        self.sketch.Add(values)
+
+    def Merge(self, other):
+        self.moments.Merge(other.moments)
+        self.sketch.Merge(other.sketch)
+
+    # Histogram of the readings in bins of equal width between the minimum and the maximum, computed from
+    # the sketch so every reading is counted within the relative accuracy of the sketch.
+    # Returns a dictionary with the bin edges and the count of every bin, both empty if there are no readings.
+    def Histogram(self, bins):
+        import numpy as np
+        buckets = self.sketch.Buckets()
+        if not buckets:
+            return {"edges": [], "counts": []}
+        values = np.clip([value for value, count in buckets], self.moments.minimum, self.moments.maximum)
+        counts, edges = np.histogram(values, bins, range=(self.moments.minimum, self.moments.maximum),
+                                     weights=[count for value, count in buckets])
+        return {"edges": edges.tolist(), "counts": counts.astype(np.int64).tolist()}
+
+    # Returns a dictionary of the statistics written to the .stats files plus the count.
+    def Summary(self):
+        moments = self.moments
+        return {"count":    moments.count,
+                "mean":     moments.mean,
+                "median":   self.sketch.Quantile(0.5),
+                "mode":     self.sketch.Mode(),
+                "range":    moments.Range(),
+                "variance": moments.Variance(),
+                "std":      moments.StandardDeviation(),
+                "min":      moments.minimum,
+                "max":      moments.maximum}
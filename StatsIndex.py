@@ -0,0 +1,148 @@
+# Consolidated statistics of a campaign.
+#
+# Every experiment writes its .stats file into its own folder, so comparing experiments means reading one
+# tiny file per experiment. The index is a single CSV table, Experiments/campaign_stats.csv, with one row
+# per experiment holding the experiment parameters, the statistics of its readings and the size,
+# modification time and sha256 checksum of the results file the statistics were computed from.
+#
+# Updating the index only recomputes the experiments whose results changed. A results file with the same
+# size and modification time is taken as unchanged without reading it. If the size or modification time
+# changed the checksum decides, so copying or touching results does not recompute them.
+#
+# The index loads in one read and is queried without touching the results, for example the mean current
+# against frequency of EXP05 at 2.0 V
+#     rows = StatsIndex.Query(StatsIndex.LoadIndex(path), numbers=["05"], voltages=["2.0"])
+#     StatsIndex.Series(rows, "frequency", "mean")
+
+# Used to build file paths.
+import os
+# Used to read and write the index.
+import csv
+
+import Campaign
+import PostProcessing
+import ResultsFormat
+
+# Name of the index file in the experiments root directory.
+INDEX_NAME = "campaign_stats.csv"
+# Columns identifying an experiment.
+KEY_COLUMNS = ["experiment", "number", "type", "frequency", "voltage", "config"]
+# Columns holding statistics, see Statistics.StreamStatistics.Summary.
+STAT_COLUMNS = ["count", "mean", "median", "mode", "range", "variance", "std", "min", "max"]
+# Columns describing the results file the statistics were computed from.
+SOURCE_COLUMNS = ["file", "bytes", "mtime", "checksum"]
+COLUMNS = KEY_COLUMNS + STAT_COLUMNS + SOURCE_COLUMNS
+
+# Returns the default path of the index of a campaign.
+def IndexPath(rootDir):
+    return os.path.join(rootDir, INDEX_NAME)
+
+# Loads the index. Returns a dictionary of experiment name to row, empty if there is no index yet.
+# Statistics are converted to numbers, the experiment parameters are kept as strings.
+def LoadIndex(path):
+    rows = {}
+    if not os.path.exists(path):
+        return rows
+    with open(path, "r", newline="") as indexFile:
+        for row in csv.DictReader(indexFile):
+            for column in STAT_COLUMNS + ["bytes", "mtime"]:
+                row[column] = float(row[column])
+            row["count"] = int(row["count"])
+            row["bytes"] = int(row["bytes"])
+            rows[row["experiment"]] = row
+    return rows
+
+# Writes the index sorted by experiment name. The file is replaced only once it is complete.
+def SaveIndex(rows, path):
+    with open(path + ".tmp", "w", newline="") as indexFile:
+        writer = csv.DictWriter(indexFile, fieldnames=COLUMNS)
+        writer.writeheader()
+        for experimentName in sorted(rows):
+            row = dict(rows[experimentName])
+            for column in STAT_COLUMNS + ["mtime"]:
+                row[column] = repr(row[column])
+            writer.writerow(row)
+    os.replace(path + ".tmp", path)
+
+# True if the row of an experiment was computed from a results file with this size and modification time.
+def IsRowCurrent(row, resultsPath):
+    return row is not None and row["file"] == os.path.basename(resultsPath) and \
+           row["bytes"] == os.path.getsize(resultsPath) and row["mtime"] == os.path.getmtime(resultsPath)
+
+# Computes the index row of an experiment from its results file.
+# arg 1 tuple of (root directory, experiment name, row in the index or None), so it can run in a pool
+# Returns a tuple of (experiment name, new row, True if the statistics were recomputed).
+# Raises ValueError if the results have no readings.
+def ComputeRow(job):
+    rootDir, experimentName, previous = job
+    resultsPath = PostProcessing.ResultsFilePath(rootDir, experimentName)
+    checksum    = Campaign.FileChecksum(resultsPath)
+    source = {"file": os.path.basename(resultsPath), "bytes": os.path.getsize(resultsPath),
+              "mtime": os.path.getmtime(resultsPath), "checksum": checksum}
+    if previous is not None and previous["file"] == source["file"] and previous["checksum"] == checksum:
+        row = dict(previous)
+        row.update(source)
+        return (experimentName, row, False)
+    summary = PostProcessing.ComputeStats(PostProcessing.ReadCurrentChunks(resultsPath))
+    if summary["count"] == 0:
+        raise ValueError("no readings")
+    expParams = ResultsFormat.ParseExperimentName(experimentName)
+    row = {"experiment": experimentName, "number": expParams["number"],
+           "type": "SYSTEM" if expParams["config"] else "MCU",
+           "frequency": expParams["frequency"], "voltage": expParams["voltage"], "config": expParams["config"]}
+    row.update((column, summary[column]) for column in STAT_COLUMNS)
+    row.update(source)
+    return (experimentName, row, True)
+
+# ComputeRow that returns (experiment name, None, error message) instead of raising, for use in a pool.
+def ComputeRowSafe(job):
+    try:
+        return ComputeRow(job)
+    except Exception as error:
+        return (job[1], None, type(error).__name__ + ": " + str(error))
+
+# Brings the index of a campaign up to date and saves it.
+# arg 1 root directory of the experiments
+# arg 2 path of the index
+# arg 3 function used to compute the rows, map or the imap_unordered of a multiprocessing pool
+# Returns a tuple of (rows, names of the experiments recomputed, list of (experiment, error message)).
+# Experiments without results are dropped from the index.
+def UpdateIndex(rootDir, path, mapFunction=map):
+    rows    = LoadIndex(path)
+    results = dict((name, PostProcessing.ResultsFilePath(rootDir, name)) for name in Campaign.ListExperiments(rootDir))
+    for experimentName in list(rows):
+        if results.get(experimentName) is None:
+            del rows[experimentName]
+    jobs = [(rootDir, name, rows.get(name)) for name, resultsPath in sorted(results.items())
+            if resultsPath is not None and not IsRowCurrent(rows.get(name), resultsPath)]
+    recomputed = []
+    failed     = []
+    for experimentName, row, changed in mapFunction(ComputeRowSafe, jobs):
+        if row is None:
+            failed.append((experimentName, changed))
+            rows.pop(experimentName, None)
+            continue
+        rows[experimentName] = row
+        if changed:
+            recomputed.append(experimentName)
+    SaveIndex(rows, path)
+    return (rows, sorted(recomputed), failed)
+
+# Returns the rows of the index matching the selection, sorted by experiment name. None selects everything.
+# numbers, voltages and frequencies are matched like the --numbers, --voltages and --frequencies options,
+# types is a list of MCU and SYSTEM.
+def Query(rows, numbers=None, voltages=None, frequencies=None, types=None):
+    selected = Campaign.FilterExperiments(sorted(rows), numbers, voltages, frequencies)
+    return [rows[name] for name in selected if types is None or rows[name]["type"] in types]
+
+# Sort key of an experiment parameter. Numeric values such as frequencies and voltages are sorted as
+# numbers, before any other values such as LF.
+def NumericSortKey(value):
+    try:
+        return (0, float(value), "")
+    except ValueError:
+        return (1, 0.0, str(value))
+
+# Returns a list of (x, y) pairs of two columns of the rows, sorted by x, see NumericSortKey.
+def Series(rows, xColumn, yColumn):
+    return sorted(((row[xColumn], row[yColumn]) for row in rows), key=lambda pair: NumericSortKey(pair[0]))